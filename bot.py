@@ -1,19 +1,45 @@
+import asyncio
+import base64
+import contextvars
+import csv
+import functools
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
 import logging
+import math
+import multiprocessing
 import pathlib
 import json
 import random
 import os
+import pickle
+import re
+import resource
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Any, Coroutine
 
 import mysql.connector
 from dotenv import load_dotenv
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 from telegram import (
+    Bot,
     Update,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
     InlineKeyboardButton,
-    InlineKeyboardMarkup
+    InlineKeyboardMarkup,
+    InputMediaPhoto
 )
 from telegram.ext import (
     Application,
@@ -22,9 +48,33 @@ from telegram.ext import (
     CallbackQueryHandler,
     ContextTypes,
     ConversationHandler,
+    ApplicationHandlerStop,
+    BasePersistence,
+    PersistenceInput,
+    TypeHandler,
     filters
 )
-from datetime import datetime
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+try:
+    import openpyxl
+except ImportError:  # XLSX-импорт необязателен
+    openpyxl = None
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+except ImportError:  # графики аналитики необязательны
+    pyplot = None
+
+try:
+    import qrcode
+except ImportError:  # без qrcode админ получает только ссылку для отметки
+    qrcode = None
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -46,43 +96,1541 @@ ROLE_STUDENT = 'student'
 ROLE_TUTOR = 'tutor'
 ROLE_ADMIN = 'admin'
 
+# Календарь мероприятий
+EVENTS_PAGE_SIZE = 10
+CALENDAR_CACHE_LIMIT = int(os.getenv('CALENDAR_CACHE_LIMIT', '100'))
+CALENDAR_CACHE_TTL = int(os.getenv('CALENDAR_CACHE_TTL', '600'))
+# Отметка по ссылке /start checkin_...: ключ подписи и сколько часов после начала ссылка действует
+CHECKIN_SECRET = os.getenv('CHECKIN_SECRET') or f"checkin:{os.getenv('BOT_TOKEN', '')}"
+CHECKIN_LINK_HOURS = int(os.getenv('CHECKIN_LINK_HOURS', '6'))
+CHECKIN_PREFIX = 'checkin_'
+
+# Подключение к БД: таймауты, повторы и автомат защиты
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '3'))  # секунды
+DB_RETRY_ATTEMPTS = int(os.getenv('DB_RETRY_ATTEMPTS', '1'))
+DB_RETRY_BASE_DELAY = 0.1  # секунды
+DB_BREAKER_THRESHOLD = int(os.getenv('DB_BREAKER_THRESHOLD', '3'))
+DB_BREAKER_COOLDOWN = float(os.getenv('DB_BREAKER_COOLDOWN', '15'))  # секунды
+# Пул соединений с основной БД (0 — без пула, соединение на каждый запрос)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+# Нет соединения, соединение потеряно, слишком много соединений, таймаут блокировки, дедлок
+TRANSIENT_DB_ERRORS = {2003, 2006, 2013, 1040, 1205, 1213}
+DB_UNAVAILABLE_TEXT = (
+    "⚠️ Ой! Не удалось подключиться к базе данных.\n"
+    "Попробуйте позже или обратитесь к администратору."
+)
+# Хранилище: mysql (по умолчанию) или встроенная sqlite для локального запуска и небольших установок
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'bot.db')
+SQLITE_BUSY_TIMEOUT = 5  # секунды ожидания блокировки записи
+# Реплики только для чтения: DB_REPLICA_HOSTS=host1,host2:3307
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+# Сколько секунд после записи чтения пользователя идут в основную БД
+DB_STICKY_SECONDS = float(os.getenv('DB_STICKY_SECONDS', '5'))
+
+# Защита от флуда: (скорость пополнения в секунду, запас) для каждого вида запросов
+FLOOD_LIMITS = {
+    'command': (float(os.getenv('FLOOD_COMMAND_RATE', '0.5')), int(os.getenv('FLOOD_COMMAND_BURST', '5'))),
+    'text': (float(os.getenv('FLOOD_TEXT_RATE', '1')), int(os.getenv('FLOOD_TEXT_BURST', '10'))),
+    'callback': (float(os.getenv('FLOOD_CALLBACK_RATE', '2')), int(os.getenv('FLOOD_CALLBACK_BURST', '10'))),
+}
+FLOOD_DUPLICATE_WINDOW = float(os.getenv('FLOOD_DUPLICATE_WINDOW', '1'))  # секунды
+FLOOD_WARNING_INTERVAL = 10
+FLOOD_MAX_USERS = 50000
+FLOOD_WARNING_TEXT = "⏳ Слишком много запросов. Подождите немного и попробуйте снова."
+
+# Многопроцессный режим: приёмник вебхука раздаёт апдейты WORKERS воркерам по chat_id
+WORKERS = int(os.getenv('WORKERS', '1'))
+WORKER_INDEX = 0
+SHARED_POLL_INTERVAL = 5  # секунды, как часто воркер сверяет общие счётчики
+
+# Проверки живости и готовности (GET /healthz, /readyz) и плавная остановка по SIGTERM
+HEALTH_LISTEN = os.getenv('HEALTH_LISTEN', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8089'))  # 0 — без HTTP-проверок
+HEALTH_INTERVAL = 5  # секунды между проверками БД и задержки цикла событий
+HEALTH_MAX_LOOP_LAG = float(os.getenv('HEALTH_MAX_LOOP_LAG', '1'))  # секунды
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '20'))  # секунды на сохранение рассылок при остановке
+
+# Несколько ботов (факультетов) в одном процессе: BOT_TENANTS=fmf,ipmkn.
+# Для каждого — BOT_TOKEN_<ИМЯ>, своя схема DB_NAME_<ИМЯ> (или файл SQLITE_PATH_<ИМЯ>)
+# и необязательный CHECKIN_SECRET_<ИМЯ>. Пул БД и клиенты Bot API общие
+BOT_TENANTS = [name.strip() for name in os.getenv('BOT_TENANTS', '').split(',') if name.strip()]
+TENANT_UPDATE_RATE = float(os.getenv('TENANT_UPDATE_RATE', '0'))  # апдейтов в секунду на бота, 0 — без лимита
+TENANT_UPDATE_BURST = int(os.getenv('TENANT_UPDATE_BURST', '100'))
+
+# Состояние пользователей в памяти: простой, после которого оно сбрасывается, и общий лимит
+STATE_IDLE_TTL = int(os.getenv('STATE_IDLE_TTL', '86400'))  # секунды
+STATE_MAX_USERS = int(os.getenv('STATE_MAX_USERS', '5000'))
+STATE_SWEEP_INTERVAL = 300  # секунды
+# Сохранение user_data и состояний диалогов в БД, чтобы перезапуск был незаметен
+STATE_PERSISTENCE = os.getenv('STATE_PERSISTENCE', '1') == '1'
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '5'))  # секунды
+
+# База вопросов
+FAQ_ENTRIES = [
+    {"question": "Как изменить номер телефона?", "answer": "Напишите команду /start и следуйте инструкциям."},
+    {"question": "Как узнать свои баллы?", "answer": "Нажмите кнопку `📊 Мои баллы` в главном меню."},
+    {"question": "Кому писать по вопросам мероприятий?", "answer": "Обратитесь к вашему тьютору или администратору."}
+]
+FAQ_STEM_LENGTH = 5
+FAQ_MIN_SCORE = float(os.getenv('FAQ_MIN_SCORE', '0.5'))  # доля совпавшего «веса» вопроса
+
+TUTOR_DIRECTORY_TTL = int(os.getenv('TUTOR_DIRECTORY_TTL', '600'))  # секунды, подхват правок tutor_groups в БД
+# Аналитика посещаемости: сколько последних мероприятий в отчёте и на графике, длина списков
+ANALYTICS_EVENTS = 10
+ANALYTICS_LIST_LIMIT = 50
+# Архивация: сколько дней строки живут в рабочих таблицах и как часто их переносить
+ARCHIVE_EVENTS_DAYS = int(os.getenv('ARCHIVE_EVENTS_DAYS', '180'))  # после даты мероприятия
+ARCHIVE_FAQ_DAYS = int(os.getenv('ARCHIVE_FAQ_DAYS', '90'))  # отвеченные вопросы
+ARCHIVE_SKS_DAYS = int(os.getenv('ARCHIVE_SKS_DAYS', '90'))  # решённые заявки СКС
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '21600'))  # секунды, 0 — только вручную
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_PAUSE = 0.1  # секунды между пачками
+ARCHIVE_QUERY_LIMIT = 20
+# Журнал действий: как часто дописывать в БД, размер пачки и предел очереди в памяти
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '2'))  # секунды
+AUDIT_BATCH_SIZE = 200
+AUDIT_MAX_PENDING = 10000
+AUDIT_QUERY_LIMIT = 20
+
+# Массовые отправки и напоминания
+BULK_RATE = float(os.getenv('BULK_RATE', '25'))  # сообщений в секунду (лимит Telegram ~30)
+# Отдельные пулы соединений с Bot API: ответы в меню и массовые отправки
+INTERACTIVE_CONCURRENCY = int(os.getenv('INTERACTIVE_CONCURRENCY', '64'))
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '8'))
+BULK_YIELD_MAX = float(os.getenv('BULK_YIELD_MAX', '5'))  # секунды, сколько массовая отправка уступает ответам
+SKS_INBOX_PAGE_SIZE = 5
+ROSTER_BATCH_SIZE = 1000
+ROSTER_SPOOL_SIZE = 1024 * 1024  # байт файла импорта в памяти, остальное — во временном файле
+POINTS_BATCH_SIZE = 500
+TUTOR_DIGEST_WINDOW = float(os.getenv('TUTOR_DIGEST_WINDOW', '30'))  # секунды
+TUTOR_DIGEST_MAX_QUESTIONS = 20
+REMINDER_OFFSETS = [int(x) for x in os.getenv('EVENT_REMINDER_OFFSETS', '1440,60').split(',') if x.strip()]  # минуты
+
+
+# Ограниченный по размеру кэш с истечением записей (LRU)
+class ExpiringCache:
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() > expires_at:
+            del self.entries[key]
+            return None
+        return value
+
+    def forget(self, key):
+        self.entries.pop(key, None)
+
+    def remember(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+# Бот-тенант: токен, своя БД и счётчики. Текущий тенант хранится в TENANT
+# и наследуется задачами, созданными при запуске его приложения
+class Tenant:
+    def __init__(self, name: str, token, db_name, sqlite_path: str, checkin_secret: str):
+        self.name = name
+        self.token = token
+        self.db_name = db_name
+        self.sqlite_path = sqlite_path
+        self.checkin_secret = checkin_secret
+        self.updates = 0
+        self.limited = 0
+        self.tokens = float(TENANT_UPDATE_BURST)
+        self.updated = time.monotonic()
+
+    @classmethod
+    def from_env(cls, name: str):
+        suffix = name.upper()
+        token = os.getenv(f'BOT_TOKEN_{suffix}')
+        return cls(
+            name,
+            token,
+            os.getenv(f'DB_NAME_{suffix}', f"{os.getenv('DB_NAME')}_{name}"),
+            os.getenv(f'SQLITE_PATH_{suffix}', f"bot_{name}.db"),
+            os.getenv(f'CHECKIN_SECRET_{suffix}') or f"checkin:{token}"
+        )
+
+    # Общий лимит апдейтов бота, чтобы один факультет не занял весь процесс
+    def allow(self) -> bool:
+        self.updates += 1
+        if TENANT_UPDATE_RATE <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(TENANT_UPDATE_BURST, self.tokens + (now - self.updated) * TENANT_UPDATE_RATE)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.limited += 1
+        return False
+
+    def metrics(self):
+        return {'updates': self.updates, 'limited': self.limited}
+
+
+DEFAULT_TENANT = Tenant('default', os.getenv('BOT_TOKEN'), os.getenv('DB_NAME'), SQLITE_PATH, CHECKIN_SECRET)
+TENANTS = [Tenant.from_env(name) for name in BOT_TENANTS]
+TENANT = contextvars.ContextVar('tenant', default=DEFAULT_TENANT)
+
+
+def current_tenant() -> Tenant:
+    return TENANT.get()
+
+
+# Отдельный экземпляр объекта на каждого тенанта; атрибуты берутся у экземпляра
+# текущего тенанта, поэтому код, обращающийся к синглтону, не меняется
+class TenantLocal:
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instances', {})
+
+    def local(self):
+        name = current_tenant().name
+        instance = self._instances.get(name)
+        if instance is None:
+            instance = self._instances[name] = self._factory()
+        return instance
+
+    def instances(self):
+        return list(self._instances.values())
+
+    def __getattr__(self, name):
+        return getattr(self.local(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.local(), name, value)
+
+
+# Счётчики поколений общих данных для многопроцессного режима: воркер, изменивший
+# мероприятия или базу ответов, увеличивает счётчик, остальные при расхождении
+# перечитывают свою копию. В одном процессе счётчики не подключены и всегда 0
+class SharedGenerations:
+    NAMES = ('events', 'faq', 'tutors')
+
+    def __init__(self):
+        self.counters = None
+
+    def attach(self, counters):
+        self.counters = counters
+
+    def bump(self, name: str):
+        if self.counters is not None:
+            with self.counters.get_lock():
+                self.counters[self.NAMES.index(name)] += 1
+
+    def current(self, name: str) -> int:
+        if self.counters is None:
+            return 0
+        return self.counters[self.NAMES.index(name)]
+
+
+GENERATIONS = SharedGenerations()
+
+
+# Telegram-аккаунты, не найденные в users (сбрасывается при регистрации)
+UNKNOWN_SENDERS = TenantLocal(lambda: ExpiringCache(
+    ttl=int(os.getenv('UNKNOWN_SENDER_TTL', '300')),
+    max_size=int(os.getenv('UNKNOWN_SENDER_CACHE_SIZE', '20000'))
+))
+
+
+# Защита от флуда: токен-бакеты на пользователя, отдельно для команд, текста и кнопок.
+# Срабатывает до всех обработчиков, поэтому лишние запросы не доходят до БД.
+class FloodGuard:
+    def __init__(self, limits, duplicate_window: float, max_users: int):
+        self.limits = limits
+        self.duplicate_window = duplicate_window
+        self.max_users = max_users
+        self.users = OrderedDict()
+
+    # Возвращает 'ok', 'duplicate', 'limited' (нужно предупредить) или 'quiet'
+    def check(self, user_id: int, kind: str, payload) -> str:
+        now = time.monotonic()
+        state = self.users.get(user_id)
+        if state is None:
+            state = {'buckets': {}, 'last': (None, 0.0), 'warned': 0.0}
+            self.users[user_id] = state
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+
+        last_payload, last_time = state['last']
+        state['last'] = (payload, now)
+        if payload is not None and payload == last_payload and now - last_time < self.duplicate_window:
+            return 'duplicate'
+
+        rate, burst = self.limits[kind]
+        tokens, updated = state['buckets'].get(kind, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            state['buckets'][kind] = (tokens - 1, now)
+            return 'ok'
+        state['buckets'][kind] = (tokens, now)
+        if now - state['warned'] >= FLOOD_WARNING_INTERVAL:
+            state['warned'] = now
+            return 'limited'
+        return 'quiet'
+
+
+FLOOD_GUARD = TenantLocal(lambda: FloodGuard(FLOOD_LIMITS, FLOOD_DUPLICATE_WINDOW, FLOOD_MAX_USERS))
+
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    CURRENT_USER_ID.set(user.id if user else None)
+    if not user:
+        return
+    if update.callback_query:
+        kind, payload = 'callback', update.callback_query.data
+    elif update.message and update.message.text:
+        text = update.message.text
+        kind, payload = ('command' if text.startswith('/') else 'text'), text
+    else:
+        kind, payload = 'text', None
+
+    verdict = FLOOD_GUARD.check(user.id, kind, payload)
+    if verdict == 'ok':
+        return
+    if update.callback_query:
+        await update.callback_query.answer(FLOOD_WARNING_TEXT if verdict == 'limited' else None)
+    elif verdict == 'limited' and update.effective_message:
+        await update.effective_message.reply_text(FLOOD_WARNING_TEXT)
+    raise ApplicationHandlerStop
+
+
+# user_data без мусора: флаги, сброшенные в False/None, не хранятся вовсе
+class UserState(dict):
+    def __setitem__(self, key, value):
+        if value is None or value is False:
+            self.pop(key, None)
+        else:
+            super().__setitem__(key, value)
+
+
+# Состояния диалога по ключу (chat_id, user_id). Публичного API для чтения, подгрузки и сброса
+# состояния одного пользователя в PTB нет, поэтому используется приватный TrackingDict:
+# версия PTB закреплена в requirements.txt, форму словаря проверяет tests/test_state.py
+def conversation_states(handler: ConversationHandler):
+    return handler._conversations
+
+
+# Ограничение памяти под состояние: user_data и состояния диалогов сбрасываются
+# у пользователей, молчащих дольше STATE_IDLE_TTL, и у самых давних сверх STATE_MAX_USERS
+class StateSweeper:
+    def __init__(self, idle_ttl: float, max_users: int, interval: float):
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.interval = interval
+        self.last_seen = OrderedDict()
+        self.evicted = 0
+        self.application = None
+        self.task = None
+
+    def touch(self, user_id: int):
+        self.last_seen[user_id] = time.monotonic()
+        self.last_seen.move_to_end(user_id)
+        while len(self.last_seen) > self.max_users:
+            self.evict(next(iter(self.last_seen)))
+
+    def conversation_handlers(self):
+        return [
+            handler
+            for handlers in self.application.handlers.values()
+            for handler in handlers
+            if isinstance(handler, ConversationHandler)
+        ]
+
+    def evict(self, user_id: int):
+        self.last_seen.pop(user_id, None)
+        # Последние изменения уходят в БД, оттуда состояние подгрузится при возвращении
+        if PERSISTENCE:
+            PERSISTENCE.release(user_id)
+        self.application.drop_user_data(user_id)
+        for handler in self.conversation_handlers():
+            states = conversation_states(handler)
+            for key in [key for key in states if key[-1] == user_id]:
+                del states[key]
+        self.evicted += 1
+
+    def sweep(self):
+        deadline = time.monotonic() - self.idle_ttl
+        idle = []
+        for user_id, seen_at in self.last_seen.items():
+            if seen_at > deadline:
+                break
+            idle.append(user_id)
+        for user_id in idle:
+            self.evict(user_id)
+        # user_data без активности (например, оставшиеся с прошлого запуска)
+        for user_id in [user_id for user_id in self.application.user_data if user_id not in self.last_seen]:
+            self.evict(user_id)
+        if idle:
+            logger.info(f"Сброшено состояние {len(idle)} неактивных пользователей, в памяти: {len(self.last_seen)}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sweep()
+
+    def start(self, application: Application):
+        self.application = application
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def report(self) -> str:
+        user_data = self.application.user_data
+        conversations = sum(len(conversation_states(handler)) for handler in self.conversation_handlers())
+        keys = sum(len(data) for data in user_data.values())
+        size = sum(len(pickle.dumps(dict(data))) for data in user_data.values())
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return (
+            "🧠 Память бота:\n"
+            f"• Активных пользователей: {len(self.last_seen)} (лимит {self.max_users})\n"
+            f"• user_data: {len(user_data)} записей, {keys} ключей, ~{size / 1024:.1f} КБ\n"
+            f"• Состояний диалогов: {conversations}\n"
+            f"• Сброшено с запуска: {self.evicted}\n"
+            f"• Пиковый RSS процесса: {peak_rss:.1f} МБ"
+        )
+
+
+STATE_SWEEPER = TenantLocal(lambda: StateSweeper(STATE_IDLE_TTL, STATE_MAX_USERS, STATE_SWEEP_INTERVAL))
+
+
+# Тенант апдейта и общий лимит бота — самая первая группа обработчиков
+async def tenant_guard(tenant: Tenant, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    TENANT.set(tenant)
+    if not tenant.allow():
+        raise ApplicationHandlerStop
+
+
+# Отметка активности пользователя — раньше антифлуда, чтобы учитывались все апдейты
+async def track_user_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        STATE_SWEEPER.touch(update.effective_user.id)
+        if PERSISTENCE:
+            PERSISTENCE.load_user(update.effective_user.id, context)
+
+
+# Автомат защиты БД: после DB_BREAKER_THRESHOLD неудач подряд обращения к БД
+# сразу отклоняются на DB_BREAKER_COOLDOWN секунд, затем пропускается одна проба
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.cooldown
+
+    def success(self):
+        if self.state != self.CLOSED:
+            logger.info("Подключение к БД восстановлено")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.error(f"БД недоступна, запросы отклоняются на {self.cooldown:.0f} с")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+DB_BREAKER = CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_COOLDOWN)
+
+
+def is_transient_db_error(error) -> bool:
+    return isinstance(error, Error) and error.errno in TRANSIENT_DB_ERRORS
+
+
+def mysql_settings(**kwargs):
+    return dict(
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=current_tenant().db_name,
+        connection_timeout=DB_CONNECT_TIMEOUT,
+        **kwargs
+    )
+
 
-# Подключение к БД
-def get_db_connection():
+def mysql_connect(**kwargs):
+    return mysql.connector.connect(**mysql_settings(**kwargs))
+
+
+DB_POOL = None
+DB_POOL_LOCK = threading.Lock()
+
+
+# Соединение с основной БД из пула; пул создаётся (и сразу открывает все соединения)
+# при первом обращении. Если пул занят целиком — отдельное соединение.
+# Пул общий для всех тенантов: схема тенанта выбирается USE при каждой выдаче
+def primary_connect():
+    global DB_POOL
+    if DB_POOL_SIZE > 0:
+        with DB_POOL_LOCK:
+            if DB_POOL is None:
+                DB_POOL = pooling.MySQLConnectionPool(
+                    pool_name='primary', pool_size=DB_POOL_SIZE, **mysql_settings(host=os.getenv('DB_HOST'))
+                )
+        try:
+            connection = DB_POOL.get_connection()
+        except PoolError:
+            logger.warning("Пул соединений с БД занят, открываю отдельное соединение")
+        else:
+            if TENANTS:
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute(f"USE `{current_tenant().db_name}`")
+                    cursor.close()
+                except Error:
+                    connection.close()
+                    raise
+            return connection
+    return mysql_connect(host=os.getenv('DB_HOST'))
+
+
+# Вызов из цикла событий: там пауза между повторами остановила бы всех пользователей
+def on_event_loop() -> bool:
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+# Подключение к основной БД. В цикле событий — одна попытка без пауз,
+# повторы только в отдельном потоке (см. db_connection)
+def connect_primary():
+    if not DB_BREAKER.allow():
+        return None
+    attempts = 0 if on_event_loop() else DB_RETRY_ATTEMPTS
+    for attempt in range(attempts + 1):
+        try:
+            connection = primary_connect()
+            DB_BREAKER.success()
+            return connection
+        except Error as e:
+            logger.error(f"Ошибка подключения к БД: {e}")
+            DB_BREAKER.failure()
+            if not is_transient_db_error(e) or attempt == attempts or not DB_BREAKER.allow():
+                return None
+            # Экспоненциальная пауза со случайным разбросом
+            time.sleep(random.uniform(0, DB_RETRY_BASE_DELAY * 2 ** attempt))
+    return None
+
+
+# Реплики для чтения; упавшая реплика пропускается на время DB_BREAKER_COOLDOWN
+class ReplicaPool:
+    def __init__(self, hosts, cooldown: float):
+        self.hosts = hosts
+        self.cooldown = cooldown
+        self.down_until = {}
+
+    def available(self):
+        now = time.monotonic()
+        return [host for host in self.hosts if self.down_until.get(host, 0) <= now]
+
+    def connect(self):
+        candidates = self.available()
+        random.shuffle(candidates)
+        for host in candidates:
+            name, _, port = host.partition(':')
+            try:
+                return mysql_connect(host=name, port=int(port or 3306))
+            except Error as e:
+                logger.warning(f"Реплика {host} недоступна: {e}")
+                self.down_until[host] = time.monotonic() + self.cooldown
+        return None
+
+
+REPLICAS = ReplicaPool(DB_REPLICA_HOSTS, DB_BREAKER_COOLDOWN)
+# Пользователи, недавно писавшие в БД: их чтения идут в основную БД
+RECENT_WRITERS = TenantLocal(lambda: ExpiringCache(ttl=DB_STICKY_SECONDS, max_size=20000))
+# Telegram id пользователя, чей апдейт сейчас обрабатывается
+CURRENT_USER_ID = contextvars.ContextVar('current_user_id', default=None)
+
+
+# Соединение с разделением чтения и записи: SELECT уходит на реплику, всё
+# остальное — в основную БД. После первой записи соединение и пользователь
+# «прилипают» к основной БД, чтобы видеть собственные изменения
+class RoutedConnection:
+    def __init__(self):
+        self.primary = None
+        self.replica = None
+        self.wrote = False
+
+    def get_primary(self):
+        if self.primary is None:
+            self.primary = connect_primary()
+            if self.primary is None:
+                raise Error(msg="Основная БД недоступна")
+        return self.primary
+
+    def route(self, sql: str):
+        statement = sql.lstrip().upper()
+        is_read = statement.startswith('SELECT') and 'FOR UPDATE' not in statement
+        user_id = CURRENT_USER_ID.get()
+        if is_read and not self.wrote and (user_id is None or RECENT_WRITERS.get(user_id) is None):
+            if self.replica is None:
+                self.replica = REPLICAS.connect()
+            if self.replica is not None:
+                return self.replica
+        if not is_read:
+            self.wrote = True
+            if user_id is not None:
+                RECENT_WRITERS.remember(user_id, True)
+        return self.get_primary()
+
+    def cursor(self, **kwargs):
+        return RoutedCursor(self, kwargs)
+
+    def commit(self):
+        if self.primary is not None:
+            self.primary.commit()
+
+    def rollback(self):
+        if self.primary is not None:
+            self.primary.rollback()
+
+    def close(self):
+        for connection in (self.primary, self.replica):
+            if connection is not None:
+                connection.close()
+
+
+# Курсор, который открывается на том соединении, куда ушёл последний запрос
+class RoutedCursor:
+    def __init__(self, connection: RoutedConnection, options: dict):
+        self.connection = connection
+        self.options = options
+        self.cursors = {}
+        self.current = None
+
+    def _cursor_for(self, sql: str):
+        target = self.connection.route(sql)
+        if id(target) not in self.cursors:
+            self.cursors[id(target)] = target.cursor(**self.options)
+        self.current = self.cursors[id(target)]
+        return self.current
+
+    def execute(self, sql, params=None):
+        return self._cursor_for(sql).execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self._cursor_for(sql).executemany(sql, seq_params)
+
+    def fetchone(self):
+        return self.current.fetchone()
+
+    def fetchall(self):
+        return self.current.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.current.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.current.lastrowid
+
+    def close(self):
+        for cursor in self.cursors.values():
+            cursor.close()
+
+
+# Схема для sqlite (в MySQL таблицы создаются вне бота)
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE,
+    telegram_username TEXT,
+    full_name TEXT NOT NULL,
+    student_id TEXT UNIQUE,
+    group_name TEXT,
+    phone_number TEXT,
+    role TEXT NOT NULL DEFAULT 'student',
+    points INTEGER NOT NULL DEFAULT 0,
+    is_prof_union BOOLEAN NOT NULL DEFAULT FALSE,
+    is_sks BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE INDEX IF NOT EXISTS idx_users_group ON users (group_name);
+CREATE TABLE IF NOT EXISTS tutors (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    code TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS tutor_groups (
+    tutor_id INTEGER NOT NULL,
+    group_name TEXT NOT NULL,
+    PRIMARY KEY (tutor_id, group_name)
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    event_date DATETIME NOT NULL,
+    attendance_code TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events (event_date);
+CREATE INDEX IF NOT EXISTS idx_events_code ON events (attendance_code);
+CREATE TABLE IF NOT EXISTS event_attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    UNIQUE (event_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS faq_questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    tutor_id INTEGER,
+    created_at DATETIME DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_faq_status ON faq_questions (status);
+CREATE TABLE IF NOT EXISTS sks_applications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    photo_url TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at DATETIME DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_sks_status ON sks_applications (status, user_id);
+"""
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+
+
+# Перевод запроса из диалекта MySQL в sqlite; второе значение — нужна ли блокировка на запись
+@functools.lru_cache(maxsize=512)
+def translate_to_sqlite(sql: str):
+    lock = 'FOR UPDATE' in sql
+    sql = sql.replace(' FOR UPDATE', '').replace('%s', '?').replace('NOW()', "datetime('now', 'localtime')")
+    if 'ON DUPLICATE KEY UPDATE' in sql:
+        head, tail = sql.split('ON DUPLICATE KEY UPDATE', 1)
+        sql = head + 'ON CONFLICT DO UPDATE SET' + re.sub(r'VALUES\((\w+)\)', r'excluded.\1', tail)
+    return sql, lock
+
+
+# Ошибки sqlite превращаются в Error из mysql.connector, чтобы обработка в хендлерах не менялась
+def as_db_error(error: sqlite3.Error) -> Error:
+    if isinstance(error, sqlite3.IntegrityError):
+        errno = 1062  # дубликат ключа
+    elif 'locked' in str(error):
+        errno = 1205  # таймаут блокировки, повторяется with_db_retry
+    else:
+        errno = None
+    return Error(msg=str(error), errno=errno)
+
+
+class SqliteCursor:
+    def __init__(self, connection: sqlite3.Connection, dictionary: bool = False):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.dictionary = dictionary
+
+    def execute(self, sql, params=None):
+        sql, lock = translate_to_sqlite(sql)
+        try:
+            # Аналог SELECT ... FOR UPDATE: сразу захватываем блокировку на запись
+            if lock and not self.connection.in_transaction:
+                self.connection.execute('BEGIN IMMEDIATE')
+            self.cursor.execute(sql, params or ())
+        except sqlite3.Error as e:
+            raise as_db_error(e) from e
+
+    def executemany(self, sql, seq_params):
+        try:
+            self.cursor.executemany(translate_to_sqlite(sql)[0], seq_params)
+        except sqlite3.Error as e:
+            raise as_db_error(e) from e
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip((column[0] for column in self.cursor.description), row))
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+class SqliteConnection:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(
+            path, timeout=SQLITE_BUSY_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES,
+            # Соединение открывается в потоке (db_connection), а используется в цикле событий
+            check_same_thread=False
         )
-        return connection
-    except Error as e:
+        # WAL задаётся при создании схемы и хранится в файле; остальное — на соединение
+        self.connection.executescript(
+            "PRAGMA synchronous = NORMAL;"
+            "PRAGMA cache_size = -16000;"
+            "PRAGMA temp_store = MEMORY;"
+            "PRAGMA mmap_size = 268435456;"
+        )
+
+    def cursor(self, dictionary: bool = False, **kwargs):
+        return SqliteCursor(self.connection, dictionary)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+def connect_sqlite():
+    try:
+        return SqliteConnection(current_tenant().sqlite_path)
+    except sqlite3.Error as e:
         logger.error(f"Ошибка подключения к БД: {e}")
         return None
 
 
-# Команда /start
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
+# Создание файла БД и таблиц при первом запуске на sqlite
+def init_sqlite_schema():
+    connection = sqlite3.connect(current_tenant().sqlite_path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(SQLITE_SCHEMA)
+    connection.close()
+
+
+# Подключение к БД. С репликами возвращает маршрутизирующее соединение;
+# primary=True — сразу основная БД (чтение-проверка перед записью в одной транзакции)
+def get_db_connection(primary: bool = False):
+    if DB_BACKEND == 'sqlite':
+        return connect_sqlite()
+    if primary or not REPLICAS.hosts:
+        return connect_primary()
+    if DB_BREAKER.is_open() and not REPLICAS.available():
+        return None
+    return RoutedConnection()
+
+
+# Подключение из хендлера: соединение и повторы с паузами — в отдельном потоке,
+# цикл событий не ждёт недоступную БД
+async def db_connection(primary: bool = False):
+    return await asyncio.to_thread(get_db_connection, primary)
+
+
+# Повтор транзакционной функции при временных ошибках БД (дедлок, обрыв соединения).
+# В цикле событий — без повторов: ошибка сразу уходит хендлеру
+def with_db_retry(func, *args):
+    attempts = 0 if on_event_loop() else DB_RETRY_ATTEMPTS
+    for attempt in range(attempts + 1):
+        try:
+            return func(*args)
+        except Error as e:
+            if not is_transient_db_error(e) or attempt == attempts:
+                raise
+            logger.warning(f"Временная ошибка БД, повтор: {e}")
+            time.sleep(random.uniform(0, DB_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+# Единый ответ, когда БД недоступна
+async def reply_db_unavailable(update: Update):
+    if update.callback_query:
+        await update.callback_query.message.reply_text(DB_UNAVAILABLE_TEXT)
+    elif update.effective_message:
+        await update.effective_message.reply_text(DB_UNAVAILABLE_TEXT)
+
+
+# Ошибки, не обработанные в хендлерах: сбои БД посреди запроса дают тот же ответ
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    error = context.error
+    if isinstance(error, Error):
+        logger.error(f"Ошибка БД при обработке апдейта: {error}")
+        if is_transient_db_error(error):
+            DB_BREAKER.failure()
+        if isinstance(update, Update):
+            await reply_db_unavailable(update)
+        return
+    logger.error("Ошибка при обработке апдейта", exc_info=error)
+
+
+# Хранение состояния в БД с отложенной записью: изменения копятся в памяти
+# и пишутся пачкой раз в STATE_FLUSH_INTERVAL и при остановке. При старте
+# ничего не читается — состояние пользователя подгружается при первом апдейте
+class DatabasePersistence(BasePersistence):
+    USER_DATA = 'user_data'
+
+    def __init__(self, flush_interval: float):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval
+        )
+        self.flush_interval = flush_interval
+        # (user_id, chat_id, kind) -> pickle состояния или None для удаления
+        self.pending = {}
+        self.loaded = set()
+        # Диалоги, сохранённые при вытеснении: их удаление из памяти — не завершение
+        self.evicted = set()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def ensure_table(self):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS bot_state ("
+            "user_id BIGINT NOT NULL, chat_id BIGINT NOT NULL, kind VARCHAR(32) NOT NULL, "
+            "state BLOB NOT NULL, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+            "PRIMARY KEY (user_id, chat_id, kind))"
+        )
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    def conversation_handlers(self):
+        return {handler.name: handler for handler in STATE_SWEEPER.conversation_handlers() if handler.persistent}
+
+    # Подгрузка состояния пользователя при первом апдейте после запуска или вытеснения
+    def load_user(self, user_id: int, context: ContextTypes.DEFAULT_TYPE):
+        if user_id in self.loaded:
+            return
+        rows = {
+            (row_user_id, chat_id, kind): state
+            for (row_user_id, chat_id, kind), state in self.pending.items()
+            if row_user_id == user_id
+        }
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
+        cursor.execute("SELECT chat_id, kind, state FROM bot_state WHERE user_id = %s", (user_id,))
+        for row in cursor.fetchall():
+            # Ещё не записанные изменения новее того, что лежит в БД
+            rows.setdefault((user_id, row['chat_id'], row['kind']), row['state'])
         cursor.close()
         connection.close()
 
-        if user:
-            # Только если студент — показываем меню
-            if user['role'] == ROLE_STUDENT:
-                await show_main_menu(update, context)
-                return MENU
-            else:
-                await update.message.reply_text(
-                    "Вы уже зарегистрированы как тьютор или админ. Используйте /menu."
+        handlers = self.conversation_handlers()
+        for (_, chat_id, kind), state in rows.items():
+            if state is None:
+                continue
+            if kind == self.USER_DATA:
+                context.user_data.update(pickle.loads(state))
+            elif kind in handlers:
+                key = (chat_id, user_id)
+                states = conversation_states(handlers[kind])
+                # Без отметки о записи: подгруженное состояние не уходит обратно в БД
+                if key not in states:
+                    states.update_no_track({key: pickle.loads(state)})
+        self.loaded.add(user_id)
+
+    # Вытеснение из памяти: сохраняем текущее состояние, при возвращении оно подгрузится
+    def release(self, user_id: int):
+        # user_data неподгруженного пользователя неполное — им не перезаписываем сохранённое
+        user_data = STATE_SWEEPER.application.user_data.get(user_id)
+        if user_data and user_id in self.loaded:
+            self.pending[(user_id, 0, self.USER_DATA)] = pickle.dumps(dict(user_data))
+        for name, handler in self.conversation_handlers().items():
+            for key, state in conversation_states(handler).items():
+                if key[-1] == user_id:
+                    self.pending[(user_id, key[0], name)] = pickle.dumps(state)
+                    self.evicted.add((user_id, key[0], name))
+        self.loaded.discard(user_id)
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        self.pending[(user_id, 0, self.USER_DATA)] = pickle.dumps(dict(data)) if data else None
+
+    async def update_conversation(self, name, key, new_state):
+        state_key = (key[-1], key[0], name)
+        if state_key in self.evicted:
+            self.evicted.discard(state_key)
+            if new_state is None:
+                return
+        self.pending[state_key] = None if new_state is None else pickle.dumps(new_state)
+
+    # В боте user_data удаляется только при вытеснении из памяти — в БД оно остаётся
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def write(self, batch):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            raise Error(msg="БД недоступна")
+        cursor = connection.cursor()
+        try:
+            upserts = [(*key, state) for key, state in batch.items() if state is not None]
+            deletes = [key for key, state in batch.items() if state is None]
+            if upserts:
+                cursor.executemany(
+                    "INSERT INTO bot_state (user_id, chat_id, kind, state) VALUES (%s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE state = VALUES(state), updated_at = NOW()",
+                    upserts
                 )
-                return MENU
+            if deletes:
+                cursor.executemany(
+                    "DELETE FROM bot_state WHERE user_id = %s AND chat_id = %s AND kind = %s",
+                    deletes
+                )
+            connection.commit()
+        except Error:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            try:
+                await asyncio.to_thread(with_db_retry, self.write, batch)
+            except Error as e:
+                logger.error(f"Не удалось сохранить состояние {len(batch)} записей: {e}")
+                # Вернуть в очередь всё, что не успело смениться более новым состоянием
+                for key, state in batch.items():
+                    self.pending.setdefault(key, state)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        self.ensure_table()
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+
+PERSISTENCE = TenantLocal(lambda: DatabasePersistence(STATE_FLUSH_INTERVAL)) if STATE_PERSISTENCE else None
+
+
+# Полоса запросов к Bot API: свой пул соединений, ограничение параллельности
+# и счётчики очереди. Полоса с yield_to пропускает вперёд запросы той полосы
+class RequestLane(HTTPXRequest):
+    def __init__(self, name: str, concurrency: int, yield_to=None, yield_max: float = 0):
+        super().__init__(connection_pool_size=concurrency, read_timeout=30, write_timeout=30)
+        self.name = name
+        self.slots = asyncio.Semaphore(concurrency)
+        self.yield_to = yield_to
+        self.yield_max = yield_max
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.served = 0
+
+    async def do_request(self, *args, **kwargs):
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        self.idle.clear()
+        waiting = True
+        try:
+            # Ждём, пока разойдутся ответы пользователям, но не дольше yield_max
+            if self.yield_to and not self.yield_to.idle.is_set():
+                try:
+                    await asyncio.wait_for(self.yield_to.idle.wait(), self.yield_max)
+                except asyncio.TimeoutError:
+                    pass
+            async with self.slots:
+                self.queued -= 1
+                waiting = False
+                self.in_flight += 1
+                try:
+                    return await super().do_request(*args, **kwargs)
+                finally:
+                    self.in_flight -= 1
+                    self.served += 1
+        finally:
+            if waiting:
+                self.queued -= 1
+            if self.queued == 0 and self.in_flight == 0:
+                self.idle.set()
+
+    def report(self) -> str:
+        return (
+            f"• {self.name}: в очереди {self.queued}, выполняется {self.in_flight}, "
+            f"пик очереди {self.max_queued}, всего {self.served}"
+        )
+
+
+INTERACTIVE_LANE = RequestLane('interactive', INTERACTIVE_CONCURRENCY)
+BULK_LANE = RequestLane('bulk', BULK_CONCURRENCY, yield_to=INTERACTIVE_LANE, yield_max=BULK_YIELD_MAX)
+
+
+# Массовые отправки через общий ограничитель скорости и отдельную полосу запросов
+class BulkSender:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+        self.bot = None
+        self.pending = 0
+
+    async def _acquire(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def send(self, method: str, **kwargs):
+        self.pending += 1
+        try:
+            for attempt in range(3):
+                await self._acquire()
+                try:
+                    return await getattr(self.bot, method)(**kwargs)
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                    logger.warning(f"Flood control при массовой отправке, пауза {delay} с")
+                    # Пауза для всех отправок, а не только для получившей 429
+                    async with self.lock:
+                        self.next_slot = max(self.next_slot, asyncio.get_running_loop().time() + delay)
+            raise RuntimeError(f"Не удалось выполнить {method} после повторов")
+        finally:
+            self.pending -= 1
+
+    async def _send_counted(self, chat_id, method: str, kwargs, remaining) -> bool:
+        try:
+            await self.send(method, chat_id=chat_id, **kwargs)
+            sent = True
+        except Exception as e:
+            logger.error(f"Ошибка отправки {chat_id}: {e}")
+            sent = False
+        # Отправка, прерванная отменой, остаётся в remaining
+        if remaining is not None:
+            remaining.discard(chat_id)
+        return sent
+
+    # Отправка одного и того же сообщения списку чатов, возвращает число успешных.
+    # Темп задаёт ограничитель скорости, параллельность — BULK_CONCURRENCY воркеров.
+    # Из remaining удаляются чаты, отправка в которые завершилась
+    async def send_many(self, chat_ids, method: str, remaining: set = None, **kwargs) -> int:
+        queue = deque(chat_ids)
+        sent = 0
+        self.pending += len(queue)
+
+        async def worker():
+            nonlocal sent
+            while queue:
+                chat_id = queue.popleft()
+                self.pending -= 1
+                delivered = await self._send_counted(chat_id, method, kwargs, remaining)
+                sent += delivered
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(BULK_CONCURRENCY, len(queue)))))
+        finally:
+            self.pending -= len(queue)
+        return sent
+
+
+BULK_SENDER = TenantLocal(lambda: BulkSender(BULK_RATE))
+
+
+# Рассылки, которые можно прервать при остановке бота: неотправленные получатели
+# сохраняются в broadcast_jobs и дорассылаются после запуска
+class BroadcastJobs:
+    def __init__(self):
+        self.active = 0
+        self.stopping = asyncio.Event()
+        self.task = None
+
+    def ensure_table(self):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS broadcast_jobs ("
+            "job_id VARCHAR(32) NOT NULL PRIMARY KEY, report_chat_id BIGINT, method VARCHAR(32) NOT NULL, "
+            "kwargs TEXT NOT NULL, chat_ids TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    @staticmethod
+    def save(job_id: str, report_chat_id, method: str, kwargs, chat_ids):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            logger.error(f"Рассылка {job_id} не сохранена: нет подключения к БД, потеряно {len(chat_ids)} получателей")
+            return
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT INTO broadcast_jobs (job_id, report_chat_id, method, kwargs, chat_ids) VALUES (%s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE chat_ids = VALUES(chat_ids)",
+            (job_id, report_chat_id, method, json.dumps(kwargs), json.dumps(sorted(chat_ids)))
+        )
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    @staticmethod
+    def delete(job_id: str):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM broadcast_jobs WHERE job_id = %s", (job_id,))
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    # Число успешных отправок или None, если рассылку прервала остановка и остаток сохранён
+    async def run(self, chat_ids, method: str, kwargs, report_chat_id, job_id: str = None):
+        remaining = set(chat_ids)
+        self.active += 1
+        try:
+            sending = asyncio.ensure_future(BULK_SENDER.send_many(chat_ids, method, remaining=remaining, **kwargs))
+            stopping = asyncio.ensure_future(self.stopping.wait())
+            await asyncio.wait({sending, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if sending.done():
+                if job_id:
+                    await asyncio.to_thread(self.delete, job_id)
+                return sending.result()
+            sending.cancel()
+            remaining = set(remaining)
+            job_id = job_id or uuid.uuid4().hex
+            await asyncio.to_thread(self.save, job_id, report_chat_id, method, kwargs, remaining)
+            logger.info(f"Рассылка {job_id} прервана остановкой, осталось {len(remaining)} получателей")
+            return None
+        finally:
+            self.active -= 1
+
+    # Дорассылка сохранённого после запуска
+    async def resume(self, bot: Bot):
+        connection = await db_connection(primary=True)
+        if not connection:
+            return
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT job_id, report_chat_id, method, kwargs, chat_ids FROM broadcast_jobs")
+        jobs = cursor.fetchall()
+        cursor.close()
+        connection.close()
+        for job in jobs:
+            chat_ids = json.loads(job['chat_ids'])
+            success = await self.run(chat_ids, job['method'], json.loads(job['kwargs']), job['report_chat_id'], job['job_id'])
+            if success is None:
+                return
+            if job['report_chat_id']:
+                try:
+                    await bot.send_message(
+                        job['report_chat_id'],
+                        f"✅ Рассылка, прерванная перезапуском, завершена: отправлено {success} из {len(chat_ids)}"
+                    )
+                except Exception as e:
+                    logger.error(f"Не удалось сообщить о завершении рассылки: {e}")
+
+    def start(self, bot: Bot):
+        self.ensure_table()
+        self.task = asyncio.create_task(self.resume(bot))
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    # Остановка: прервать рассылки и дождаться сохранения остатка, не дольше timeout
+    async def drain(self, timeout: float):
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.active:
+            logger.error(f"Не дождались сохранения рассылок: {self.active}")
+
+
+BROADCASTS = TenantLocal(BroadcastJobs)
+
+
+# Справочник тьюторов и админов: кто какие группы курирует, кто курирует группу
+# и users.id по telegram_id. Загружается целиком, перечитывается по TTL и при изменениях
+class TutorDirectory:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.loaded_at = None
+        self.generation = 0
+        self.staff = {}  # users.id -> telegram_id, full_name, role
+        self.by_telegram = {}  # telegram_id -> users.id
+        self.groups_by_tutor = {}  # users.id -> [group_name]
+        self.tutors_by_group = {}  # group_name -> [users.id]
+
+    def load(self) -> bool:
+        connection = get_db_connection()
+        if not connection:
+            return False
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT id, telegram_id, full_name, role FROM users WHERE role IN (%s, %s)",
+            (ROLE_TUTOR, ROLE_ADMIN)
+        )
+        staff = {row['id']: row for row in cursor.fetchall()}
+        cursor.execute("SELECT tutor_id, group_name FROM tutor_groups ORDER BY group_name")
+        links = cursor.fetchall()
+        cursor.close()
+        connection.close()
+
+        groups_by_tutor, tutors_by_group = {}, {}
+        for link in links:
+            groups_by_tutor.setdefault(link['tutor_id'], []).append(link['group_name'])
+            tutors_by_group.setdefault(link['group_name'], []).append(link['tutor_id'])
+        self.staff = staff
+        self.by_telegram = {row['telegram_id']: user_id for user_id, row in staff.items() if row['telegram_id']}
+        self.groups_by_tutor = groups_by_tutor
+        self.tutors_by_group = tutors_by_group
+        self.loaded_at = time.monotonic()
+        return True
+
+    # False, только если справочник ни разу не удалось загрузить; при сбое обновления
+    # продолжаем отвечать по прежней копии
+    def ensure(self) -> bool:
+        generation = GENERATIONS.current('tutors')
+        if generation != self.generation:
+            self.generation = generation
+            self.loaded_at = None
+        stale = self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl
+        if stale and not self.load():
+            return self.loaded_at is not None
+        return True
+
+    def invalidate(self):
+        self.loaded_at = None
+        GENERATIONS.bump('tutors')
+
+    # Тьютор или админ по telegram_id: {'id', 'telegram_id', 'full_name', 'role'} или None
+    def member(self, telegram_id: int):
+        user_id = self.by_telegram.get(telegram_id)
+        return self.staff.get(user_id) if user_id else None
+
+    def groups_of(self, user_id: int):
+        return self.groups_by_tutor.get(user_id, [])
+
+    def all_groups(self):
+        return sorted(self.tutors_by_group)
+
+    def tutor_name(self, group: str):
+        for user_id in self.tutors_by_group.get(group, []):
+            tutor = self.staff.get(user_id)
+            if tutor and tutor['role'] == ROLE_TUTOR:
+                return tutor['full_name']
+        return None
+
+    # telegram_id тьюторов группы; без группы — всех тьюторов
+    def tutor_chat_ids(self, group: str = None):
+        user_ids = self.tutors_by_group.get(group, []) if group else self.staff
+        return [
+            self.staff[user_id]['telegram_id'] for user_id in dict.fromkeys(user_ids)
+            if user_id in self.staff and self.staff[user_id]['role'] == ROLE_TUTOR and self.staff[user_id]['telegram_id']
+        ]
+
+
+TUTOR_DIRECTORY = TenantLocal(lambda: TutorDirectory(TUTOR_DIRECTORY_TTL))
+
+
+# Подписанная ссылка на отметку: id мероприятия, срок действия и усечённый HMAC,
+# всё вместе — 24 символа base64url, проверяется без обращения к БД
+def sign_checkin(event_id: int, event_date: datetime) -> str:
+    expires = int((event_date + timedelta(hours=CHECKIN_LINK_HOURS)).timestamp())
+    body = event_id.to_bytes(4, 'big') + expires.to_bytes(4, 'big')
+    mac = hmac.new(current_tenant().checkin_secret.encode(), body, hashlib.sha256).digest()[:10]
+    return CHECKIN_PREFIX + base64.urlsafe_b64encode(body + mac).decode()
+
+
+# id мероприятия из параметра /start или None, если подпись неверна или срок вышел
+def verify_checkin(payload: str):
+    try:
+        raw = base64.urlsafe_b64decode(payload[len(CHECKIN_PREFIX):])
+    except ValueError:
+        return None
+    if len(raw) != 18:
+        return None
+    body, mac = raw[:8], raw[8:]
+    expected = hmac.new(current_tenant().checkin_secret.encode(), body, hashlib.sha256).digest()[:10]
+    if not hmac.compare_digest(mac, expected) or int.from_bytes(body[4:], 'big') < time.time():
+        return None
+    return int.from_bytes(body[:4], 'big')
+
+
+def checkin_link(bot_username: str, event_id: int, event_date: datetime) -> str:
+    return f"https://t.me/{bot_username}?start={sign_checkin(event_id, event_date)}"
+
+
+def checkin_qr(link: str) -> bytes:
+    buffer = io.BytesIO()
+    qrcode.make(link).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+# Ссылка и QR-код для отметки — админу при создании мероприятия и по /qr
+async def send_checkin_link(update: Update, context: ContextTypes.DEFAULT_TYPE, event_id: int, event_date: datetime):
+    link = checkin_link(context.bot.username, event_id, event_date)
+    text = f"🔗 Ссылка для отметки (действует до {CHECKIN_LINK_HOURS} ч после начала мероприятия):\n{link}"
+    if qrcode is None:
+        await update.message.reply_text(text)
+        return
+    image = await asyncio.to_thread(checkin_qr, link)
+    await update.message.reply_photo(image, caption=text)
+
+
+# Отметка студента в транзакции курсора: баллы и аналитика вместе с записью.
+# False — уже отмечался; коммит делает вызывающий. Строка студента блокируется,
+# чтобы два нажатия подряд не прошли проверку одновременно: уникального ключа
+# (event_id, user_id) в MySQL может и не быть
+def record_attendance(cursor, event: dict, telegram_id: int) -> bool:
+    cursor.execute("SELECT id FROM users WHERE telegram_id = %s FOR UPDATE", (telegram_id,))
+    cursor.fetchone()
+    cursor.execute(
+        "SELECT id FROM event_attendance WHERE event_id = %s AND user_id = %s", (event['id'], telegram_id)
+    )
+    if cursor.fetchone():
+        return False
+    try:
+        cursor.execute(
+            "INSERT INTO event_attendance (event_id, user_id) VALUES (%s, %s)", (event['id'], telegram_id)
+        )
+    except Error as e:
+        if e.errno != 1062:
+            raise
+        return False
+    cursor.execute("UPDATE users SET points = points + 1 WHERE telegram_id = %s", (telegram_id,))
+    ATTENDANCE_STATS.record(cursor, event, telegram_id)
+    return True
+
+
+# Команда /start
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = update.effective_user.id
+    payload = context.args[0] if context.args else ''
+    event_id = verify_checkin(payload) if payload.startswith(CHECKIN_PREFIX) else None
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return ConversationHandler.END
+
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
+    # Отметка по QR-коду: всё в этом же апдейте, без ввода кода
+    event = None
+    marked = False
+    if user and event_id:
+        cursor.execute("SELECT id, event_date FROM events WHERE id = %s", (event_id,))
+        event = cursor.fetchone()
+        if event:
+            marked = record_attendance(cursor, event, user_id)
+            connection.commit()
+    cursor.close()
+    connection.close()
+
+    if payload.startswith(CHECKIN_PREFIX):
+        if not user:
+            await update.message.reply_text(
+                "Чтобы отметиться, сначала зарегистрируйтесь, а затем снова отсканируйте QR-код."
+            )
+        elif event:
+            await update.message.reply_text(
+                "✅ Вы успешно отметились!" if marked else "Вы уже отмечались на этом мероприятии."
+            )
+            return MENU
+        else:
+            await update.message.reply_text("❌ Ссылка для отметки недействительна или устарела.")
+
+    if user:
+        # Только если студент — показываем меню
+        if user['role'] == ROLE_STUDENT:
+            await show_main_menu(update, context)
+            return MENU
+        else:
+            await update.message.reply_text(
+                "Вы уже зарегистрированы как тьютор или админ. Используйте /menu."
+            )
+            return MENU
 
     # Если пользователь не найден — запрашиваем ФИО (только для студентов)
     await update.message.reply_text(
@@ -104,32 +1652,34 @@ async def handle_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     full_name = update.message.text
     if full_name.isdigit() and len(full_name) == 6:
         return await handle_tutor_auth(update, context)
-    context.user_data['full_name'] = full_name
 
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT * FROM users WHERE full_name = %s",
-            (full_name,)
-        )
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return FULL_NAME
 
-        if user:
-            keyboard = [
-                ['✅ Да', '❌ Нет']
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
-            await update.message.reply_text(
-                f"🔎 Мы нашли похожую запись:\n"
-                f"👤 {user['full_name']} (№ зачётки: {user['student_id']})\n\n"
-                "Это вы? Подтвердите, пожалуйста 👇",
-                reply_markup=reply_markup
-            )
-            context.user_data['found_user'] = user
-            return CONFIRM_NAME
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute(
+        "SELECT * FROM users WHERE full_name = %s",
+        (full_name,)
+    )
+    user = cursor.fetchone()
+    cursor.close()
+    connection.close()
+
+    if user:
+        keyboard = [
+            ['✅ Да', '❌ Нет']
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
+        await update.message.reply_text(
+            f"🔎 Мы нашли похожую запись:\n"
+            f"👤 {user['full_name']} (№ зачётки: {user['student_id']})\n\n"
+            "Это вы? Подтвердите, пожалуйста 👇",
+            reply_markup=reply_markup
+        )
+        context.user_data['found_user_id'] = user['id']
+        return CONFIRM_NAME
 
     await update.message.reply_text(
         "😔 Увы, такого ФИО не найдено в базе.\n"
@@ -142,17 +1692,25 @@ async def handle_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def confirm_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     choice = update.message.text
     if choice == '✅ Да':
-        user_data = context.user_data['found_user']
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor()
-            cursor.execute(
-                "UPDATE users SET telegram_id = %s, telegram_username = %s WHERE id = %s",
-                (update.effective_user.id, update.effective_user.username, user_data['id'])
-            )
-            connection.commit()
-            cursor.close()
-            connection.close()
+        found_user_id = context.user_data.get('found_user_id')
+        if not found_user_id:
+            await update.message.reply_text("Введите ваше ФИО ещё раз:", reply_markup=ReplyKeyboardRemove())
+            return FULL_NAME
+        connection = await db_connection()
+        if not connection:
+            await reply_db_unavailable(update)
+            return CONFIRM_NAME
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE users SET telegram_id = %s, telegram_username = %s WHERE id = %s",
+            (update.effective_user.id, update.effective_user.username, found_user_id)
+        )
+        connection.commit()
+        cursor.close()
+        connection.close()
+        UNKNOWN_SENDERS.forget(update.effective_user.id)
+        context.user_data.pop('found_user_id', None)
 
         await update.message.reply_text(
             "🎉 Отлично! Вы успешно авторизованы.\n"
@@ -168,18 +1726,20 @@ async def confirm_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 # Обработка номера телефона
 async def handle_phone_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     phone_number = update.message.text
-    context.user_data['phone_number'] = phone_number
 
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor()
-        cursor.execute(
-            "UPDATE users SET phone_number = %s WHERE telegram_id = %s",
-            (phone_number, update.effective_user.id)
-        )
-        connection.commit()
-        cursor.close()
-        connection.close()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return PHONE_NUMBER
+
+    cursor = connection.cursor()
+    cursor.execute(
+        "UPDATE users SET phone_number = %s WHERE telegram_id = %s",
+        (phone_number, update.effective_user.id)
+    )
+    connection.commit()
+    cursor.close()
+    connection.close()
 
     await update.message.reply_text(
         "✅ Ваш номер телефона сохранён!\n"
@@ -191,46 +1751,25 @@ async def handle_phone_number(update: Update, context: ContextTypes.DEFAULT_TYPE
 # Показ главного меню
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    connection = get_db_connection()
-    user = None
+    connection = await db_connection()
     tutor_name = "-"  # ← добавьте эту строку
 
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
+    if not connection:
+        await reply_db_unavailable(update)
+        return MENU
+
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    connection.close()
 
     if not user:
         await update.message.reply_text("❌ Пользователь не найден. Начните с /start")
         return ConversationHandler.END
 
-    if user['role'] == ROLE_STUDENT:
-        tutor_name = "-"
-        group = user.get('group_name')
-        if group:
-            connection = get_db_connection()
-            if connection:
-                cursor1 = connection.cursor(dictionary=True)
-                cursor1.execute(
-                    "SELECT tutor_id FROM tutor_groups WHERE group_name = %s", (group,)
-                )
-                tutor_groups = cursor1.fetchall()
-                cursor1.close()  # теперь можно безопасно закрыть
-
-                tutor_name = "-"
-                if tutor_groups:
-                    tutor_group = tutor_groups[0]
-                    cursor2 = connection.cursor(dictionary=True)
-                    cursor2.execute(
-                        "SELECT full_name FROM users WHERE id = %s AND role = 'tutor'", (tutor_group['tutor_id'],)
-                    )
-                    tutors = cursor2.fetchall()
-                    if tutors:
-                        tutor_name = tutors[0]['full_name']
-                    cursor2.close()
-                connection.close()
+    if user['role'] == ROLE_STUDENT and user.get('group_name') and TUTOR_DIRECTORY.ensure():
+        tutor_name = TUTOR_DIRECTORY.tutor_name(user['group_name']) or "-"
     menu_text = (
         f"👋 Привет, {user['full_name']}!\n"
         f"📚 Вот ваши данные:\n"
@@ -241,17 +1780,8 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
 
     if user['role'] == ROLE_TUTOR or user['role'] == ROLE_ADMIN:
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT id FROM users WHERE telegram_id = %s", (user_id,))
-            tutor = cursor.fetchone()
-            groups = []
-            if tutor:
-                cursor.execute("SELECT group_name FROM tutor_groups WHERE tutor_id = %s", (tutor['id'],))
-                groups = [row['group_name'] for row in cursor.fetchall()]
-            cursor.close()
-            connection.close()
+        if TUTOR_DIRECTORY.ensure():
+            groups = TUTOR_DIRECTORY.groups_of(user['id'])
             menu_text = (
                 f"👋 Привет, {user['full_name']}!\n"
                 f"• Тьютор групп(ы): {', '.join(groups) if groups else '-'}\n"
@@ -272,7 +1802,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         keyboard = [
             ['📅 Управление мероприятиями', '📊 Изменить баллы'],
             ['📢 Рассылка', '📊 Статистика'],
-            ['👥 Управление пользователями']
+            ['👥 Управление пользователями', '🎫 Заявки СКС']
         ]
     else:
         keyboard = [['❓ Помощь']]
@@ -282,28 +1812,25 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return MENU
 
 async def tutor_broadcast_entry(update, context):
-    user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT id FROM users WHERE telegram_id = %s AND role = 'tutor'", (user_id,))
-        tutor = cursor.fetchone()
-        if tutor:
-            cursor.execute("SELECT group_name FROM tutor_groups WHERE tutor_id = %s", (tutor['id'],))
-            groups = [row['group_name'] for row in cursor.fetchall()]
-            cursor.close()
-            connection.close()
-            if groups:
-                # Если у тьютора одна группа — сразу выбираем её
-                context.user_data['broadcast_target'] = groups[0] if len(groups) == 1 else groups
-                await update.message.reply_text("📨 Введите сообщение для рассылки группе:")
-                return BROADCAST_MESSAGE
-            else:
-                await update.message.reply_text("❌ У вас нет прикреплённых групп.")
+    if not TUTOR_DIRECTORY.ensure():
+        await reply_db_unavailable(update)
+        return ConversationHandler.END
+
+    tutor = TUTOR_DIRECTORY.member(update.effective_user.id)
+    if tutor and tutor['role'] == ROLE_TUTOR:
+        groups = TUTOR_DIRECTORY.groups_of(tutor['id'])
+        if groups:
+            # Если у тьютора одна группа — сразу выбираем её
+            context.user_data['broadcast_target'] = groups[0] if len(groups) == 1 else groups
+            await update.message.reply_text("📨 Введите сообщение для рассылки группе:")
+            return BROADCAST_MESSAGE
         else:
-            await update.message.reply_text("❌ Вы не тьютор.")
+            await update.message.reply_text("❌ У вас нет прикреплённых групп.")
+    else:
+        await update.message.reply_text("❌ Вы не тьютор.")
     return ConversationHandler.END
 
+
 # Проверка кода авторизации
 async def handle_tutor_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     code = update.message.text
@@ -321,108 +1848,130 @@ async def handle_tutor_auth(update: Update, context: ContextTypes.DEFAULT_TYPE)
     telegram_id = update.effective_user.id
     telegram_username = update.effective_user.username
 
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM tutors WHERE code = %s", (personal_code,))
-        tutor = cursor.fetchone()
-
-        if tutor and tutor['user_id']:
-            cursor.execute("SELECT * FROM users WHERE id = %s", (tutor['user_id'],))
-            user = cursor.fetchone()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return ConversationHandler.END
 
-            if user:
-                if user['telegram_id']:
-                    await update.message.reply_text("❌ Этот профиль уже привязан к другому Telegram аккаунту.")
-                    cursor.close()
-                    connection.close()
-                    return ConversationHandler.END
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM tutors WHERE code = %s", (personal_code,))
+    tutor = cursor.fetchone()
 
-                cursor.execute(
-                    "UPDATE users SET telegram_id = %s, telegram_username = %s WHERE id = %s",
-                    (telegram_id, telegram_username, user['id'])
-                )
-                connection.commit()
-                cursor.close()
-                connection.close()
+    if tutor and tutor['user_id']:
+        cursor.execute("SELECT * FROM users WHERE id = %s", (tutor['user_id'],))
+        user = cursor.fetchone()
 
-                await update.message.reply_text("✅ Авторизация успешна! Вы теперь тьютор.")
-                await show_main_menu(update, context)
-                return ConversationHandler.END
-            else:
+        if user:
+            if user['telegram_id']:
+                await update.message.reply_text("❌ Этот профиль уже привязан к другому Telegram аккаунту.")
                 cursor.close()
                 connection.close()
-                await update.message.reply_text("❌ Профиль пользователя не найден. Обратитесь к администратору.")
                 return ConversationHandler.END
+
+            cursor.execute(
+                "UPDATE users SET telegram_id = %s, telegram_username = %s WHERE id = %s",
+                (telegram_id, telegram_username, user['id'])
+            )
+            connection.commit()
+            cursor.close()
+            connection.close()
+            UNKNOWN_SENDERS.forget(telegram_id)
+            TUTOR_DIRECTORY.invalidate()
+
+            await update.message.reply_text("✅ Авторизация успешна! Вы теперь тьютор.")
+            await show_main_menu(update, context)
+            return ConversationHandler.END
         else:
             cursor.close()
             connection.close()
-            await update.message.reply_text("❌ Код не найден или не привязан к пользователю. Обратитесь к администратору.")
+            await update.message.reply_text("❌ Профиль пользователя не найден. Обратитесь к администратору.")
             return ConversationHandler.END
+    else:
+        cursor.close()
+        connection.close()
+        await update.message.reply_text("❌ Код не найден или не привязан к пользователю. Обратитесь к администратору.")
+        return ConversationHandler.END
 
 # Обработка меню
 async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int | None:
     text = update.message.text
     user_id = update.effective_user.id
 
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
+    # Незарегистрированным отвечаем без запроса к БД
+    if UNKNOWN_SENDERS.get(user_id):
+        await update.message.reply_text("❌ Пользователь не авторизован. Начните с /start")
+        return ConversationHandler.END
+
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return MENU
+
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    connection.close()
 
     if not user:
+        UNKNOWN_SENDERS.remember(user_id, True)
         await update.message.reply_text("❌ Пользователь не авторизован. Начните с /start")
         return ConversationHandler.END
 
     if context.user_data.get('user_search'):
         search_term = text
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute(
-                "SELECT * FROM users WHERE full_name LIKE %s",
-                (f'%{search_term}%',)
-            )
-            users = cursor.fetchall()
-            cursor.close()
-            connection.close()
+        connection = await db_connection()
+        if not connection:
+            await reply_db_unavailable(update)
+            return MENU
 
-            if users:
-                info_text = "🔍 Найденные пользователи:\n\n"
-                for u in users:
-                    info_text += f"• ID: {u['id']}, ФИО: {u['full_name']}, Группа: {u['group_name']}, Роль: {u['role']}\n"
-                await update.message.reply_text(info_text)
-            else:
-                await update.message.reply_text("❌ Пользователи не найдены.")
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT * FROM users WHERE full_name LIKE %s",
+            (f'%{search_term}%',)
+        )
+        users = cursor.fetchall()
+        cursor.close()
+        connection.close()
+
+        if users:
+            info_text = "🔍 Найденные пользователи:\n\n"
+            for u in users:
+                info_text += f"• ID: {u['id']}, ФИО: {u['full_name']}, Группа: {u['group_name']}, Роль: {u['role']}\n"
+            await update.message.reply_text(info_text)
+        else:
+            await update.message.reply_text("❌ Пользователи не найдены.")
         context.user_data['user_search'] = False
         return MENU
 
     if context.user_data.get('faq_answer_id'):
         question_id = context.user_data['faq_answer_id']
         answer = text
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute(
-                "UPDATE faq_questions SET answer = %s, status = 'answered' WHERE id = %s",
-                (answer, question_id)
-            )
-            cursor.execute("SELECT user_id FROM faq_questions WHERE id = %s", (question_id,))
-            question = cursor.fetchone()
-            if question:
-                cursor.execute("SELECT telegram_id FROM users WHERE telegram_id = %s", (question['user_id'],))
-                user = cursor.fetchone()
-                if user and user['telegram_id']:
-                    await context.bot.send_message(
-                        chat_id=user['telegram_id'],
-                        text=f"Ответ на ваш вопрос:\n{answer}"
-                    )
-                else:
-                    logger.warning(
-                        f"Не удалось отправить ответ: telegram_id отсутствует для user_id={question['user_id']}")
+        connection = await db_connection()
+        if not connection:
+            await reply_db_unavailable(update)
+            return MENU
+
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            "UPDATE faq_questions SET answer = %s, status = 'answered' WHERE id = %s",
+            (answer, question_id)
+        )
+        cursor.execute("SELECT user_id, question FROM faq_questions WHERE id = %s", (question_id,))
+        question = cursor.fetchone()
+        if question:
+            FAQ_INDEX.add(question['question'], answer)
+            GENERATIONS.bump('faq')
+            cursor.execute("SELECT telegram_id FROM users WHERE telegram_id = %s", (question['user_id'],))
+            user = cursor.fetchone()
+            if user and user['telegram_id']:
+                await context.bot.send_message(
+                    chat_id=user['telegram_id'],
+                    text=f"Ответ на ваш вопрос:\n{answer}"
+                )
+            else:
+                logger.warning(
+                    f"Не удалось отправить ответ: telegram_id отсутствует для user_id={question['user_id']}")
         connection.commit()
         cursor.close()
         connection.close()
@@ -433,21 +1982,23 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     if context.user_data.get('ask_question'):
         question = text
-        user_id = update.effective_user.id
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor()
-            cursor.execute(
-                "INSERT INTO faq_questions (user_id, question) VALUES (%s, %s)",
-                (user_id, question)
-            )
-            question_id = cursor.lastrowid
-            connection.commit()
-            cursor.close()
-            connection.close()
-            await update.message.reply_text("✅ Ваш вопрос отправлен тьюторам. Ожидайте ответа.")
-            await notify_tutors_about_question(context, question_id, question)
         context.user_data['ask_question'] = False
+        matches = FAQ_INDEX.search(question)
+        if matches:
+            # Сначала предлагаем готовые ответы, тьюторам — только если не подошли
+            context.user_data['pending_question'] = question
+            suggestion_text = "💡 Возможно, ответ уже есть:\n\n"
+            for item in matches:
+                suggestion_text += f"• {item['question']}\n{item['answer']}\n\n"
+            keyboard = [
+                [InlineKeyboardButton("✅ Это ответ на мой вопрос", callback_data="faq_resolved")],
+                [InlineKeyboardButton("📨 Нет, отправить тьюторам", callback_data="faq_escalate")]
+            ]
+            await update.message.reply_text(suggestion_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        elif await escalate_question(context, update.effective_user.id, question):
+            await update.message.reply_text("✅ Ваш вопрос отправлен тьюторам. Ожидайте ответа.")
+        else:
+            await reply_db_unavailable(update)
         return MENU
 
     if context.user_data.get('add_event_title'):
@@ -466,7 +2017,7 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
             event_date = datetime.strptime(event_date_str, "%d.%m.%Y %H:%M")
             event_title = context.user_data.get('event_title')
             attendance_code = f"{random.randint(1000, 9999)}"
-            connection = get_db_connection()
+            connection = await db_connection()
             if connection:
                 cursor = connection.cursor()
                 cursor.execute(
@@ -477,14 +2028,15 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
                 connection.commit()
                 cursor.close()
                 connection.close()
+                events_changed()
+                REMINDERS.update(event_id, {'title': event_title, 'event_date': event_date})
+                AUDIT.record(user_id, 'event_add', f"event:{event_id}", f"{event_title} {event_date_str}")
                 await update.message.reply_text(
                     f"✅ Мероприятие '{event_title}' добавлено на {event_date_str}.\nID: {event_id}\nКод для отметки: {attendance_code}"
                 )
+                await send_checkin_link(update, context, event_id, event_date)
             else:
-                await update.message.reply_text(
-                    "⚠️ Ой! Не удалось подключиться к базе данных.\n"
-                    "Попробуйте позже или обратитесь к администратору."
-                )
+                await reply_db_unavailable(update)
         except ValueError:
             await update.message.reply_text("❌ Некорректный формат даты. Попробуйте ещё раз:")
             return MENU
@@ -507,22 +2059,25 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     if context.user_data.get('edit_event_title'):
         new_title = text
         event_id = context.user_data.get('edit_event_id')
-        connection = get_db_connection()
+        connection = await db_connection()
         if connection:
-            cursor = connection.cursor()
+            cursor = connection.cursor(dictionary=True)
             cursor.execute(
                 "UPDATE events SET title = %s WHERE id = %s",
                 (new_title, event_id)
             )
+            # Расписание строится по записи целиком: так его не обойдёт и изменение даты
+            cursor.execute("SELECT title, event_date FROM events WHERE id = %s", (event_id,))
+            event = cursor.fetchone()
             connection.commit()
             cursor.close()
             connection.close()
+            events_changed()
+            REMINDERS.update(event_id, event)
+            AUDIT.record(user_id, 'event_edit', f"event:{event_id}", new_title)
             await update.message.reply_text(f"✅ Название мероприятия обновлено на '{new_title}'.")
         else:
-            await update.message.reply_text(
-                "⚠️ Ой! Не удалось подключиться к базе данных.\n"
-                "Попробуйте позже или обратитесь к администратору."
-            )
+            await reply_db_unavailable(update)
         context.user_data['edit_event_title'] = False
         context.user_data['edit_event_id'] = None
         return await manage_events(update, context)
@@ -531,19 +2086,14 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     if context.user_data.get('delete_event'):
         try:
             event_id = int(text)
-            connection = get_db_connection()
-            if connection:
-                cursor = connection.cursor()
-                cursor.execute("DELETE FROM events WHERE id = %s", (event_id,))
-                connection.commit()
-                cursor.close()
-                connection.close()
-                await update.message.reply_text(f"🗑️ Мероприятие с ID {event_id} удалено.")
-            else:
-                await update.message.reply_text(
-                    "⚠️ Ой! Не удалось подключиться к базе данных.\n"
-                    "Попробуйте позже или обратитесь к администратору."
-                )
+            await asyncio.to_thread(with_db_retry, delete_event, event_id)
+            events_changed()
+            REMINDERS.update(event_id, None)
+            AUDIT.record(user_id, 'event_delete', f"event:{event_id}")
+            await update.message.reply_text(f"🗑️ Мероприятие с ID {event_id} удалено.")
+        except (ConnectionError, Error) as e:
+            logger.error(f"Ошибка удаления мероприятия {text}: {e}")
+            await reply_db_unavailable(update)
         except ValueError:
             await update.message.reply_text("❌ Введите корректный ID мероприятия.")
         context.user_data['delete_event'] = False
@@ -552,33 +2102,23 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     if context.user_data.get('attendance_mark'):
         code = text.strip()
         user_id = update.effective_user.id
-        connection = get_db_connection()
+        connection = await db_connection()
         if connection:
             cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT id FROM events WHERE attendance_code = %s", (code,))
+            cursor.execute("SELECT id, event_date FROM events WHERE attendance_code = %s", (code,))
             event = cursor.fetchone()
             if event:
-                event_id = event['id']
-                cursor.execute("SELECT * FROM event_attendance WHERE event_id = %s AND user_id = %s",
-                               (event_id, user_id))
-                already = cursor.fetchone()
-                if already:
-                    await update.message.reply_text("Вы уже отмечались на этом мероприятии.")
-                else:
-                    cursor.execute("INSERT INTO event_attendance (event_id, user_id) VALUES (%s, %s)",
-                                   (event_id, user_id))
-                    cursor.execute("UPDATE users SET points = points + 1 WHERE telegram_id = %s", (user_id,))
+                if record_attendance(cursor, event, user_id):
                     connection.commit()
                     await update.message.reply_text("✅ Вы успешно отметились!")
+                else:
+                    await update.message.reply_text("Вы уже отмечались на этом мероприятии.")
             else:
                 await update.message.reply_text("❌ Код мероприятия неверный.")
             cursor.close()
             connection.close()
         else:
-            await update.message.reply_text(
-                "⚠️ Ой! Не удалось подключиться к базе данных.\n"
-                "Попробуйте позже или обратитесь к администратору."
-            )
+            await reply_db_unavailable(update)
         context.user_data['attendance_mark'] = False
         return MENU
 
@@ -589,53 +2129,57 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         else:
             context.user_data['broadcast_target'] = group
         context.user_data['choose_group'] = False
-        await update.message.reply_text("📨 Отправьте сообщение для рассылки выбранной группе:")
-        return BROADCAST_MESSAGE
-
-    if context.user_data.get('choose_points_group'):
-        group = text
-        context.user_data['choose_points_group'] = False
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor(dictionary=True)
-            # Получаем id тьютора по telegram_id
-            cursor.execute("SELECT id FROM users WHERE telegram_id = %s AND role = 'tutor'", (user_id,))
-            tutor = cursor.fetchone()
-            if tutor:
-                tutor_id = tutor['id']
-                if group == 'Всем группам':
-                    cursor.execute(
-                        "SELECT full_name, group_name, points FROM users WHERE group_name IN (SELECT group_name FROM tutor_groups WHERE tutor_id = %s) AND role = 'student' ORDER BY group_name, points DESC",
-                        (tutor_id,)
-                    )
-                students = cursor.fetchall()
-                cursor.close()
-                connection.close()
-                if students:
-                    points_text = "📊 Баллы студентов всех ваших групп:\n\n"
-                    for student in students:
-                        points_text += f"• {student['full_name']} ({student['group_name']}): {student['points']} баллов\n"
-                    await update.message.reply_text(points_text)
-                else:
-                    await update.message.reply_text("В ваших группах пока нет студентов.")
-        else:
-            connection = get_db_connection()
-            if connection:
-                cursor = connection.cursor(dictionary=True)
+        await update.message.reply_text("📨 Отправьте сообщение для рассылки выбранной группе:")
+        return BROADCAST_MESSAGE
+
+    if context.user_data.get('choose_points_group'):
+        group = text
+        context.user_data['choose_points_group'] = False
+        # Каталог тьюторов мог быть сброшен или ещё не загружен в этом воркере
+        if group == 'Всем группам' and not TUTOR_DIRECTORY.ensure():
+            await reply_db_unavailable(update)
+            return MENU
+        connection = await db_connection()
+        if not connection:
+            await reply_db_unavailable(update)
+            return MENU
+
+        cursor = connection.cursor(dictionary=True)
+        if group == 'Всем группам':
+            tutor = TUTOR_DIRECTORY.member(user_id)
+            groups = TUTOR_DIRECTORY.groups_of(tutor['id']) if tutor and tutor['role'] == ROLE_TUTOR else []
+            students = []
+            if groups:
+                placeholders = ', '.join(['%s'] * len(groups))
                 cursor.execute(
-                    "SELECT full_name, points FROM users WHERE group_name = %s AND role = 'student' ORDER BY points DESC",
-                    (group,)
+                    f"SELECT full_name, group_name, points FROM users WHERE group_name IN ({placeholders}) AND role = 'student' ORDER BY group_name, points DESC",
+                    tuple(groups)
                 )
                 students = cursor.fetchall()
-                cursor.close()
-                connection.close()
-                if students:
-                    points_text = f"📊 Баллы студентов группы {group}:\n\n"
-                    for student in students:
-                        points_text += f"• {student['full_name']}: {student['points']} баллов\n"
-                    await update.message.reply_text(points_text)
-                else:
-                    await update.message.reply_text("В этой группе пока нет студентов.")
+            cursor.close()
+            connection.close()
+            if students:
+                points_text = "📊 Баллы студентов всех ваших групп:\n\n"
+                for student in students:
+                    points_text += f"• {student['full_name']} ({student['group_name']}): {student['points']} баллов\n"
+                await update.message.reply_text(points_text)
+            else:
+                await update.message.reply_text("В ваших группах пока нет студентов.")
+        else:
+            cursor.execute(
+                "SELECT full_name, points FROM users WHERE group_name = %s AND role = 'student' ORDER BY points DESC",
+                (group,)
+            )
+            students = cursor.fetchall()
+            cursor.close()
+            connection.close()
+            if students:
+                points_text = f"📊 Баллы студентов группы {group}:\n\n"
+                for student in students:
+                    points_text += f"• {student['full_name']}: {student['points']} баллов\n"
+                await update.message.reply_text(points_text)
+            else:
+                await update.message.reply_text("В этой группе пока нет студентов.")
         return MENU
 
     # Обработка кнопок для студентов
@@ -679,6 +2223,8 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
             await stats_command(update, context)
         elif text == '👥 Управление пользователями':
             await manage_users(update, context)
+        elif text == '🎫 Заявки СКС':
+            await sks_inbox_command(update, context)
         elif text == '👥 Список пользователей':
             await show_users_list(update, context)
         elif text == '🔍 Поиск пользователя':
@@ -705,58 +2251,47 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     return MENU
 
 async def choose_points_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT id FROM users WHERE telegram_id = %s AND role = 'tutor'", (user_id,))
-        tutor = cursor.fetchone()
-        if tutor:
-            cursor.execute("SELECT group_name FROM tutor_groups WHERE tutor_id = %s", (tutor['id'],))
-            groups = [row['group_name'] for row in cursor.fetchall()]
-            cursor.close()
-            connection.close()
+    if not TUTOR_DIRECTORY.ensure():
+        await reply_db_unavailable(update)
+        return MENU
 
-            if groups:
-                keyboard = [[group] for group in groups]
-                keyboard.append(['Всем группам'])
-                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-                await update.message.reply_text("Выберите группу для просмотра баллов:", reply_markup=reply_markup)
-                context.user_data['choose_points_group'] = True
-            else:
-                await update.message.reply_text("❌ У вас нет курируемых групп.")
+    tutor = TUTOR_DIRECTORY.member(update.effective_user.id)
+    if tutor and tutor['role'] == ROLE_TUTOR:
+        groups = TUTOR_DIRECTORY.groups_of(tutor['id'])
+        if groups:
+            keyboard = [[group] for group in groups]
+            keyboard.append(['Всем группам'])
+            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+            await update.message.reply_text("Выберите группу для просмотра баллов:", reply_markup=reply_markup)
+            context.user_data['choose_points_group'] = True
         else:
-            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            await update.message.reply_text("❌ У вас нет курируемых групп.")
+    else:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
     return MENU
 
 async def choose_broadcast_group(update, context):
-    user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT id, role FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
-        groups = []
-        if user:
-            if user['role'] == 'tutor':
-                cursor.execute("SELECT group_name FROM tutor_groups WHERE tutor_id = %s", (user['id'],))
-                groups = [row['group_name'] for row in cursor.fetchall()]
-            elif user['role'] == 'admin':
-                cursor.execute("SELECT DISTINCT group_name FROM tutor_groups")
-                groups = [row['group_name'] for row in cursor.fetchall()]
-            cursor.close()
-            connection.close()
-            if groups:
-                keyboard = [[group] for group in groups]
-                keyboard.append(['Всем группам'])
-                keyboard.append(['↩️ Назад'])  # ← добавлено
-                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-                await update.message.reply_text("Выберите группу для рассылки:", reply_markup=reply_markup)
-                return CHOOSE_GROUP
-            else:
-                await update.message.reply_text("❌ Нет доступных групп для рассылки.")
+    if not TUTOR_DIRECTORY.ensure():
+        await reply_db_unavailable(update)
+        return ConversationHandler.END
+
+    user = TUTOR_DIRECTORY.member(update.effective_user.id)
+    if user:
+        if user['role'] == ROLE_ADMIN:
+            groups = TUTOR_DIRECTORY.all_groups()
         else:
-            await update.message.reply_text("❌ У вас нет прав для рассылки.")
+            groups = TUTOR_DIRECTORY.groups_of(user['id'])
+        if groups:
+            keyboard = [[group] for group in groups]
+            keyboard.append(['Всем группам'])
+            keyboard.append(['↩️ Назад'])  # ← добавлено
+            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+            await update.message.reply_text("Выберите группу для рассылки:", reply_markup=reply_markup)
+            return CHOOSE_GROUP
+        else:
+            await update.message.reply_text("❌ Нет доступных групп для рассылки.")
+    else:
+        await update.message.reply_text("❌ У вас нет прав для рассылки.")
     return ConversationHandler.END
 
 async def group_chosen(update, context):
@@ -772,10 +2307,18 @@ async def group_chosen(update, context):
         await update.message.reply_text("📨 Введите сообщение для рассылки выбранной группе:")
         return BROADCAST_MESSAGE
 
+async def run_broadcast(message, chat_ids, method: str, kwargs):
+    success = await BROADCASTS.run(chat_ids, method, kwargs, message.chat_id)
+    if success is None:
+        await message.reply_text("⏸ Бот перезапускается: рассылка сохранена и продолжится после запуска.")
+    else:
+        await message.reply_text(f"✅ Отправлено: {success} из {len(chat_ids)}")
+
+
 async def send_broadcast(update, context):
     target = context.user_data.get('broadcast_target')
     message = update.message
-    connection = get_db_connection()
+    connection = await db_connection()
     if connection:
         cursor = connection.cursor(dictionary=True)
         if target == 'all':
@@ -785,76 +2328,221 @@ async def send_broadcast(update, context):
         users = cursor.fetchall()
         cursor.close()
         connection.close()
-        success = 0
-        for user in users:
-            try:
-                if message.text:
-                    await context.bot.send_message(chat_id=user['telegram_id'], text=message.text)
-                elif message.photo:
-                    await context.bot.send_photo(chat_id=user['telegram_id'], photo=message.photo[-1].file_id,
-                                            caption=message.caption)
-                elif message.document:
-                    await context.bot.send_document(chat_id=user['telegram_id'], document=message.document.file_id,
-                                            caption=message.caption)
-                success += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки: {e}")
-        await update.message.reply_text(f"✅ Отправлено: {success} из {len(users)}")
+        chat_ids = [user['telegram_id'] for user in users if user['telegram_id']]
+        if message.text:
+            method, kwargs = 'send_message', {'text': message.text}
+        elif message.photo:
+            method, kwargs = 'send_photo', {'photo': message.photo[-1].file_id, 'caption': message.caption}
+        elif message.document:
+            method, kwargs = 'send_document', {'document': message.document.file_id, 'caption': message.caption}
+        else:
+            method, kwargs = 'copy_message', {'from_chat_id': message.chat_id, 'message_id': message.message_id}
+        # Рассылка идёт в фоне, чтобы не задерживать обработку остальных апдейтов
+        context.application.create_task(run_broadcast(message, chat_ids, method, kwargs), update=update)
+        AUDIT.record(
+            update.effective_user.id, 'broadcast',
+            f"group:{target}" if isinstance(target, str) else f"groups:{','.join(target)}",
+            f"{method}, получателей: {len(chat_ids)}"
+        )
+        await update.message.reply_text(f"📨 Рассылка запущена: {len(chat_ids)} получателей.")
     else:
-        await update.message.reply_text("❌ Ошибка подключения к базе данных.")
+        await reply_db_unavailable(update)
     return ConversationHandler.END
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return await show_main_menu(update, context)
 
-async def notify_tutors_about_question(context, question_id, question):
-    connection = get_db_connection()
-    if connection:
+# Дайджесты новых вопросов для тьюторов: вопросы копятся TUTOR_DIGEST_WINDOW секунд
+# и уходят одним сообщением на тьютора. Вопрос адресуется тьюторам группы студента,
+# а если их нет — всем тьюторам.
+class TutorNotifier:
+    def __init__(self, window: float):
+        self.window = window
+        self.buffer = {}
+        self.flush_task = None
+        self.flush_now = asyncio.Event()
+
+    @staticmethod
+    def resolve_tutors(asker_id: int):
+        connection = get_db_connection()
+        if not connection:
+            return []
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT telegram_id FROM users WHERE role = 'tutor'")
-        tutors = cursor.fetchall()
+        cursor.execute("SELECT group_name FROM users WHERE telegram_id = %s", (asker_id,))
+        student = cursor.fetchone()
         cursor.close()
         connection.close()
-        for tutor in tutors:
-            if tutor['telegram_id']:
-                keyboard = [
-                    [InlineKeyboardButton("Ответить", callback_data=f"faq_answer_{question_id}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+        if not TUTOR_DIRECTORY.ensure():
+            return []
+        tutors = TUTOR_DIRECTORY.tutor_chat_ids(student['group_name']) if student and student['group_name'] else []
+        return tutors or TUTOR_DIRECTORY.tutor_chat_ids()
+
+    def enqueue(self, asker_id: int, question_id: int, question: str):
+        for tutor_id in self.resolve_tutors(asker_id):
+            self.buffer.setdefault(tutor_id, []).append((question_id, question))
+        if self.buffer and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    # Вопросы, пришедшие во время отправки, попадают в новый буфер — ждут следующего окна
+    async def _flush_later(self):
+        while self.buffer:
+            try:
+                await asyncio.wait_for(self.flush_now.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        buffer, self.buffer = self.buffer, {}
+        for tutor_id, questions in buffer.items():
+            for start in range(0, len(questions), TUTOR_DIGEST_MAX_QUESTIONS):
+                chunk = questions[start:start + TUTOR_DIGEST_MAX_QUESTIONS]
+                if len(chunk) == 1:
+                    question_id, question = chunk[0]
+                    text = f"Новый вопрос от студента:\n\n{question}"
+                    keyboard = [[InlineKeyboardButton("Ответить", callback_data=f"faq_answer_{question_id}")]]
+                else:
+                    text = f"Новые вопросы от студентов ({len(chunk)}):\n\n"
+                    text += "\n\n".join(f"#{question_id}: {question}" for question_id, question in chunk)
+                    keyboard = [
+                        [InlineKeyboardButton(f"Ответить #{question_id}", callback_data=f"faq_answer_{question_id}")]
+                        for question_id, _ in chunk
+                    ]
                 try:
-                    await context.bot.send_message(
-                        chat_id=tutor['telegram_id'],
-                        text=f"Новый вопрос от студента:\n\n{question}",
-                        reply_markup=reply_markup
-                    )
+                    await BULK_SENDER.send('send_message', chat_id=tutor_id, text=text,
+                                           reply_markup=InlineKeyboardMarkup(keyboard))
                 except Exception as e:
-                    logger.error(f"Ошибка отправки вопроса тьютору {tutor['telegram_id']}: {e}")
+                    logger.error(f"Ошибка отправки вопросов тьютору {tutor_id}: {e}")
+
+    async def stop(self):
+        self.flush_now.set()
+        if self.flush_task:
+            await self.flush_task
+        await self.flush()
+
+
+TUTOR_NOTIFIER = TenantLocal(lambda: TutorNotifier(TUTOR_DIGEST_WINDOW))
+
+
+async def notify_tutors_about_question(context, question_id, question, asker_id):
+    TUTOR_NOTIFIER.enqueue(asker_id, question_id, question)
+
+
+# Ответ на нажатие «Ответить»: в дайджесте убираем только нажатую кнопку
+async def resolve_question_button(query, question_id: int, text: str):
+    markup = query.message.reply_markup
+    rows = []
+    if markup:
+        rows = [
+            row for row in markup.inline_keyboard
+            if not any(button.callback_data == f"faq_answer_{question_id}" for button in row)
+        ]
+    if rows:
+        await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(rows))
+        await query.message.reply_text(f"#{question_id}: {text}")
+    else:
+        await query.edit_message_text(text)
 
 async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    connection = get_db_connection()
-    if connection:
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
+
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT id, full_name, group_name, role FROM users LIMIT 30")
+    users = cursor.fetchall()
+    cursor.close()
+    connection.close()
+
+    if users:
+        text = "👥 Список пользователей:\n\n"
+        for u in users:
+            text += f"• ID: {u['id']}, ФИО: {u['full_name']}, Группа: {u['group_name']}, Роль: {u['role']}\n"
+        await update.message.reply_text(text)
+    else:
+        await update.message.reply_text("❌ Пользователи не найдены.")
+
+# Сохранение вопроса студента и уведомление тьюторов
+async def escalate_question(context, user_id: int, question: str) -> bool:
+    connection = await db_connection()
+    if not connection:
+        return False
+    cursor = connection.cursor()
+    cursor.execute(
+        "INSERT INTO faq_questions (user_id, question) VALUES (%s, %s)",
+        (user_id, question)
+    )
+    question_id = cursor.lastrowid
+    connection.commit()
+    cursor.close()
+    connection.close()
+    await notify_tutors_about_question(context, question_id, question, user_id)
+    return True
+
+
+# Поиск по базе вопросов: инвертированный индекс по статичным вопросам
+# и всем отвеченным вопросам из faq_questions
+class FaqIndex:
+    def __init__(self):
+        self.docs = []
+        self.postings = {}
+        self.generation = 0
+
+    @staticmethod
+    def tokenize(text: str):
+        # Грубый стемминг: обрезаем слова до FAQ_STEM_LENGTH символов
+        return [w[:FAQ_STEM_LENGTH] for w in re.findall(r'\w+', text.lower()) if len(w) > 3]
+
+    def add(self, question: str, answer: str):
+        doc_id = len(self.docs)
+        self.docs.append({'question': question, 'answer': answer})
+        for term in set(self.tokenize(question)):
+            self.postings.setdefault(term, []).append(doc_id)
+
+    def load(self):
+        self.docs, self.postings = [], {}
+        for item in FAQ_ENTRIES:
+            self.add(item['question'], item['answer'])
+        connection = get_db_connection()
+        if not connection:
+            logger.error("База вопросов загружена без отвеченных вопросов: нет подключения к БД")
+            return
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT id, full_name, group_name, role FROM users LIMIT 30")
-        users = cursor.fetchall()
+        cursor.execute(
+            "SELECT question, answer FROM faq_questions WHERE status = 'answered' "
+            "UNION ALL SELECT question, answer FROM faq_questions_archive"
+        )
+        for row in cursor.fetchall():
+            self.add(row['question'], row['answer'])
         cursor.close()
         connection.close()
 
-        if users:
-            text = "👥 Список пользователей:\n\n"
-            for u in users:
-                text += f"• ID: {u['id']}, ФИО: {u['full_name']}, Группа: {u['group_name']}, Роль: {u['role']}\n"
-            await update.message.reply_text(text)
-        else:
-            await update.message.reply_text("❌ Пользователи не найдены.")
+    def search(self, text: str, limit: int = 3):
+        generation = GENERATIONS.current('faq')
+        if generation != self.generation:
+            self.generation = generation
+            self.load()
+        terms = set(self.tokenize(text))
+        if not terms:
+            return []
+        total = len(self.docs)
+        weights = {t: math.log(1 + total / len(self.postings[t])) for t in terms if t in self.postings}
+        max_score = sum(weights.values()) + math.log(1 + total) * (len(terms) - len(weights))
+        scores = {}
+        for term, weight in weights.items():
+            for doc_id in self.postings[term]:
+                scores[doc_id] = scores.get(doc_id, 0) + weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [self.docs[doc_id] for doc_id, score in ranked[:limit] if score / max_score >= FAQ_MIN_SCORE]
+
+
+FAQ_INDEX = TenantLocal(FaqIndex)
+
 
 async def show_faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    faq = [
-        {"question": "Как изменить номер телефона?", "answer": "Напишите команду /start и следуйте инструкциям."},
-        {"question": "Как узнать свои баллы?", "answer": "Нажмите кнопку `📊 Мои баллы` в главном меню."},
-        {"question": "Кому писать по вопросам мероприятий?", "answer": "Обратитесь к вашему тьютору или администратору."}
-    ]
     text = "❓ *База вопросов:*\n\n"
-    for item in faq:
+    for item in FAQ_ENTRIES:
         text += f"• *{item['question']}*\n{item['answer']}\n\n"
     keyboard = [
         ['✍️ Задать свой вопрос'],
@@ -869,18 +2557,21 @@ async def ask_question_entry(update, context):
 
 async def handle_prof_union(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor()
-        cursor.execute(
-            "UPDATE users SET is_prof_union = TRUE WHERE telegram_id = %s",
-            (user_id,)
-        )
-        connection.commit()
-        cursor.close()
-        connection.close()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
+
+    cursor = connection.cursor()
+    cursor.execute(
+        "UPDATE users SET is_prof_union = TRUE WHERE telegram_id = %s",
+        (user_id,)
+    )
+    connection.commit()
+    cursor.close()
+    connection.close()
 
-        await update.message.reply_text("✅ Спасибо за регистрацию в профсоюзе!")
+    await update.message.reply_text("✅ Спасибо за регистрацию в профсоюзе!")
 
 
 async def manage_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -895,7 +2586,8 @@ async def manage_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start_set_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Для изменения баллов используйте команду /setpoints <ID_пользователя> <количество_баллов>\n\n"
-        "Например: /setpoints 15 10"
+        "Например: /setpoints 15 10\n\n"
+        "Для нескольких студентов сразу — /bulkpoints"
     )
 
 
@@ -908,39 +2600,878 @@ async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("👥 Управление пользователями:", reply_markup=reply_markup)
 
 
-# Показ мероприятий
-async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    connection = get_db_connection()
-    if connection:
+# Кэш календаря: готовые страницы ближайших мероприятий.
+# Сбрасывается при добавлении/изменении/удалении мероприятия и сам устаревает,
+# когда проходит самое раннее из них (или через CALENDAR_CACHE_TTL секунд).
+class EventsCalendarCache:
+    def __init__(self):
+        self.pages = None
+        self.expires_at = None
+        self.generation = 0
+
+    def invalidate(self):
+        self.pages = None
+        self.expires_at = None
+
+    def _load(self):
+        connection = get_db_connection()
+        if not connection:
+            return False
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM events WHERE event_date >= NOW() ORDER BY event_date LIMIT 10")
+        cursor.execute(
+            "SELECT id, title, event_date FROM events WHERE event_date >= NOW() ORDER BY event_date LIMIT %s",
+            (CALENDAR_CACHE_LIMIT,)
+        )
         events = cursor.fetchall()
         cursor.close()
         connection.close()
 
-        if events:
-            events_text = "📅 Вот список ближайших мероприятий! \n Не пропустите интересные события и получайте баллы за участие 🏆"
-            for event in events:
+        pages = []
+        for start in range(0, len(events), EVENTS_PAGE_SIZE):
+            events_text = "📅 Вот список ближайших мероприятий! \n Не пропустите интересные события и получайте баллы за участие 🏆\n\n"
+            for event in events[start:start + EVENTS_PAGE_SIZE]:
                 events_text += f"• {event['title']} - {event['event_date'].strftime('%d.%m.%Y %H:%M')}\n"
+            pages.append(events_text)
+
+        self.pages = pages
+        self.expires_at = datetime.now() + timedelta(seconds=CALENDAR_CACHE_TTL)
+        if events:
+            self.expires_at = min(self.expires_at, events[0]['event_date'])
+        return True
+
+    # Возвращает (текст, число страниц) или None, если БД недоступна
+    def get_page(self, page: int):
+        generation = GENERATIONS.current('events')
+        if generation != self.generation:
+            self.generation = generation
+            self.invalidate()
+        if self.pages is None or datetime.now() >= self.expires_at:
+            if not self._load():
+                return None
+        if not self.pages:
+            return "На данный момент мероприятий нет.", 0
+        page = max(0, min(page, len(self.pages) - 1))
+        text = self.pages[page]
+        if len(self.pages) > 1:
+            text += f"\nСтраница {page + 1} из {len(self.pages)}"
+        return text, len(self.pages)
+
+
+CALENDAR_CACHE = TenantLocal(EventsCalendarCache)
+
+
+# Мероприятия изменились: сбросить календарь здесь и в остальных воркерах
+def events_changed():
+    CALENDAR_CACHE.invalidate()
+    GENERATIONS.bump('events')
+
+
+# Напоминания о мероприятиях: куча (время срабатывания, мероприятие).
+# Изменение мероприятия — O(log n): старые записи в куче не удаляются,
+# а отбрасываются при извлечении по несовпадению версии.
+class ReminderScheduler:
+    def __init__(self, offsets):
+        self.offsets = sorted(offsets, reverse=True)
+        self.heap = []
+        self.events = {}
+        self.versions = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sending = set()
+
+    def load(self):
+        connection = get_db_connection()
+        if not connection:
+            logger.error("Напоминания не загружены: нет подключения к БД")
+            return
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT id, title, event_date FROM events WHERE event_date >= NOW()")
+        events = cursor.fetchall()
+        cursor.close()
+        connection.close()
+        for event in events:
+            self.schedule(event['id'], event['title'], event['event_date'])
+
+    # Полная перезагрузка, когда мероприятия изменил другой воркер
+    def reload(self):
+        self.heap = []
+        self.events = {}
+        self.load()
+        self.wakeup.set()
+
+    def schedule(self, event_id: int, title: str, event_date: datetime):
+        version = next(self.versions)
+        now = datetime.now()
+        pending = 0
+        for offset in self.offsets:
+            fire_at = event_date - timedelta(minutes=offset)
+            if fire_at > now:
+                heapq.heappush(self.heap, (fire_at, event_id, version))
+                pending += 1
+        if pending:
+            self.events[event_id] = {'title': title, 'event_date': event_date, 'version': version, 'pending': pending}
+            self.wakeup.set()
+        else:
+            self.events.pop(event_id, None)
+
+    def cancel(self, event_id: int):
+        self.events.pop(event_id, None)
+
+    # Мероприятие добавлено, изменено или удалено (event=None). Напоминания ведёт только
+    # воркер 0; остальные воркеры сообщают ему об изменении счётчиком 'events' (events_changed),
+    # по которому run() перечитывает мероприятия из БД
+    def update(self, event_id: int, event: dict = None):
+        if WORKER_INDEX != 0:
+            return
+        if event:
+            self.schedule(event_id, event['title'], event['event_date'])
+        else:
+            self.cancel(event_id)
+
+    def _pop_due(self):
+        now = datetime.now()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, event_id, version = heapq.heappop(self.heap)
+            event = self.events.get(event_id)
+            if not event or event['version'] != version:
+                continue
+            due.append(dict(event))
+            event['pending'] -= 1
+            if not event['pending']:
+                del self.events[event_id]
+        return due
+
+    async def run(self):
+        generation = GENERATIONS.current('events')
+        while True:
+            self.wakeup.clear()
+            if GENERATIONS.current('events') != generation:
+                generation = GENERATIONS.current('events')
+                self.reload()
+            due = self._pop_due()
+            if due:
+                task = asyncio.create_task(self._send(due))
+                self.sending.add(task)
+                task.add_done_callback(self.sending.discard)
+            timeout = SHARED_POLL_INTERVAL if GENERATIONS.counters is not None else 3600
+            if self.heap:
+                timeout = min(timeout, max(0.0, (self.heap[0][0] - datetime.now()).total_seconds()))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # Одна рассылка на все мероприятия, у которых наступило время напоминания
+    async def _send(self, due):
+        connection = await db_connection()
+        if not connection:
+            logger.error("Напоминания не отправлены: нет подключения к БД")
+            return
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT telegram_id FROM users WHERE role = 'student' AND telegram_id IS NOT NULL")
+        students = [row['telegram_id'] for row in cursor.fetchall()]
+        cursor.close()
+        connection.close()
+
+        text = "⏰ Напоминание о мероприятиях:\n\n"
+        for event in sorted(due, key=lambda e: e['event_date']):
+            text += f"• {event['title']} - {event['event_date'].strftime('%d.%m.%Y %H:%M')}\n"
+        sent = await BULK_SENDER.send_many(students, 'send_message', text=text)
+        logger.info(f"Напоминание о {len(due)} мероприятиях отправлено {sent} из {len(students)} студентов")
+
+    def start(self):
+        self.load()
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+        for task in self.sending:
+            task.cancel()
+
+
+REMINDERS = TenantLocal(lambda: ReminderScheduler(REMINDER_OFFSETS))
+
+
+# Аналитика посещаемости на агрегатах, которые обновляются при каждой отметке
+# в той же транзакции: явка по мероприятиям, отметки по группам, серии студентов.
+# Отчёты читают только агрегаты и не зависят от размера event_attendance
+class AttendanceStats:
+    TABLES = (
+        "CREATE TABLE IF NOT EXISTS attendance_event_stats ("
+        "event_id INT NOT NULL PRIMARY KEY, attendees INT NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS attendance_group_stats ("
+        "group_name VARCHAR(64) NOT NULL PRIMARY KEY, checkins INT NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS attendance_student_stats ("
+        "telegram_id BIGINT NOT NULL PRIMARY KEY, attended INT NOT NULL DEFAULT 0, "
+        "streak INT NOT NULL DEFAULT 0, best_streak INT NOT NULL DEFAULT 0, "
+        "last_event_id INT, last_event_date DATETIME)",
+    )
+
+    def ensure_tables(self) -> bool:
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return False
+        cursor = connection.cursor(dictionary=True)
+        for statement in self.TABLES:
+            cursor.execute(statement)
+        connection.commit()
+        cursor.execute("SELECT COUNT(*) AS total FROM attendance_event_stats")
+        empty = cursor.fetchone()['total'] == 0
+        cursor.execute("SELECT COUNT(*) AS total FROM event_attendance")
+        history = cursor.fetchone()['total'] > 0
+        cursor.close()
+        connection.close()
+        # Первый запуск на существующей истории: посчитать агрегаты целиком
+        if empty and history and WORKER_INDEX == 0:
+            self.rebuild()
+        return True
+
+    # Учёт отметки; вызывается курсором той же транзакции, что вставляет event_attendance
+    def record(self, cursor, event: dict, telegram_id: int):
+        cursor.execute(
+            "INSERT INTO attendance_event_stats (event_id, attendees) VALUES (%s, 1) "
+            "ON DUPLICATE KEY UPDATE attendees = attendees + 1",
+            (event['id'],)
+        )
+        cursor.execute("SELECT group_name FROM users WHERE telegram_id = %s", (telegram_id,))
+        user = cursor.fetchone()
+        if user and user['group_name']:
+            cursor.execute(
+                "INSERT INTO attendance_group_stats (group_name, checkins) VALUES (%s, 1) "
+                "ON DUPLICATE KEY UPDATE checkins = checkins + 1",
+                (user['group_name'],)
+            )
+
+        cursor.execute(
+            "SELECT attended, streak, best_streak, last_event_id, last_event_date "
+            "FROM attendance_student_stats WHERE telegram_id = %s",
+            (telegram_id,)
+        )
+        student = cursor.fetchone() or {
+            'attended': 0, 'streak': 0, 'best_streak': 0, 'last_event_id': None, 'last_event_date': None
+        }
+        attended = student['attended'] + 1
+        streak, last_event_id, last_event_date = student['streak'], student['last_event_id'], student['last_event_date']
+        # Отметка задним числом на более раннем мероприятии серию не меняет
+        if last_event_date is None or (event['event_date'], event['id']) > (last_event_date, last_event_id):
+            # Предыдущее мероприятие ищется и среди архивных — так же, как в rebuild()
+            cursor.execute(
+                "SELECT id, event_date FROM events WHERE event_date < %s OR (event_date = %s AND id < %s) "
+                "UNION ALL SELECT id, event_date FROM events_archive "
+                "WHERE event_date < %s OR (event_date = %s AND id < %s) "
+                "ORDER BY event_date DESC, id DESC LIMIT 1",
+                (event['event_date'], event['event_date'], event['id']) * 2
+            )
+            previous = cursor.fetchone()
+            streak = streak + 1 if previous and previous['id'] == last_event_id else 1
+            last_event_id, last_event_date = event['id'], event['event_date']
+        cursor.execute(
+            "INSERT INTO attendance_student_stats "
+            "(telegram_id, attended, streak, best_streak, last_event_id, last_event_date) "
+            "VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE attended = VALUES(attended), streak = VALUES(streak), "
+            "best_streak = VALUES(best_streak), last_event_id = VALUES(last_event_id), "
+            "last_event_date = VALUES(last_event_date)",
+            (telegram_id, attended, streak, max(student['best_streak'], streak), last_event_id, last_event_date)
+        )
+
+    # Удаление мероприятия меняет не только его явку: отметки уходят из счётчиков групп
+    # и студентов, а соседние мероприятия смыкаются в сериях. Поэтому агрегаты
+    # пересчитываются целиком курсором той же транзакции, что удаляет мероприятие
+    def forget_event(self, cursor, event_id: int):
+        cursor.execute("DELETE FROM event_attendance WHERE event_id = %s", (event_id,))
+        self.recompute(cursor)
+
+    # Полный пересчёт агрегатов по event_attendance и её архиву: при первом запуске и по /analytics rebuild
+    def rebuild(self) -> bool:
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return False
+        cursor = connection.cursor(dictionary=True)
+        events, students = self.recompute(cursor)
+        connection.commit()
+        cursor.close()
+        connection.close()
+        logger.info(f"Аналитика посещаемости пересчитана: {events} мероприятий, {students} студентов")
+        return True
+
+    # Пересчёт без фиксации транзакции; возвращает (мероприятий с явкой, студентов)
+    def recompute(self, cursor):
+        cursor.execute(
+            "SELECT id, event_date FROM events UNION ALL SELECT id, event_date FROM events_archive "
+            "ORDER BY event_date, id"
+        )
+        events = cursor.fetchall()
+        position = {event['id']: index for index, event in enumerate(events)}
+        cursor.execute("SELECT telegram_id, group_name FROM users WHERE telegram_id IS NOT NULL")
+        groups = {row['telegram_id']: row['group_name'] for row in cursor.fetchall()}
+        cursor.execute(
+            "SELECT event_id, user_id FROM event_attendance "
+            "UNION ALL SELECT event_id, user_id FROM event_attendance_archive"
+        )
+        attendees, group_checkins, visits = {}, {}, {}
+        for row in cursor.fetchall():
+            if row['event_id'] not in position:
+                continue
+            attendees[row['event_id']] = attendees.get(row['event_id'], 0) + 1
+            group = groups.get(row['user_id'])
+            if group:
+                group_checkins[group] = group_checkins.get(group, 0) + 1
+            visits.setdefault(row['user_id'], []).append(position[row['event_id']])
+
+        students = []
+        for telegram_id, positions in visits.items():
+            positions.sort()
+            streak = best_streak = 0
+            previous = None
+            for index in positions:
+                streak = streak + 1 if previous is not None and index == previous + 1 else 1
+                best_streak = max(best_streak, streak)
+                previous = index
+            last = events[positions[-1]]
+            students.append((telegram_id, len(positions), streak, best_streak, last['id'], last['event_date']))
+
+        cursor.execute("DELETE FROM attendance_event_stats")
+        cursor.execute("DELETE FROM attendance_group_stats")
+        cursor.execute("DELETE FROM attendance_student_stats")
+        cursor.executemany(
+            "INSERT INTO attendance_event_stats (event_id, attendees) VALUES (%s, %s)", list(attendees.items())
+        )
+        cursor.executemany(
+            "INSERT INTO attendance_group_stats (group_name, checkins) VALUES (%s, %s)", list(group_checkins.items())
+        )
+        cursor.executemany(
+            "INSERT INTO attendance_student_stats "
+            "(telegram_id, attended, streak, best_streak, last_event_id, last_event_date) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            students
+        )
+        return len(attendees), len(students)
+
+    # Последние прошедшие мероприятия с числом отметившихся, от старых к новым
+    @staticmethod
+    def recent_events(cursor):
+        cursor.execute(
+            "SELECT e.id, e.title, e.event_date, COALESCE(s.attendees, 0) AS attendees "
+            "FROM events e LEFT JOIN attendance_event_stats s ON s.event_id = e.id "
+            "WHERE e.event_date <= NOW() ORDER BY e.event_date DESC, e.id DESC LIMIT %s",
+            (ANALYTICS_EVENTS,)
+        )
+        return list(reversed(cursor.fetchall()))
+
+    @staticmethod
+    def registered_students(cursor):
+        cursor.execute(
+            "SELECT group_name, COUNT(*) AS total FROM users "
+            "WHERE role = 'student' AND telegram_id IS NOT NULL GROUP BY group_name"
+        )
+        return {row['group_name']: row['total'] for row in cursor.fetchall()}
+
+    # Текст отчёта или None, если БД недоступна
+    def overview(self):
+        connection = get_db_connection()
+        if not connection:
+            return None
+        cursor = connection.cursor(dictionary=True)
+        events = self.recent_events(cursor)
+        registered = self.registered_students(cursor)
+        cursor.execute("SELECT COUNT(*) AS total FROM events WHERE event_date <= NOW()")
+        past_events = cursor.fetchone()['total']
+        cursor.execute("SELECT COUNT(*) AS total FROM events_archive")
+        past_events += cursor.fetchone()['total']
+        cursor.execute("SELECT group_name, checkins FROM attendance_group_stats ORDER BY group_name")
+        group_checkins = cursor.fetchall()
+        streaks = []
+        if events:
+            # Текущая серия жива, только если студент был на последнем прошедшем мероприятии
+            cursor.execute(
+                "SELECT u.full_name, u.group_name, s.streak, s.best_streak FROM attendance_student_stats s "
+                "JOIN users u ON u.telegram_id = s.telegram_id "
+                "WHERE s.last_event_id = %s ORDER BY s.streak DESC, s.best_streak DESC LIMIT 5",
+                (events[-1]['id'],)
+            )
+            streaks = cursor.fetchall()
+        cursor.close()
+        connection.close()
+
+        total = sum(registered.values())
+        text = f"📈 Посещаемость (зарегистрировано студентов: {total}, прошло мероприятий: {past_events})\n\n"
+        text += "Последние мероприятия:\n"
+        for event in reversed(events):
+            share = event['attendees'] / total * 100 if total else 0
+            text += (
+                f"• {event['event_date'].strftime('%d.%m.%Y')} {event['title']}: "
+                f"{event['attendees']} ({share:.1f}%)\n"
+            )
+        if not events:
+            text += "• пока не было\n"
+
+        text += "\nЯвка по группам (отметок на студента за мероприятие):\n"
+        for row in group_checkins:
+            size = registered.get(row['group_name'], 0)
+            ratio = row['checkins'] / (size * past_events) * 100 if size and past_events else 0
+            text += f"• {row['group_name']}: {ratio:.1f}% ({row['checkins']} отметок, {size} студ.)\n"
+        if not group_checkins:
+            text += "• нет отметок\n"
+
+        if streaks:
+            text += "\n🔥 Серии подряд:\n"
+            for row in streaks:
+                text += f"• {row['full_name']} ({row['group_name']}): {row['streak']}, лучшая {row['best_streak']}\n"
+        return text
+
+    # Зарегистрированные студенты без единой отметки (всего, первые имена) или None
+    def never_attended(self, group: str = None):
+        connection = get_db_connection()
+        if not connection:
+            return None
+        cursor = connection.cursor(dictionary=True)
+        condition, params = "", ()
+        if group:
+            condition, params = " AND u.group_name = %s", (group,)
+        cursor.execute(
+            "SELECT u.full_name, u.group_name FROM users u "
+            "LEFT JOIN attendance_student_stats s ON s.telegram_id = u.telegram_id "
+            "WHERE u.role = 'student' AND u.telegram_id IS NOT NULL AND s.telegram_id IS NULL"
+            f"{condition} ORDER BY u.group_name, u.full_name",
+            params
+        )
+        students = cursor.fetchall()
+        cursor.close()
+        connection.close()
+        return len(students), students[:ANALYTICS_LIST_LIMIT]
+
+    # PNG с явкой на последних мероприятиях или None, если БД недоступна
+    def chart(self):
+        connection = get_db_connection()
+        if not connection:
+            return None
+        cursor = connection.cursor(dictionary=True)
+        events = self.recent_events(cursor)
+        total = sum(self.registered_students(cursor).values())
+        cursor.close()
+        connection.close()
+
+        figure, axes = pyplot.subplots(figsize=(8, 4.5))
+        labels = [f"{event['event_date'].strftime('%d.%m')}\n{event['title'][:12]}" for event in events]
+        counts = [event['attendees'] for event in events]
+        bars = axes.bar(range(len(events)), counts, color='#4c72b0')
+        for bar, count in zip(bars, counts):
+            share = count / total * 100 if total else 0
+            axes.annotate(f"{share:.0f}%", (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                          ha='center', va='bottom', fontsize=8)
+        axes.set_xticks(range(len(events)))
+        axes.set_xticklabels(labels, fontsize=7)
+        axes.set_ylabel("Отметились")
+        axes.set_title("Явка на последних мероприятиях")
+        figure.tight_layout()
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format='png', dpi=120)
+        pyplot.close(figure)
+        return buffer.getvalue()
+
+
+ATTENDANCE_STATS = AttendanceStats()
+
+
+# Удаление мероприятия вместе с его отметками и пересчётом аналитики, одной транзакцией.
+# Пересчёт читает всю историю, поэтому вызывается в отдельном потоке
+def delete_event(event_id: int):
+    connection = get_db_connection(primary=True)
+    if not connection:
+        raise ConnectionError("нет подключения к базе данных")
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("DELETE FROM events WHERE id = %s", (event_id,))
+        ATTENDANCE_STATS.forget_event(cursor, event_id)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
 
-            await update.message.reply_text(events_text)
+
+# Перенос старых строк из растущих таблиц в *_archive небольшими пачками:
+# прошедшие мероприятия вместе с отметками, отвеченные вопросы, решённые заявки СКС.
+# Каждая пачка — отдельная короткая транзакция, чтобы не держать блокировки
+class Archiver:
+    TABLES = (
+        "CREATE TABLE IF NOT EXISTS events_archive ("
+        "id INT NOT NULL PRIMARY KEY, title VARCHAR(255) NOT NULL, event_date DATETIME NOT NULL, "
+        "attendance_code VARCHAR(16), archived_at DATETIME)",
+        "CREATE TABLE IF NOT EXISTS event_attendance_archive ("
+        "id INT NOT NULL, event_id INT NOT NULL, user_id BIGINT NOT NULL, archived_at DATETIME, "
+        "PRIMARY KEY (event_id, id))",
+        "CREATE TABLE IF NOT EXISTS faq_questions_archive ("
+        "id INT NOT NULL PRIMARY KEY, user_id BIGINT NOT NULL, question TEXT NOT NULL, answer TEXT, "
+        "status VARCHAR(32) NOT NULL, tutor_id BIGINT, created_at DATETIME, archived_at DATETIME)",
+        "CREATE TABLE IF NOT EXISTS sks_applications_archive ("
+        "id INT NOT NULL, user_id BIGINT NOT NULL, photo_url TEXT, status VARCHAR(32) NOT NULL, "
+        "created_at DATETIME, archived_at DATETIME, PRIMARY KEY (user_id, id))",
+    )
+    COLUMNS = {
+        'events': 'id, title, event_date, attendance_code',
+        'event_attendance': 'id, event_id, user_id',
+        'faq_questions': 'id, user_id, question, answer, status, tutor_id, created_at',
+        'sks_applications': 'id, user_id, photo_url, status, created_at',
+    }
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.last_run = None
+        self.last_moved = {}
+
+    def ensure_tables(self):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return
+        cursor = connection.cursor()
+        for statement in self.TABLES:
+            cursor.execute(statement)
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    # Одна пачка: скопировать строки с данными id в архив и удалить из основной таблицы
+    @classmethod
+    def move_batch(cls, cursor, table: str, ids):
+        placeholders = ', '.join(['%s'] * len(ids))
+        columns = cls.COLUMNS[table]
+        cursor.execute(
+            f"INSERT INTO {table}_archive ({columns}, archived_at) "
+            f"SELECT {columns}, NOW() FROM {table} WHERE id IN ({placeholders})",
+            tuple(ids)
+        )
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", tuple(ids))
+
+    # Переносит строки, которые выбирает select (id ... LIMIT %s), пока они не кончатся
+    def move_all(self, connection, table: str, select: str, params=()) -> int:
+        moved = 0
+        while True:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute(select, params + (ARCHIVE_BATCH_SIZE,))
+            ids = [row['id'] for row in cursor.fetchall()]
+            if ids:
+                self.move_batch(cursor, table, ids)
+            connection.commit()
+            cursor.close()
+            if not ids:
+                return moved
+            moved += len(ids)
+            time.sleep(ARCHIVE_BATCH_PAUSE)
+
+    # Полный проход архивации, возвращает число перенесённых строк по таблицам
+    def archive(self):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return None
+        now = datetime.now()
+        moved = {table: 0 for table in self.COLUMNS}
+        try:
+            # Мероприятия — пачками, сначала отметки на них, потом сами мероприятия
+            while True:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute(
+                    "SELECT id FROM events WHERE event_date < %s ORDER BY event_date LIMIT %s",
+                    (now - timedelta(days=ARCHIVE_EVENTS_DAYS), ARCHIVE_BATCH_SIZE)
+                )
+                event_ids = tuple(row['id'] for row in cursor.fetchall())
+                cursor.close()
+                if not event_ids:
+                    break
+                placeholders = ', '.join(['%s'] * len(event_ids))
+                moved['event_attendance'] += self.move_all(
+                    connection, 'event_attendance',
+                    f"SELECT id FROM event_attendance WHERE event_id IN ({placeholders}) LIMIT %s", event_ids
+                )
+                cursor = connection.cursor()
+                self.move_batch(cursor, 'events', event_ids)
+                connection.commit()
+                cursor.close()
+                moved['events'] += len(event_ids)
+
+            moved['faq_questions'] = self.move_all(
+                connection, 'faq_questions',
+                "SELECT id FROM faq_questions WHERE status = 'answered' AND created_at < %s LIMIT %s",
+                (now - timedelta(days=ARCHIVE_FAQ_DAYS),)
+            )
+            moved['sks_applications'] = self.move_all(
+                connection, 'sks_applications',
+                "SELECT id FROM sks_applications WHERE status <> 'pending' AND created_at < %s LIMIT %s",
+                (now - timedelta(days=ARCHIVE_SKS_DAYS),)
+            )
+        finally:
+            connection.close()
+        return moved
+
+    # Запуск прохода из бота: не чаще одного одновременно, в отдельном потоке
+    async def run_once(self):
+        async with self.lock:
+            try:
+                moved = await asyncio.to_thread(self.archive)
+            except Error as e:
+                logger.error(f"Ошибка архивации: {e}")
+                return None
+            if moved is None:
+                return None
+            self.last_run, self.last_moved = datetime.now(), moved
+            if any(moved.values()):
+                logger.info(f"Архивация: {moved}")
+            return moved
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def start(self):
+        self.ensure_tables()
+        # В многопроцессном режиме архивирует только первый воркер
+        if self.interval > 0 and WORKER_INDEX == 0:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    # Сводка по архиву для /archive или None, если БД недоступна
+    def report(self):
+        connection = get_db_connection()
+        if not connection:
+            return None
+        cursor = connection.cursor(dictionary=True)
+        text = "🗄 Архив:\n"
+        for table in self.COLUMNS:
+            cursor.execute(f"SELECT COUNT(*) AS total FROM {table}_archive")
+            text += f"• {table}: {cursor.fetchone()['total']}\n"
+        cursor.close()
+        connection.close()
+        text += (
+            f"\nХраним в рабочих таблицах: мероприятия {ARCHIVE_EVENTS_DAYS} дн., "
+            f"вопросы {ARCHIVE_FAQ_DAYS} дн., заявки СКС {ARCHIVE_SKS_DAYS} дн.\n"
+        )
+        if self.last_run:
+            text += f"Последний перенос: {self.last_run.strftime('%d.%m.%Y %H:%M')}, {self.last_moved}"
         else:
-            await update.message.reply_text("На данный момент мероприятий нет.")
+            text += "С момента запуска перенос не выполнялся."
+        return text
+
+    # Поиск по архиву: events <название>, faq <текст>, sks <telegram_id>. Строки или None
+    def search(self, kind: str, term: str):
+        queries = {
+            'events': (
+                "SELECT e.id, e.title, e.event_date, COUNT(a.id) AS attendees FROM events_archive e "
+                "LEFT JOIN event_attendance_archive a ON a.event_id = e.id "
+                "WHERE e.title LIKE %s GROUP BY e.id, e.title, e.event_date ORDER BY e.event_date DESC LIMIT %s",
+                f'%{term}%'
+            ),
+            'faq': (
+                "SELECT id, question, answer, created_at FROM faq_questions_archive "
+                "WHERE question LIKE %s ORDER BY id DESC LIMIT %s",
+                f'%{term}%'
+            ),
+            'sks': (
+                "SELECT id, user_id, status, created_at FROM sks_applications_archive "
+                "WHERE user_id = %s ORDER BY id DESC LIMIT %s",
+                int(term) if term.isdigit() else 0
+            ),
+        }
+        sql, param = queries[kind]
+        connection = get_db_connection()
+        if not connection:
+            return None
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(sql, (param, ARCHIVE_QUERY_LIMIT))
+        rows = cursor.fetchall()
+        cursor.close()
+        connection.close()
+        return rows
+
+
+ARCHIVER = TenantLocal(lambda: Archiver(ARCHIVE_INTERVAL))
+
+
+# Журнал действий админов и тьюторов. Записи копятся в памяти и пишутся
+# в audit_log многострочными INSERT из фоновой задачи, не задерживая ответы
+class AuditLog:
+    TABLES = {
+        'mysql': (
+            "CREATE TABLE IF NOT EXISTS audit_log ("
+            "id BIGINT AUTO_INCREMENT PRIMARY KEY, created_at DATETIME NOT NULL, actor_id BIGINT, "
+            "action VARCHAR(32) NOT NULL, target VARCHAR(64), details TEXT, "
+            "INDEX idx_audit_actor (actor_id, created_at), INDEX idx_audit_target (target, created_at), "
+            "INDEX idx_audit_time (created_at))",
+        ),
+        'sqlite': (
+            "CREATE TABLE IF NOT EXISTS audit_log ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at DATETIME NOT NULL, actor_id BIGINT, "
+            "action VARCHAR(32) NOT NULL, target VARCHAR(64), details TEXT)",
+            "CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_log (actor_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_audit_target ON audit_log (target, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_audit_time ON audit_log (created_at)",
+        ),
+    }
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def ensure_table(self):
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return
+        cursor = connection.cursor()
+        for statement in self.TABLES[DB_BACKEND]:
+            cursor.execute(statement)
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    # target — что изменено: user:<users.id>, tg:<telegram_id>, event:<id>, group:<название>
+    def record(self, actor_id: int, action: str, target: str = None, details: str = None):
+        self.pending.append((datetime.now(), actor_id, action, target, details))
+        if len(self.pending) > AUDIT_MAX_PENDING:
+            del self.pending[0]
+            self.dropped += 1
+        if len(self.pending) >= AUDIT_BATCH_SIZE:
+            self.wakeup.set()
+
+    @staticmethod
+    def write(batch) -> bool:
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return False
+        cursor = connection.cursor()
+        for start in range(0, len(batch), AUDIT_BATCH_SIZE):
+            rows = batch[start:start + AUDIT_BATCH_SIZE]
+            cursor.execute(
+                "INSERT INTO audit_log (created_at, actor_id, action, target, details) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows)),
+                tuple(value for row in rows for value in row)
+            )
+        connection.commit()
+        cursor.close()
+        connection.close()
+        return True
+
+    async def flush(self) -> bool:
+        async with self.lock:
+            if not self.pending:
+                return True
+            batch, self.pending = self.pending, []
+            try:
+                written = await asyncio.to_thread(with_db_retry, self.write, batch)
+            except Error as e:
+                logger.error(f"Ошибка записи журнала действий: {e}")
+                written = False
+            if not written:
+                # Вернуть в начало очереди, лишнее сверх лимита отбросить
+                self.pending[:0] = batch
+                overflow = len(self.pending) - AUDIT_MAX_PENDING
+                if overflow > 0:
+                    del self.pending[:overflow]
+                    self.dropped += overflow
+            return written
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self.ensure_table()
+        self.task = asyncio.create_task(self.run())
+
+    # Остановка с дозаписью всего накопленного
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        if not await self.flush():
+            logger.error(f"При остановке не записано действий в журнал: {len(self.pending)}")
+
+    # Последние записи по фильтрам {actor, action, target, since, until} или None, если БД недоступна
+    def search(self, filters):
+        conditions, params = [], []
+        for key, column in (('actor', 'actor_id'), ('action', 'action'), ('target', 'target')):
+            if key in filters:
+                conditions.append(f"{column} = %s")
+                params.append(filters[key])
+        if 'since' in filters:
+            conditions.append("created_at >= %s")
+            params.append(filters['since'])
+        if 'until' in filters:
+            conditions.append("created_at < %s")
+            params.append(filters['until'])
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        connection = get_db_connection()
+        if not connection:
+            return None
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            f"SELECT created_at, actor_id, action, target, details FROM audit_log {where}"
+            "ORDER BY created_at DESC LIMIT %s",
+            (*params, AUDIT_QUERY_LIMIT)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        connection.close()
+        return rows
+
+
+AUDIT = TenantLocal(lambda: AuditLog(AUDIT_FLUSH_INTERVAL))
+
+
+def events_page_markup(page: int, total: int):
+    if total <= 1:
+        return None
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"events_page_{page - 1}"))
+    if page < total - 1:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"events_page_{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+
+# Показ мероприятий
+async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    result = CALENDAR_CACHE.get_page(0)
+    if not result:
+        await reply_db_unavailable(update)
+        return
+    text, total = result
+    await update.message.reply_text(text, reply_markup=events_page_markup(0, total))
 
 
 # Показ баллов пользователя
 async def show_my_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT points FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
 
-        if user:
-            await update.message.reply_text(f"📊 Ваши баллы: {user['points']}")
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT points FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    connection.close()
+
+    if user:
+        await update.message.reply_text(f"📊 Ваши баллы: {user['points']}")
 
 
 # Запрос фото для СКС
@@ -963,11 +3494,9 @@ async def handle_sks_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SKS_PHOTO
 
     user_id = update.effective_user.id
-    connection = get_db_connection()
+    connection = await db_connection()
     if not connection:
-        await update.message.reply_text(
-            "⚠️ Не удалось подключиться к базе данных. Попробуйте позже."
-        )
+        await reply_db_unavailable(update)
         return SKS_PHOTO
 
     try:
@@ -979,49 +3508,180 @@ async def handle_sks_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         connection.commit()
         cursor.close()
         connection.close()
+        # Новая заявка — прежнее решение по кнопкам больше не действует
+        CALLBACK_DEDUP.forget(f"sks_{user_id}")
     except Exception as e:
         logger.error(f"Ошибка записи заявки СКС: {e}")
         await update.message.reply_text("❌ Не удалось сохранить заявку. Попробуйте позже.")
         return SKS_PHOTO
 
-    try:
-        await notify_admins_about_sks(update, context, user_id, photo.file_id)
-    except Exception as e:
-        logger.error(f"Ошибка уведомления админов: {e}")
-
     await update.message.reply_text("✅ Заявка отправлена на рассмотрение!")
     return await show_main_menu(update, context)
 
 
-# Уведомление админов о новой заявке СКС
-async def notify_admins_about_sks(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, photo_id: str):
+# Очередь заявок СКС для админов: страницы с фото, выбор нескольких заявок
+# и пакетное решение одной транзакцией
+def load_sks_page(page: int):
     connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE role = 'admin'")
-        admins = cursor.fetchall()
+    if not connection:
+        return None
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute(
+        "SELECT s.id, s.user_id, s.photo_url, u.full_name, u.group_name "
+        "FROM sks_applications s LEFT JOIN users u ON u.telegram_id = s.user_id "
+        "WHERE s.status = 'pending' ORDER BY s.id LIMIT %s OFFSET %s",
+        (SKS_INBOX_PAGE_SIZE, page * SKS_INBOX_PAGE_SIZE)
+    )
+    apps = cursor.fetchall()
+    cursor.execute("SELECT COUNT(*) AS total FROM sks_applications WHERE status = 'pending'")
+    total = cursor.fetchone()['total']
+    cursor.close()
+    connection.close()
+    return apps, total
+
+
+def sks_inbox_markup(context):
+    inbox = context.user_data['sks_inbox']
+    selected = context.user_data.setdefault('sks_selected', set())
+    keyboard = [
+        [InlineKeyboardButton(f"{'☑️' if app_id in selected else '⬜'} {label}", callback_data=f"sksq_t_{app_id}")]
+        for app_id, label in inbox['apps']
+    ]
+    keyboard.append([InlineKeyboardButton("☑️ Выбрать все на странице", callback_data="sksq_all")])
+    keyboard.append([
+        InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", callback_data="sksq_approve"),
+        InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data="sksq_reject")
+    ])
+    navigation = []
+    if inbox['page'] > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"sksq_p_{inbox['page'] - 1}"))
+    if (inbox['page'] + 1) * SKS_INBOX_PAGE_SIZE < inbox['total']:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"sksq_p_{inbox['page'] + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def send_sks_inbox_page(message, context, page: int):
+    result = load_sks_page(page)
+    if result is None:
+        await message.reply_text(DB_UNAVAILABLE_TEXT)
+        return
+    apps, total = result
+    if not apps and page > 0:
+        return await send_sks_inbox_page(message, context, 0)
+    if not apps:
+        await message.reply_text("🎫 Заявок СКС на рассмотрении нет.")
+        return
+
+    labels = []
+    for number, app in enumerate(apps, start=page * SKS_INBOX_PAGE_SIZE + 1):
+        labels.append((app['id'], f"{number}. {app['full_name'] or app['user_id']} ({app['group_name'] or '-'})"))
+    context.user_data['sks_inbox'] = {'page': page, 'total': total, 'apps': labels}
+
+    if len(apps) == 1:
+        await message.reply_photo(apps[0]['photo_url'], caption=labels[0][1])
+    else:
+        await message.reply_media_group(
+            [InputMediaPhoto(app['photo_url'], caption=label) for app, (_, label) in zip(apps, labels)]
+        )
+    await message.reply_text(
+        f"🎫 Заявки СКС на рассмотрении: {total}. Отметьте заявки и выберите действие:",
+        reply_markup=sks_inbox_markup(context)
+    )
+
+
+async def sks_inbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    context.user_data['sks_selected'] = set()
+    await send_sks_inbox_page(update.message, context, 0)
+
+
+# Пакетное решение по заявкам, возвращает число решённых заявок и telegram_id их студентов
+def apply_sks_decision(app_ids, approve: bool):
+    connection = get_db_connection(primary=True)
+    if not connection:
+        return None
+    placeholders = ', '.join(['%s'] * len(app_ids))
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            f"SELECT user_id FROM sks_applications WHERE id IN ({placeholders}) AND status = 'pending' FOR UPDATE",
+            tuple(app_ids)
+        )
+        rows = cursor.fetchall()
+        user_ids = sorted({row['user_id'] for row in rows})
+        cursor.execute(
+            f"UPDATE sks_applications SET status = %s WHERE id IN ({placeholders}) AND status = 'pending'",
+            ('approved' if approve else 'rejected', *app_ids)
+        )
+        if approve and user_ids:
+            user_placeholders = ', '.join(['%s'] * len(user_ids))
+            cursor.execute(
+                f"UPDATE users SET is_sks = TRUE WHERE telegram_id IN ({user_placeholders})",
+                tuple(user_ids)
+            )
+        connection.commit()
+        return len(rows), user_ids
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Ошибка пакетного решения по заявкам СКС: {e}")
+        return None
+    finally:
         cursor.close()
-        sent = 0
-        for admin in admins:
-            if admin['telegram_id']:
-                keyboard = [
-                    [InlineKeyboardButton("✅ Одобрить", callback_data=f"sks_approve_{user_id}"),
-                     InlineKeyboardButton("❌ Отклонить", callback_data=f"sks_reject_{user_id}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                try:
-                    await context.bot.send_photo(
-                        chat_id=admin['telegram_id'],
-                        photo=photo_id,
-                        caption="Новая заявка на подтверждение в СКС",
-                        reply_markup=reply_markup
-                    )
-                    sent += 1
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления админу: {e}")
         connection.close()
-        if sent == 0:
-            await update.message.reply_text("❌ Не удалось отправить заявку ни одному админу. Проверьте настройки.")
+
+
+async def handle_sks_inbox_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    query = update.callback_query
+    data = query.data
+    inbox = context.user_data.get('sks_inbox')
+    selected = context.user_data.setdefault('sks_selected', set())
+    if data.startswith('sksq_p_'):
+        await query.edit_message_reply_markup(reply_markup=None)
+        await send_sks_inbox_page(query.message, context, int(data.split('_')[2]))
+        return
+    if not inbox:
+        await query.edit_message_text("Список устарел. Откройте его заново: /sks")
+        return
+
+    if data.startswith('sksq_t_'):
+        app_id = int(data.split('_')[2])
+        if app_id in selected:
+            selected.discard(app_id)
+        else:
+            selected.add(app_id)
+        await query.edit_message_reply_markup(reply_markup=sks_inbox_markup(context))
+    elif data == 'sksq_all':
+        selected.update(app_id for app_id, _ in inbox['apps'])
+        await query.edit_message_reply_markup(reply_markup=sks_inbox_markup(context))
+    elif data in ('sksq_approve', 'sksq_reject'):
+        if not selected:
+            await query.message.reply_text("Сначала отметьте заявки.")
+            return
+        approve = data == 'sksq_approve'
+        result = apply_sks_decision(sorted(selected), approve)
+        if result is None:
+            await query.message.reply_text("⚠️ Не удалось сохранить решение. Попробуйте позже.")
+            return
+        decided, user_ids = result
+        for user_id in user_ids:
+            CALLBACK_DEDUP.remember(f"sks_{user_id}", query.from_user.id)
+            AUDIT.record(query.from_user.id, 'sks_approve' if approve else 'sks_reject', f"tg:{user_id}")
+        context.user_data['sks_selected'] = set()
+        await query.edit_message_text(
+            f"{'✅ Одобрено' if approve else '❌ Отклонено'} заявок: {decided}"
+            + (" (остальные уже рассмотрены)" if decided < len(selected) else "")
+        )
+        text = (
+            "✅ Ваша заявка на подтверждение СКС одобрена. Спасибо!" if approve else
+            "❌ Ваша заявка на подтверждение в СКС отклонена. Пожалуйста, подайте заявку снова."
+        )
+        await BULK_SENDER.send_many(user_ids, 'send_message', text=text)
+        await send_sks_inbox_page(query.message, context, inbox['page'])
 
 
 # Обработка отмены
@@ -1033,240 +3693,1192 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
+# Команда для админа: сколько памяти занимает состояние пользователей
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    await update.message.reply_text(STATE_SWEEPER.report())
+
+
+# Команда для админа: загрузка полос запросов к Bot API
+async def queues_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    await update.message.reply_text(
+        "🚦 Запросы к Bot API:\n"
+        f"{INTERACTIVE_LANE.report()}\n"
+        f"{BULK_LANE.report()}\n"
+        f"• Массовых отправок ожидает: {BULK_SENDER.pending}\n"
+        f"• Апдейтов бота: {current_tenant().updates}, отклонено общим лимитом: {current_tenant().limited}"
+    )
+
+
+# Команда для админа: аналитика посещаемости
+# /analytics — сводка, /analytics never [группа] — ни разу не отмечались,
+# /analytics chart — график, /analytics rebuild — пересчитать агрегаты
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    action = context.args[0].lower() if context.args else ''
+
+    if action == 'never':
+        result = ATTENDANCE_STATS.never_attended(context.args[1] if len(context.args) > 1 else None)
+        if result is None:
+            await reply_db_unavailable(update)
+            return
+        total, students = result
+        if not total:
+            await update.message.reply_text("✅ Все зарегистрированные студенты хотя бы раз отметились.")
+            return
+        text = f"😴 Ни разу не отмечались: {total}\n\n"
+        text += "\n".join(f"• {student['full_name']} ({student['group_name']})" for student in students)
+        if total > len(students):
+            text += f"\n… и ещё {total - len(students)}"
+        await update.message.reply_text(text)
+    elif action == 'chart':
+        if pyplot is None:
+            await update.message.reply_text("❌ На сервере не установлен matplotlib, графики недоступны.")
+            return
+        image = await asyncio.to_thread(ATTENDANCE_STATS.chart)
+        if image is None:
+            await reply_db_unavailable(update)
+            return
+        await update.message.reply_photo(image, caption="📊 Явка на последних мероприятиях")
+    elif action == 'rebuild':
+        await update.message.reply_text("⏳ Пересчитываю аналитику...")
+        if await asyncio.to_thread(with_db_retry, ATTENDANCE_STATS.rebuild):
+            await update.message.reply_text("✅ Аналитика пересчитана.")
+        else:
+            await reply_db_unavailable(update)
+    else:
+        text = ATTENDANCE_STATS.overview()
+        if text is None:
+            await reply_db_unavailable(update)
+            return
+        await update.message.reply_text(text)
+
+
+# Команда для админа: архив старых записей
+# /archive — сводка, /archive run — перенести сейчас,
+# /archive events|faq <текст>, /archive sks <telegram_id> — поиск в архиве
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    action = context.args[0].lower() if context.args else ''
+
+    if action == 'run':
+        await update.message.reply_text("⏳ Переношу старые записи в архив...")
+        moved = await ARCHIVER.run_once()
+        if moved is None:
+            await reply_db_unavailable(update)
+            return
+        await update.message.reply_text(
+            "✅ Перенесено в архив:\n" + "\n".join(f"• {table}: {count}" for table, count in moved.items())
+        )
+    elif action in ('events', 'faq', 'sks'):
+        if len(context.args) < 2:
+            await update.message.reply_text("❌ Использование: /archive events|faq <текст> или /archive sks <telegram_id>")
+            return
+        rows = ARCHIVER.search(action, ' '.join(context.args[1:]))
+        if rows is None:
+            await reply_db_unavailable(update)
+            return
+        if not rows:
+            await update.message.reply_text("❌ В архиве ничего не найдено.")
+            return
+        if action == 'events':
+            lines = [
+                f"• ID {row['id']}: {row['title']} — {row['event_date'].strftime('%d.%m.%Y %H:%M')}, отметились {row['attendees']}"
+                for row in rows
+            ]
+        elif action == 'faq':
+            lines = [f"• #{row['id']} {row['question']}\n  ↳ {row['answer']}" for row in rows]
+        else:
+            lines = [
+                f"• #{row['id']} {row['status']} от {row['created_at'].strftime('%d.%m.%Y')}" for row in rows
+            ]
+        await update.message.reply_text("🗄 Найдено в архиве:\n" + "\n".join(lines))
+    else:
+        text = ARCHIVER.report()
+        if text is None:
+            await reply_db_unavailable(update)
+            return
+        await update.message.reply_text(text)
+
+
+# Команда для админа: ссылка и QR-код для отметки на мероприятии
+async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("❌ Использование: /qr <ID мероприятия>")
+        return
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT id, title, event_date FROM events WHERE id = %s", (int(context.args[0]),))
+    event = cursor.fetchone()
+    cursor.close()
+    connection.close()
+    if not event:
+        await update.message.reply_text("❌ Мероприятие не найдено.")
+        return
+    await update.message.reply_text(f"📌 {event['title']} — {event['event_date'].strftime('%d.%m.%Y %H:%M')}")
+    await send_checkin_link(update, context, event['id'], event['event_date'])
+
+
+# Команда для админа: журнал действий.
+# /audit [actor=<telegram_id>] [action=points] [target=user:15] [since=ДД.ММ.ГГГГ] [until=ДД.ММ.ГГГГ]
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    criteria = {}
+    try:
+        for arg in context.args:
+            key, _, value = arg.partition('=')
+            if key == 'actor':
+                criteria[key] = int(value)
+            elif key in ('action', 'target') and value:
+                criteria[key] = value
+            elif key == 'since':
+                criteria[key] = datetime.strptime(value, "%d.%m.%Y")
+            elif key == 'until':
+                criteria[key] = datetime.strptime(value, "%d.%m.%Y") + timedelta(days=1)
+            else:
+                raise ValueError(arg)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Использование: /audit [actor=<telegram_id>] [action=<действие>] [target=<объект>] "
+            "[since=ДД.ММ.ГГГГ] [until=ДД.ММ.ГГГГ]"
+        )
+        return
+
+    # Сначала дописать накопленное, чтобы в выдаче были и самые свежие действия
+    await AUDIT.flush()
+    rows = AUDIT.search(criteria)
+    if rows is None:
+        await reply_db_unavailable(update)
+        return
+    if not rows:
+        await update.message.reply_text("📜 Записей не найдено.")
+        return
+    text = "📜 Журнал действий (новые сверху):\n\n"
+    for row in rows:
+        text += (
+            f"• {row['created_at'].strftime('%d.%m.%Y %H:%M:%S')} {row['actor_id']} {row['action']} "
+            f"{row['target'] or ''} {row['details'] or ''}\n"
+        )
+    await update.message.reply_text(text)
+
+
 # Команда для статистики
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
 
-        if user and user['role'] in [ROLE_TUTOR, ROLE_ADMIN]:
-            # Получаем статистику по профсоюзу и СКС
-            cursor.execute("SELECT COUNT(*) as total FROM users")
-            total_users = cursor.fetchone()['total']
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
 
-            cursor.execute("SELECT COUNT(*) as prof FROM users WHERE is_prof_union = TRUE")
-            prof_users = cursor.fetchone()['prof']
+    if user and user['role'] in [ROLE_TUTOR, ROLE_ADMIN]:
+        # Получаем статистику по профсоюзу и СКС
+        cursor.execute("SELECT COUNT(*) as total FROM users")
+        total_users = cursor.fetchone()['total']
 
-            cursor.execute("SELECT COUNT(*) as sks FROM users WHERE is_sks = TRUE")
-            sks_users = cursor.fetchone()['sks']
+        cursor.execute("SELECT COUNT(*) as prof FROM users WHERE is_prof_union = TRUE")
+        prof_users = cursor.fetchone()['prof']
 
-            prof_percentage = (prof_users / total_users * 100) if total_users > 0 else 0
-            sks_percentage = (sks_users / total_users * 100) if total_users > 0 else 0
+        cursor.execute("SELECT COUNT(*) as sks FROM users WHERE is_sks = TRUE")
+        sks_users = cursor.fetchone()['sks']
 
-            stats_text = (
-                f"📊 Статистика:\n"
-                f"• Всего пользователей: {total_users}\n"
-                f"• В профсоюзе: {prof_users} ({prof_percentage:.1f}%)\n"
-                f"• В СКС: {sks_users} ({sks_percentage:.1f}%)"
-            )
+        prof_percentage = (prof_users / total_users * 100) if total_users > 0 else 0
+        sks_percentage = (sks_users / total_users * 100) if total_users > 0 else 0
 
-            await update.message.reply_text(stats_text)
-        else:
-            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        stats_text = (
+            f"📊 Статистика:\n"
+            f"• Всего пользователей: {total_users}\n"
+            f"• В профсоюзе: {prof_users} ({prof_percentage:.1f}%)\n"
+            f"• В СКС: {sks_users} ({sks_percentage:.1f}%)"
+        )
 
-        cursor.close()
-        connection.close()
+        await update.message.reply_text(stats_text)
+    else:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+
+    cursor.close()
+    connection.close()
 
 
 # Команда для изменения баллов
 async def set_points_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Несколько строк — пакетное начисление, включая запись в строке с командой
+    if len(update.message.text.splitlines()) > 1:
+        if await require_admin(update):
+            await apply_bulk_points(update, points_lines(update.message.text))
+        return
+
     user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
 
-        if user and user['role'] == ROLE_ADMIN:
-            if len(context.args) < 2:
-                await update.message.reply_text("❌ Использование: /setpoints <user_id> <points>")
-                return
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
 
-            try:
-                target_user_id = int(context.args[0])
-                points = int(context.args[1])
+    if user and user['role'] == ROLE_ADMIN:
+        if len(context.args) < 2:
+            await update.message.reply_text("❌ Использование: /setpoints <user_id> <points>")
+            return
 
-                cursor.execute(
-                    "UPDATE users SET points = points + %s WHERE id = %s",
-                    (points, target_user_id)
-                )
-                connection.commit()
+        try:
+            target_user_id = int(context.args[0])
+            points = int(context.args[1])
 
-                await update.message.reply_text(f"✅ Баллы пользователя {target_user_id} изменены на {points}")
-            except ValueError:
-                await update.message.reply_text("❌ Неверный формат аргументов")
-        else:
-            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            cursor.execute(
+                "UPDATE users SET points = points + %s WHERE id = %s",
+                (points, target_user_id)
+            )
+            connection.commit()
+            AUDIT.record(user_id, 'points', f"user:{target_user_id}", f"{points:+d}")
 
-        cursor.close()
-        connection.close()
+            await update.message.reply_text(f"✅ Баллы пользователя {target_user_id} изменены на {points}")
+        except ValueError:
+            await update.message.reply_text("❌ Неверный формат аргументов")
+    else:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+
+    cursor.close()
+    connection.close()
 
 
 # Команда для получения информации о пользователе
 async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return
 
-        if user and user['role'] == ROLE_ADMIN:
-            if not context.args:
-                await update.message.reply_text("❌ Использование: /info <ФИО или часть>")
-                return
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
+    user = cursor.fetchone()
 
-            search_term = ' '.join(context.args)
-            cursor.execute(
-                "SELECT * FROM users WHERE full_name LIKE %s",
-                (f'%{search_term}%',)
-            )
-            users = cursor.fetchall()
+    if user and user['role'] == ROLE_ADMIN:
+        if not context.args:
+            await update.message.reply_text("❌ Использование: /info <ФИО или часть>")
+            return
+
+        search_term = ' '.join(context.args)
+        cursor.execute(
+            "SELECT * FROM users WHERE full_name LIKE %s",
+            (f'%{search_term}%',)
+        )
+        users = cursor.fetchall()
 
-            if users:
-                info_text = "🔍 Найденные пользователи:\n\n"
-                for u in users:
-                    info_text += f"• ID: {u['id']}, ФИО: {u['full_name']}, Группа: {u['group_name']}, Роль: {u['role']}\n"
+        if users:
+            info_text = "🔍 Найденные пользователи:\n\n"
+            for u in users:
+                info_text += f"• ID: {u['id']}, ФИО: {u['full_name']}, Группа: {u['group_name']}, Роль: {u['role']}\n"
 
-                await update.message.reply_text(info_text)
-            else:
-                await update.message.reply_text("❌ Пользователи не найдены.")
+            await update.message.reply_text(info_text)
         else:
-            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+            await update.message.reply_text("❌ Пользователи не найдены.")
+    else:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
 
+    cursor.close()
+    connection.close()
+
+
+# Проверка, что команду вызвал админ
+async def require_admin(update: Update) -> bool:
+    connection = await db_connection()
+    if not connection:
+        await reply_db_unavailable(update)
+        return False
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (update.effective_user.id,))
+    user = cursor.fetchone()
+    cursor.close()
+    connection.close()
+    if user and user['role'] == ROLE_ADMIN:
+        return True
+    await update.effective_message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+    return False
+
+
+# Импорт списка студентов из CSV/XLSX
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    context.user_data['roster_import'] = True
+    await update.message.reply_text(
+        "📥 Отправьте файл CSV или XLSX со столбцами: ФИО, № зачётки, группа.\n"
+        "Строка заголовков необязательна. Существующие студенты (по № зачётки) будут обновлены."
+    )
+
+
+# Построчное чтение файла без загрузки всей таблицы в память; data — двоичный поток,
+# читается с начала (with_db_retry может повторить импорт)
+def iter_table_rows(data, file_name: str):
+    data.seek(0)
+    if file_name.lower().endswith('.xlsx'):
+        if openpyxl is None:
+            raise ValueError("для XLSX на сервере не установлен openpyxl, пришлите CSV")
+        workbook = openpyxl.load_workbook(data, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield ['' if value is None else str(value).strip() for value in row]
+        finally:
+            workbook.close()
+        return
+    stream = io.TextIOWrapper(data, encoding='utf-8-sig', newline='')
+    try:
+        sample = stream.read(4096)
+        stream.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.reader(stream, dialect):
+            yield [value.strip() for value in row]
+    finally:
+        # Поток закрывает вызывающий код
+        stream.detach()
+
+
+ROSTER_COLUMNS = {'full_name': ('фио', 'full_name', 'имя'), 'student_id': ('зач', 'student_id', 'номер'),
+                  'group_name': ('груп', 'group')}
+
+
+def roster_column_map(header):
+    mapping = {}
+    for field, hints in ROSTER_COLUMNS.items():
+        for index, title in enumerate(header):
+            if any(hint in title.lower() for hint in hints):
+                mapping[field] = index
+                break
+    return mapping if len(mapping) == len(ROSTER_COLUMNS) else None
+
+
+def upsert_roster_batch(cursor, batch):
+    placeholders = ', '.join(['%s'] * len(batch))
+    cursor.execute(
+        f"SELECT id, student_id FROM users WHERE student_id IN ({placeholders})",
+        tuple(row[1] for row in batch)
+    )
+    existing = {row['student_id']: row['id'] for row in cursor.fetchall()}
+    new_rows = [row for row in batch if row[1] not in existing]
+    updated_rows = [(existing[row[1]], *row) for row in batch if row[1] in existing]
+    if new_rows:
+        cursor.executemany(
+            "INSERT INTO users (full_name, student_id, group_name, role) VALUES (%s, %s, %s, 'student')",
+            new_rows
+        )
+    if updated_rows:
+        cursor.executemany(
+            "INSERT INTO users (id, full_name, student_id, group_name) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE full_name = VALUES(full_name), group_name = VALUES(group_name)",
+            updated_rows
+        )
+    return len(new_rows), len(updated_rows)
+
+
+# Разбор и запись списка одной транзакцией пачками по ROSTER_BATCH_SIZE строк
+def import_roster(data, file_name: str):
+    inserted = updated = 0
+    rejected = []
+    seen = set()
+    columns = {'full_name': 0, 'student_id': 1, 'group_name': 2}
+    connection = get_db_connection(primary=True)
+    if not connection:
+        raise ConnectionError("нет подключения к базе данных")
+    cursor = connection.cursor(dictionary=True)
+    try:
+        batch = []
+        for line_number, row in enumerate(iter_table_rows(data, file_name), start=1):
+            if not any(row):
+                continue
+            if line_number == 1 and roster_column_map(row):
+                columns = roster_column_map(row)
+                continue
+            values = [row[columns[field]] if columns[field] < len(row) else '' for field in ROSTER_COLUMNS]
+            full_name, student_id, group_name = values
+            if not full_name or not student_id or not group_name:
+                rejected.append(f"строка {line_number}: не заполнены ФИО, № зачётки или группа")
+            elif len(full_name) > 255 or len(student_id) > 32 or len(group_name) > 50:
+                rejected.append(f"строка {line_number}: слишком длинное значение")
+            elif student_id in seen:
+                rejected.append(f"строка {line_number}: повтор № зачётки {student_id}")
+            else:
+                seen.add(student_id)
+                batch.append((full_name, student_id, group_name))
+            if len(batch) >= ROSTER_BATCH_SIZE:
+                counts = upsert_roster_batch(cursor, batch)
+                inserted, updated = inserted + counts[0], updated + counts[1]
+                batch = []
+        if batch:
+            counts = upsert_roster_batch(cursor, batch)
+            inserted, updated = inserted + counts[0], updated + counts[1]
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+    return inserted, updated, rejected
+
+
+async def handle_roster_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    context.user_data['roster_import'] = False
+    file = await document.get_file()
+    # Файл сверх ROSTER_SPOOL_SIZE лежит на диске, строки разбираются по одной
+    with tempfile.SpooledTemporaryFile(max_size=ROSTER_SPOOL_SIZE) as data:
+        await file.download_to_memory(data)
+        try:
+            inserted, updated, rejected = await asyncio.to_thread(
+                with_db_retry, import_roster, data, document.file_name or ''
+            )
+        except Exception as e:
+            logger.error(f"Ошибка импорта списка студентов: {e}")
+            await update.message.reply_text(f"❌ Импорт отменён, изменения не сохранены: {e}")
+            return
+    text = f"📥 Импорт завершён.\n• Добавлено: {inserted}\n• Обновлено: {updated}\n• Отклонено: {len(rejected)}"
+    if rejected:
+        text += "\n\n" + "\n".join(rejected[:20])
+        if len(rejected) > 20:
+            text += f"\n… и ещё {len(rejected) - 20}"
+    await update.message.reply_text(text)
+
+
+# Пакетное изменение баллов: строки «id изменение [причина]»
+async def bulk_points_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_admin(update):
+        return
+    lines = points_lines(update.message.text)
+    if lines:
+        await apply_bulk_points(update, lines)
+        return
+    context.user_data['points_import'] = True
+    await update.message.reply_text(
+        "📊 Отправьте текстовый файл или сообщение /bulkpoints, где каждая строка —\n"
+        "<ID_пользователя> <изменение> [причина]\n\n"
+        "Например:\n/bulkpoints\n15 10 олимпиада\n16 -2"
+    )
+
+
+# Строки начисления из сообщения с командой: текст после команды — тоже запись
+def points_lines(text: str):
+    command_line, *lines = text.splitlines()
+    return command_line.split(maxsplit=1)[1:] + lines
+
+
+def parse_points_lines(lines):
+    entries, errors = [], []
+    for line_number, line in enumerate(lines, start=1):
+        parts = line.split(maxsplit=2)
+        if not parts:
+            continue
+        try:
+            target_user_id, delta = int(parts[0]), int(parts[1])
+        except (ValueError, IndexError):
+            errors.append(f"строка {line_number}: ожидается «id изменение [причина]»")
+            continue
+        entries.append((line_number, target_user_id, delta, parts[2] if len(parts) > 2 else ''))
+    return entries, errors
+
+
+# Все изменения одной транзакцией; при любой ошибке не применяется ничего
+def apply_points_batch(entries):
+    totals = {}
+    for _, target_user_id, delta, _ in entries:
+        totals[target_user_id] = totals.get(target_user_id, 0) + delta
+    user_ids = list(totals)
+
+    connection = get_db_connection(primary=True)
+    if not connection:
+        raise ConnectionError("нет подключения к базе данных")
+    cursor = connection.cursor(dictionary=True)
+    try:
+        existing = set()
+        for start in range(0, len(user_ids), POINTS_BATCH_SIZE):
+            chunk = user_ids[start:start + POINTS_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"SELECT id FROM users WHERE id IN ({placeholders})", tuple(chunk))
+            existing.update(row['id'] for row in cursor.fetchall())
+        missing = [f"строка {n}: пользователь {uid} не найден" for n, uid, _, _ in entries if uid not in existing]
+        if missing:
+            connection.rollback()
+            return missing
+
+        for start in range(0, len(user_ids), POINTS_BATCH_SIZE):
+            chunk = user_ids[start:start + POINTS_BATCH_SIZE]
+            cases = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+            placeholders = ', '.join(['%s'] * len(chunk))
+            params = [value for uid in chunk for value in (uid, totals[uid])] + chunk
+            cursor.execute(
+                f"UPDATE users SET points = points + CASE id {cases} END WHERE id IN ({placeholders})",
+                tuple(params)
+            )
+        connection.commit()
+        return []
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
         cursor.close()
         connection.close()
 
 
+async def apply_bulk_points(update: Update, lines):
+    entries, errors = parse_points_lines(lines)
+    if not entries and not errors:
+        await update.message.reply_text("❌ Нет строк для начисления.")
+        return
+    if not errors:
+        try:
+            errors = await asyncio.to_thread(with_db_retry, apply_points_batch, entries)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного начисления баллов: {e}")
+            errors = [str(e)]
+    if errors:
+        text = "❌ Баллы не изменены, исправьте ошибки:\n" + "\n".join(errors[:20])
+        if len(errors) > 20:
+            text += f"\n… и ещё {len(errors) - 20}"
+        await update.message.reply_text(text)
+        return
+    for _, target_user_id, delta, reason in entries:
+        AUDIT.record(update.effective_user.id, 'points', f"user:{target_user_id}", f"{delta:+d} {reason}".strip())
+    users_count = len({entry[1] for entry in entries})
+    total = sum(entry[2] for entry in entries)
+    await update.message.reply_text(
+        f"✅ Баллы изменены.\n• Строк: {len(entries)}\n• Пользователей: {users_count}\n• Сумма изменений: {total:+d}"
+    )
+
+
+async def handle_points_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['points_import'] = False
+    file = await update.message.document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    try:
+        lines = data.decode('utf-8-sig').splitlines()
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ Файл должен быть в кодировке UTF-8.")
+        return
+    await apply_bulk_points(update, lines)
+
+
+# Документы от админов: файл обрабатывается по выбранной ранее команде
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.user_data.get('roster_import'):
+        await handle_roster_document(update, context)
+    elif context.user_data.get('points_import'):
+        await handle_points_document(update, context)
+
+
+# Недавно принятые решения по инлайн-кнопкам: повторные нажатия
+# отвечаются из памяти, без обращения к БД
+CALLBACK_DEDUP = TenantLocal(lambda: ExpiringCache(ttl=600, max_size=10000))
+
+
 # Обработчик инлайн-кнопок
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
+    if query.data.startswith('sksq_'):
+        await handle_sks_inbox_button(update, context)
+        return
+
+    if query.data.startswith('events_page_'):
+        page = int(query.data.split('_')[2])
+        result = CALENDAR_CACHE.get_page(page)
+        if result:
+            text, total = result
+            page = max(0, min(page, total - 1))
+            await query.edit_message_text(text, reply_markup=events_page_markup(page, total))
+        return
+
+    if query.data == 'faq_resolved':
+        context.user_data.pop('pending_question', None)
+        await query.edit_message_reply_markup(reply_markup=None)
+        await query.message.reply_text("😊 Рады, что ответ нашёлся!")
+        return
+
+    if query.data == 'faq_escalate':
+        question = context.user_data.pop('pending_question', None)
+        await query.edit_message_reply_markup(reply_markup=None)
+        if not question:
+            await query.message.reply_text("Вопрос уже отправлен. Чтобы задать новый, нажмите «✍️ Задать свой вопрос».")
+        elif await escalate_question(context, query.from_user.id, question):
+            await query.message.reply_text("✅ Ваш вопрос отправлен тьюторам. Ожидайте ответа.")
+        else:
+            await query.message.reply_text(DB_UNAVAILABLE_TEXT)
+        return
+
     if query.data.startswith('faq_answer_'):
         question_id = int(query.data.split('_')[2])
         tutor_id = query.from_user.id
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT status FROM faq_questions WHERE id = %s", (question_id,))
-            question = cursor.fetchone()
-            if question and question['status'] == 'pending':
-                cursor.execute(
-                    "UPDATE faq_questions SET status = 'in_progress', tutor_id = %s WHERE id = %s",
-                    (tutor_id, question_id)
-                )
-                connection.commit()
-                await query.edit_message_text("Вы взяли вопрос. Напишите ответ студенту.")
-                context.user_data['faq_answer_id'] = question_id
-            else:
-                await query.edit_message_text("Вопрос уже взят другим тьютором.")
-            cursor.close()
-            connection.close()
+        key = f"faq_{question_id}"
+        winner = CALLBACK_DEDUP.get(key)
+        if winner is not None:
+            text = "Вы уже взяли этот вопрос." if winner == tutor_id else "Вопрос уже взят другим тьютором."
+            await resolve_question_button(query, question_id, text)
+            return
+        connection = await db_connection()
+        if not connection:
+            await reply_db_unavailable(update)
+            return
 
-    if query.data.startswith('sks_'):
-        action, user_id = query.data.split('_')[1], query.data.split('_')[2]
+        cursor = connection.cursor()
+        # Кто первым перевёл вопрос из pending, тот и отвечает
+        cursor.execute(
+            "UPDATE faq_questions SET status = 'in_progress', tutor_id = %s WHERE id = %s AND status = 'pending'",
+            (tutor_id, question_id)
+        )
+        claimed = cursor.rowcount == 1
+        connection.commit()
+        cursor.close()
+        connection.close()
+        if claimed:
+            CALLBACK_DEDUP.remember(key, tutor_id)
+            await resolve_question_button(query, question_id, "Вы взяли вопрос. Напишите ответ студенту.")
+            context.user_data['faq_answer_id'] = question_id
+        else:
+            CALLBACK_DEDUP.remember(key, 0)
+            await resolve_question_button(query, question_id, "Вопрос уже взят другим тьютором.")
 
-        connection = get_db_connection()
-        if connection:
-            cursor = connection.cursor()
+    if query.data.startswith('sks_'):
+        action, user_id = query.data.split('_')[1], int(query.data.split('_')[2])
+        key = f"sks_{user_id}"
+        if CALLBACK_DEDUP.get(key) is not None:
+            await query.edit_message_caption(caption="Заявка уже рассмотрена другим администратором.")
+            return
+        if action not in ('approve', 'reject'):
+            return
+
+        connection = await db_connection()
+        if not connection:
+            await reply_db_unavailable(update)
+            return
 
-            if action == 'approve':
-                cursor.execute(
-                    "UPDATE users SET is_sks = TRUE WHERE id = %s",
-                    (user_id,)
-                )
-                cursor.execute(
-                    "UPDATE sks_applications SET status = 'approved' WHERE user_id = %s AND status = 'pending'",
-                    (user_id,)
-                )
-                await query.edit_message_caption(caption="✅ Заявка одобрена")
-
-                # Уведомляем пользователя
-                cursor.execute("SELECT telegram_id FROM users WHERE id = %s", (user_id,))
-                user = cursor.fetchone()
-                if user and user[0]:
-                    try:
-                        await context.bot.send_message(chat_id=user[0],
-                                                       text="✅ Ваша заявка на подтверждение СКС. Спасибо!")
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления пользователю: {e}")
-
-            elif action == 'reject':
-                cursor.execute(
-                    "UPDATE sks_applications SET status = 'rejected' WHERE user_id = %s AND status = 'pending'",
-                    (user_id,)
+        cursor = connection.cursor()
+        # sks_applications.user_id — это telegram_id студента
+        cursor.execute(
+            "UPDATE sks_applications SET status = %s WHERE user_id = %s AND status = 'pending'",
+            ('approved' if action == 'approve' else 'rejected', user_id)
+        )
+        decided = cursor.rowcount > 0
+        if decided and action == 'approve':
+            cursor.execute("UPDATE users SET is_sks = TRUE WHERE telegram_id = %s", (user_id,))
+        connection.commit()
+        cursor.close()
+        connection.close()
+        CALLBACK_DEDUP.remember(key, query.from_user.id)
+        if decided:
+            AUDIT.record(query.from_user.id, f"sks_{action}", f"tg:{user_id}")
+
+        if not decided:
+            await query.edit_message_caption(caption="Заявка уже рассмотрена другим администратором.")
+        elif action == 'approve':
+            await query.edit_message_caption(caption="✅ Заявка одобрена")
+            try:
+                await context.bot.send_message(chat_id=user_id,
+                                               text="✅ Ваша заявка на подтверждение СКС одобрена. Спасибо!")
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления пользователю: {e}")
+        else:
+            await query.edit_message_caption(caption="❌ Заявка отклонена")
+            try:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="❌ Ваша заявка на подтверждение в СКС отклонена. Пожалуйста, подайте заявку снова."
                 )
-                await query.edit_message_caption(caption="❌ Заявка отклонена")
-
-                # Уведомляем пользователя
-                cursor.execute("SELECT telegram_id FROM users WHERE id = %s", (user_id,))
-                user = cursor.fetchone()
-                if user and user[0]:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user[0],
-                            text="❌ Ваша заявка на подтверждение в СКС отклонена. Пожалуйста, подайте заявку снова."
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления пользователю: {e}")
-
-            connection.commit()
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления пользователю: {e}")
+
+
+# Состояние процесса для проверок: БД отвечает, пул открыт, кэши прогреты,
+# цикл событий не залипает и бот не останавливается
+class HealthMonitor:
+    def __init__(self):
+        self.warm = set()  # тенанты с прогретыми кэшами
+        self.draining = False
+        self.db_ok = False
+        self.loop_lag = 0.0
+        self.flags = None
+        self.task = None
+
+    # Общие флаги готовности воркеров для приёмника в многопроцессном режиме
+    def attach(self, flags):
+        self.flags = flags
+
+    @staticmethod
+    def check_db() -> bool:
+        connection = get_db_connection(primary=True)
+        if not connection:
+            return False
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
             cursor.close()
+            return True
+        except Error as e:
+            logger.warning(f"Проверка БД не прошла: {e}")
+            return False
+        finally:
             connection.close()
 
+    def checks(self):
+        return {
+            'db': self.db_ok,
+            'pool': DB_BACKEND == 'sqlite' or DB_POOL_SIZE == 0 or DB_POOL is not None,
+            'caches': len(self.warm) >= max(1, len(TENANTS)),
+            'loop_lag': self.loop_lag <= HEALTH_MAX_LOOP_LAG,
+            'accepting': not self.draining,
+        }
+
+    def ready(self) -> bool:
+        return all(self.checks().values())
+
+    def publish(self):
+        if self.flags is not None:
+            self.flags[WORKER_INDEX] = 1 if self.ready() else 0
+
+    async def refresh(self):
+        self.db_ok = await asyncio.to_thread(self.check_db)
+        self.publish()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(HEALTH_INTERVAL)
+            self.loop_lag = loop.time() - started - HEALTH_INTERVAL
+            await self.refresh()
+
+    # Один на процесс, даже если тенантов несколько
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+
+HEALTH = HealthMonitor()
+
+
+# HTTP-проверки для systemd/балансировщика/update_bot.sh: /healthz — процесс жив,
+# /readyz — 200 только когда бот готов принимать апдейты. checks() -> {проверка: bool};
+# /metrics — счётчики апдейтов по тенантам
+def make_health_handler(checks):
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/healthz':
+                status, body = 200, {'status': 'ok'}
+            elif self.path == '/readyz':
+                result = checks()
+                status, body = (200 if all(result.values()) else 503), result
+            elif self.path == '/metrics':
+                status, body = 200, {tenant.name: tenant.metrics() for tenant in TENANTS or [DEFAULT_TENANT]}
+            else:
+                status, body = 404, {}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
 
-def main() -> None:
+        def log_message(self, format, *args):
+            pass
+
+    return HealthHandler
+
+
+def start_health_server(checks):
+    if not HEALTH_PORT:
+        return None
+    # Без проверок бот продолжает работать — занятый порт не повод не запускаться
     try:
-        application = (
-            Application.builder()
-            .token(os.getenv('BOT_TOKEN'))
-            .read_timeout(30)
-            .write_timeout(30)
-            .build()
-        )
+        server = ThreadingHTTPServer((HEALTH_LISTEN, HEALTH_PORT), make_health_handler(checks))
+    except OSError as e:
+        logger.error(f"Не удалось открыть порт проверок {HEALTH_LISTEN}:{HEALTH_PORT}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='health', daemon=True).start()
+    return server
+
+
+# Плавная остановка: снять готовность и сохранить незавершённые рассылки.
+# Остальное (апдейты в очереди, user_data, дайджесты тьюторам) дописывается при остановке приложения
+async def drain():
+    HEALTH.draining = True
+    HEALTH.publish()
+    await asyncio.gather(*(jobs.drain(DRAIN_TIMEOUT) for jobs in BROADCASTS.instances()))
+
+
+async def stop_gracefully(application: Application):
+    logger.info("Получен SIGTERM, останавливаюсь")
+    await drain()
+    application.stop_running()
 
-        broadcast_conv = ConversationHandler(
-            entry_points=[
-                MessageHandler(filters.Regex("^📢 Рассылка для группы$"), tutor_broadcast_entry),
-                MessageHandler(filters.Regex("^📢 Рассылка$"), choose_broadcast_group)
-            ],
-            states={
-                CHOOSE_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_chosen)],
-                BROADCAST_MESSAGE: [MessageHandler(filters.ALL, send_broadcast)]
-            },
-            fallbacks=[CommandHandler('cancel', cancel)]
+
+# Запуск фоновых задач после инициализации бота
+async def post_init(application: Application) -> None:
+    # Массовые отправки идут через отдельный клиент со своим пулом соединений
+    BULK_SENDER.bot = Bot(
+        application.bot.token,
+        base_url=application.bot.base_url.removesuffix(application.bot.token),
+        request=BULK_LANE
+    )
+    await BULK_SENDER.bot.initialize()
+    # Прогрев до готовности: пул соединений, кэши и справочники.
+    # Архивные таблицы нужны базе вопросов и аналитике
+    await HEALTH.refresh()
+    ARCHIVER.start()
+    FAQ_INDEX.load()
+    TUTOR_DIRECTORY.load()
+    CALENDAR_CACHE.get_page(0)
+    ATTENDANCE_STATS.ensure_tables()
+    # В многопроцессном режиме напоминания рассылает только первый воркер
+    if WORKER_INDEX == 0:
+        REMINDERS.start()
+    STATE_SWEEPER.start(application)
+    if PERSISTENCE:
+        PERSISTENCE.start()
+    if WORKER_INDEX == 0:
+        BROADCASTS.start(BULK_SENDER.bot)
+    AUDIT.start()
+    # SIGTERM в обычном режиме обрабатываем сами; воркеров останавливает приёмник,
+    # несколько ботов — serve_tenants
+    if WORKERS == 1 and not TENANTS:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: application.create_task(stop_gracefully(application))
         )
+    HEALTH.warm.add(current_tenant().name)
+    HEALTH.start()
+    HEALTH.publish()
+
+
+# Отправка накопленного до остановки бота
+async def post_stop(application: Application) -> None:
+    await TUTOR_NOTIFIER.stop()
+
+
+# Остановка фоновых задач
+async def post_shutdown(application: Application) -> None:
+    await AUDIT.close()
+    await BULK_SENDER.bot.shutdown()
+    REMINDERS.stop()
+    STATE_SWEEPER.stop()
+    ARCHIVER.stop()
+    BROADCASTS.stop()
+    HEALTH.stop()
+    if PERSISTENCE:
+        PERSISTENCE.stop()
+
+
+# Шард апдейта: по chat_id, чтобы апдейты одного чата шли в один воркер по порядку
+def update_shard(data: dict, shards: int) -> int:
+    for value in data.values():
+        if isinstance(value, dict):
+            chat = value.get('chat') or (value.get('message') or {}).get('chat') or value.get('from') or {}
+            return chat.get('id', 0) % shards
+    return 0
+
+
+# Воркер: обычное приложение без собственного приёма апдейтов, апдейты — из очереди приёмника
+async def serve_worker(application: Application, inbox):
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    while True:
+        body = await asyncio.to_thread(inbox.get)
+        if body is None:
+            break
+        await application.update_queue.put(Update.de_json(json.loads(body), application.bot))
+    await drain()
+    await application.stop()
+    await post_stop(application)
+    await application.shutdown()
+    await post_shutdown(application)
+
+
+def run_worker(index: int, inbox, counters, ready_flags):
+    global WORKER_INDEX
+    # Останавливает воркеры приёмник, отправляя им None в очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    WORKER_INDEX = index
+    GENERATIONS.attach(counters)
+    HEALTH.attach(ready_flags)
+    # Общий лимит массовых отправок делится между воркерами
+    BULK_SENDER.interval = WORKERS / BULK_RATE
+    asyncio.run(serve_worker(build_application(), inbox))
+
+
+async def set_front_webhook(webhook_url: str):
+    bot = Bot(os.getenv('BOT_TOKEN'), base_url=os.getenv('BOT_API_URL') or 'https://api.telegram.org/bot')
+    async with bot:
+        await bot.set_webhook(
+            url=webhook_url,
+            secret_token=os.getenv('WEBHOOK_SECRET'),
+            allowed_updates=Update.ALL_TYPES
+        )
+
 
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', start)],
-            states={
-                FULL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_full_name)],
-                CONFIRM_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_name)],
-                PHONE_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone_number)],
-                TUTOR_CODE_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tutor_code)],
-                TUTOR_AUTH: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tutor_auth)],
-                SKS_PHOTO: [MessageHandler(filters.PHOTO, handle_sks_photo)],
-                MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu)],
-                BROADCAST_MESSAGE: [MessageHandler(filters.ALL, send_broadcast)]  # ← исправлено
-            },
-            fallbacks=[CommandHandler('cancel', cancel)]
+# Приёмник вебхука: проверяет секрет, отвечает сразу и кладёт апдейт в очередь своего воркера
+def make_front_handler(path: str, secret, queues):
+    class FrontHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            if self.path != path or (secret and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret):
+                self.send_response(403)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                shard = update_shard(json.loads(body), len(queues))
+            except ValueError:
+                shard = 0
+            queues[shard].put(body)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FrontHandler
+
+
+def run_sharded(workers: int):
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if not webhook_url:
+        print("Многопроцессный режим (WORKERS > 1) работает только через вебхук: задайте WEBHOOK_URL")
+        return
+    counters = multiprocessing.Array('q', len(SharedGenerations.NAMES))
+    ready_flags = multiprocessing.Array('b', workers)
+    queues = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [
+        multiprocessing.Process(
+            target=run_worker, args=(index, queues[index], counters, ready_flags), name=f"worker-{index}"
         )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    server = ThreadingHTTPServer(
+        (os.getenv('WEBHOOK_LISTEN', '0.0.0.0'), int(os.getenv('WEBHOOK_PORT', '8443'))),
+        make_front_handler(urlparse(webhook_url).path or '/', os.getenv('WEBHOOK_SECRET'), queues)
+    )
+    server.daemon_threads = True
+    # Приёмник готов, когда готовы все воркеры; после SIGTERM — уже нет
+    stopping = threading.Event()
+    health_server = start_health_server(lambda: {
+        **{f"worker-{index}": bool(flag) for index, flag in enumerate(ready_flags)},
+        'accepting': not stopping.is_set(),
+    })
+
+    def on_sigterm(*_):
+        stopping.set()
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    asyncio.run(set_front_webhook(webhook_url))
+    logger.info(f"Приёмник вебхука запущен, воркеров: {workers}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for inbox in queues:
+            inbox.put(None)
+        for process in processes:
+            process.join()
+        if health_server:
+            health_server.shutdown()
+
+
+# Корутина в контексте тенанта: задачи, которые она создаёт, тоже работают с его данными
+async def in_tenant(tenant: Tenant, coroutine_function, *args):
+    TENANT.set(tenant)
+    return await coroutine_function(*args)
+
+
+async def start_tenant() -> Application:
+    if DB_BACKEND == 'sqlite':
+        init_sqlite_schema()
+    application = build_application()
+    await application.initialize()
+    await post_init(application)
+    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    await application.start()
+    logger.info(f"Бот {current_tenant().name} запущен: @{application.bot.username}")
+    return application
+
+
+async def stop_tenant(application: Application):
+    await application.updater.stop()
+    await application.stop()
+    await post_stop(application)
+
+
+async def shutdown_tenant(application: Application):
+    await application.shutdown()
+    await post_shutdown(application)
+
+
+# Несколько ботов в одном цикле событий: у каждого своё приложение, кэши и БД,
+# общие — пул соединений с БД, клиенты Bot API и проверки готовности
+async def serve_tenants(tenants):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    applications = []
+    try:
+        for tenant in tenants:
+            applications.append((tenant, await asyncio.create_task(in_tenant(tenant, start_tenant))))
+        await stopping.wait()
+        logger.info("Получен сигнал остановки, останавливаю ботов")
+        await drain()
+    finally:
+        # Общие клиенты Bot API закрываются только после остановки всех ботов
+        await asyncio.gather(*(in_tenant(tenant, stop_tenant, application) for tenant, application in applications))
+        await asyncio.gather(*(in_tenant(tenant, shutdown_tenant, application) for tenant, application in applications))
+
+
+# Сборка приложения со всеми обработчиками (общая для обычного режима и воркеров)
+def build_application() -> Application:
+    builder = (
+        Application.builder()
+        .token(current_tenant().token)
+        .request(INTERACTIVE_LANE)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .context_types(ContextTypes(user_data=UserState))
+    )
+    if PERSISTENCE:
+        builder = builder.persistence(PERSISTENCE.local())
+    # Альтернативный адрес Bot API: локальный сервер или нагрузочный стенд (load_test.py)
+    if os.getenv('BOT_API_URL'):
+        builder = builder.base_url(os.getenv('BOT_API_URL'))
+    application = builder.build()
+
+    broadcast_conv = ConversationHandler(
+        entry_points=[
+            MessageHandler(filters.Regex("^📢 Рассылка для группы$"), tutor_broadcast_entry),
+            MessageHandler(filters.Regex("^📢 Рассылка$"), choose_broadcast_group)
+        ],
+        states={
+            CHOOSE_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_chosen)],
+            BROADCAST_MESSAGE: [MessageHandler(filters.ALL, send_broadcast)]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='broadcast',
+        persistent=PERSISTENCE is not None
+    )
+
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            FULL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_full_name)],
+            CONFIRM_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_name)],
+            PHONE_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone_number)],
+            TUTOR_CODE_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tutor_code)],
+            TUTOR_AUTH: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tutor_auth)],
+            SKS_PHOTO: [MessageHandler(filters.PHOTO, handle_sks_photo)],
+            MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu)],
+            BROADCAST_MESSAGE: [MessageHandler(filters.ALL, send_broadcast)]  # ← исправлено
+        },
+        # Ссылка на отметку срабатывает в любом состоянии диалога
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            CommandHandler('start', start, filters.Regex(f'^/start {CHECKIN_PREFIX}'))
+        ],
+        name='main',
+        persistent=PERSISTENCE is not None
+    )
+
+    # Тенант, учёт активности и антифлуд — раньше всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, functools.partial(tenant_guard, current_tenant())), group=-3)
+    application.add_handler(TypeHandler(Update, track_user_state), group=-2)
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
+    application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("menu", menu_command))
+    application.add_handler(CommandHandler("code", code_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("setpoints", set_points_command))
+    application.add_handler(CommandHandler("info", info_command))
+    application.add_handler(CommandHandler("sks", sks_inbox_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("bulkpoints", bulk_points_command))
+    application.add_handler(CommandHandler("memory", memory_command))
+    application.add_handler(CommandHandler("queues", queues_command))
+    application.add_handler(CommandHandler("analytics", analytics_command))
+    application.add_handler(CommandHandler("archive", archive_command))
+    application.add_handler(CommandHandler("qr", qr_command))
+    application.add_handler(CommandHandler("audit", audit_command))
+    # Документы импорта — после рассылки, чтобы файл в BROADCAST_MESSAGE ушёл в рассылку
+    application.add_handler(broadcast_conv)
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu))
+    application.add_error_handler(error_handler)
+    return application
 
-        application.add_handler(conv_handler)
-        application.add_handler(CommandHandler("menu", menu_command))
-        application.add_handler(CommandHandler("code", code_command))
-        application.add_handler(CommandHandler("stats", stats_command))
-        application.add_handler(CommandHandler("setpoints", set_points_command))
-        application.add_handler(CommandHandler("info", info_command))
-        application.add_handler(broadcast_conv)
-        application.add_handler(CallbackQueryHandler(button_handler))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu))
-
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+def main() -> None:
+    try:
+        if TENANTS:
+            if WORKERS > 1 or os.getenv('WEBHOOK_URL'):
+                print("Несколько ботов (BOT_TENANTS) работают только в одном процессе через polling")
+                return
+            start_health_server(HEALTH.checks)
+            asyncio.run(serve_tenants(TENANTS))
+            return
+        if DB_BACKEND == 'sqlite':
+            init_sqlite_schema()
+        if WORKERS > 1:
+            run_sharded(WORKERS)
+            return
+        application = build_application()
+        start_health_server(HEALTH.checks)
+
+        # SIGTERM обрабатывает stop_gracefully (см. post_init), остальные сигналы — как обычно
+        stop_signals = (signal.SIGINT, signal.SIGABRT)
+        webhook_url = os.getenv('WEBHOOK_URL')
+        if webhook_url:
+            application.run_webhook(
+                listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', '8443')),
+                url_path=urlparse(webhook_url).path.lstrip('/'),
+                webhook_url=webhook_url,
+                secret_token=os.getenv('WEBHOOK_SECRET'),
+                allowed_updates=Update.ALL_TYPES,
+                stop_signals=stop_signals
+            )
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=stop_signals)
     except Exception as e:
         print(f"Ошибка запуска бота: {e}")
 
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+# Нагрузочный стенд для бота: локальная заглушка Telegram Bot API
+# (getUpdates / webhook, приёмники sendMessage / sendPhoto / copyMessage)
+# и сценарии виртуальных пользователей, которые прогоняются против настоящего main().
+#
+# Пример:
+#   DB_NAME=student_bot_loadtest python load_test.py --stages 10,50,100 --duration 30 \
+#       --mix registration=1,browse=3,checkin=2 --checkin-code 1234 --latency-ms 40 --rate-429 0.01
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+FAKE_TOKEN = '123456:LOADTEST'
+
+# Методы, ответы на которые считаются «ответом бота» пользователю
+SINK_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'copyMessage', 'sendMediaGroup'}
+EDIT_METHODS = {'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'}
+
+
+# Заглушка Bot API
+class FakeBotApi:
+    def __init__(self, host, port, latency_ms, rate_429, retry_after, webhook_connections):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.webhook_connections = webhook_connections
+
+        self.pending = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_queue = asyncio.Queue()
+        self.webhook_tasks = []
+        self.ready = asyncio.Event()
+
+        self.inboxes = {}
+        self.calls = {}
+        self.injected_429 = 0
+        self.delivery_errors = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+
+    async def stop(self):
+        for task in self.webhook_tasks:
+            task.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    def backlog(self):
+        return len(self.pending) + self.webhook_queue.qsize()
+
+    def inbox(self, chat_id):
+        if chat_id not in self.inboxes:
+            self.inboxes[chat_id] = asyncio.Queue()
+        return self.inboxes[chat_id]
+
+    # Поставить апдейт в очередь доставки
+    def push_update(self, payload):
+        update = {'update_id': self.next_update_id, **payload}
+        self.next_update_id += 1
+        if self.webhook_url:
+            self.webhook_queue.put_nowait(update)
+        else:
+            self.pending.append(update)
+            self.new_updates.set()
+        return update
+
+    def push_text(self, user_id, text):
+        message = {
+            'message_id': self.next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'VU{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'VU{user_id}', 'username': f'vu{user_id}'},
+            'text': text
+        }
+        self.next_message_id += 1
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return self.push_update({'message': message})
+
+    # --- HTTP-сервер ---
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(int(headers['content-length']))
+
+                status, payload = await self.dispatch(target, headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def parse_params(headers, body):
+        content_type = headers.get('content-type', '')
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        # multipart — содержимое файлов стенду не нужно
+        return {}
+
+    def fake_message(self, chat_id, **extra):
+        message = {
+            'message_id': self.next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+            **extra
+        }
+        self.next_message_id += 1
+        return message
+
+    async def dispatch(self, target, headers, body):
+        api_method = urlparse(target).path.rsplit('/', 1)[-1]
+        params = self.parse_params(headers, body)
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+
+        if api_method == 'getMe':
+            return 200, {'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot',
+                'can_join_groups': True, 'can_read_all_group_messages': False,
+                'supports_inline_queries': False
+            }}
+        if api_method == 'getUpdates':
+            return 200, {'ok': True, 'result': await self.get_updates(params)}
+        if api_method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.webhook_secret = params.get('secret_token')
+            self.start_webhook_delivery()
+            return 200, {'ok': True, 'result': True}
+
+        if api_method in SINK_METHODS or api_method in EDIT_METHODS:
+            if self.latency_ms:
+                await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency_ms / 1000)
+            if self.rate_429 and random.random() < self.rate_429:
+                self.injected_429 += 1
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after}
+                }
+            chat_id = params.get('chat_id')
+            if api_method in SINK_METHODS and chat_id is not None:
+                self.inbox(int(chat_id)).put_nowait((time.monotonic(), api_method, params))
+            if api_method == 'copyMessage':
+                return 200, {'ok': True, 'result': {'message_id': self.next_message_id}}
+            if api_method == 'sendMediaGroup':
+                media = json.loads(params.get('media', '[]'))
+                return 200, {'ok': True, 'result': [self.fake_message(chat_id, photo=[]) for _ in media]}
+            return 200, {'ok': True, 'result': self.fake_message(chat_id, text=params.get('text', ''))}
+
+        # deleteWebhook, answerCallbackQuery, setMyCommands и прочее
+        return 200, {'ok': True, 'result': True}
+
+    async def get_updates(self, params):
+        self.ready.set()
+        offset = int(params.get('offset', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        timeout = float(params.get('timeout', 0) or 0)
+        self.pending = [u for u in self.pending if u['update_id'] >= offset]
+        if not self.pending and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:limit]
+
+    # --- Доставка через webhook ---
+    def start_webhook_delivery(self):
+        if self.webhook_tasks:
+            return
+        for _ in range(self.webhook_connections):
+            self.webhook_tasks.append(asyncio.create_task(self.webhook_worker()))
+        self.ready.set()
+
+    async def webhook_worker(self):
+        url = urlparse(self.webhook_url)
+        reader = writer = None
+        while True:
+            update = await self.webhook_queue.get()
+            data = json.dumps(update).encode()
+            headers = (
+                f"POST {url.path or '/'} HTTP/1.1\r\n"
+                f"Host: {url.hostname}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+            )
+            if self.webhook_secret:
+                headers += f"X-Telegram-Bot-Api-Secret-Token: {self.webhook_secret}\r\n"
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                writer.write((headers + "\r\n").encode() + data)
+                await writer.drain()
+                status_line = await reader.readline()
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                if b' 200 ' not in status_line:
+                    self.delivery_errors += 1
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                self.delivery_errors += 1
+                writer = None
+
+
+# Сценарии пользователей: список сообщений, на каждое ждём ответ бота
+def build_journeys(args):
+    names = []
+    if args.roster:
+        with open(args.roster, encoding='utf-8') as f:
+            names = [line.strip() for line in f if line.strip()]
+    return {
+        'registration': lambda: [
+            '/start',
+            random.choice(names) if names else 'Нагрузочный Тест Тестович',
+            '✅ Да',
+            f'+7900{random.randint(1000000, 9999999)}'
+        ],
+        'browse': lambda: ['/menu', '📅 Календарь мероприятий', '❓ Помощь', '↩️ Назад'],
+        'checkin': lambda: ['/menu', '✅ Отметиться на мероприятии', args.checkin_code],
+        'broadcast': lambda: ['/menu', '📢 Рассылка', 'Всем группам', f'Нагрузочный тест {time.time():.0f}'],
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if float(weight or 1) > 0:
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class StageStats:
+    def __init__(self, users):
+        self.users = users
+        self.latencies = []
+        self.steps = 0
+        self.timeouts = 0
+        self.journeys = 0
+        self.failed_journeys = 0
+        self.backlog = []
+
+
+# Виртуальный пользователь
+async def virtual_user(api, user_id, journey_name, journeys, stats, deadline, reply_timeout):
+    inbox = api.inbox(user_id)
+    while time.monotonic() < deadline:
+        failed = False
+        for text in journeys[journey_name]():
+            # Опоздавшие ответы на предыдущий шаг не должны засчитываться текущему
+            while not inbox.empty():
+                inbox.get_nowait()
+            sent_at = time.monotonic()
+            api.push_text(user_id, text)
+            stats.steps += 1
+            try:
+                received_at, _, _ = await asyncio.wait_for(inbox.get(), reply_timeout)
+                stats.latencies.append(received_at - sent_at)
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                failed = True
+                break
+        stats.journeys += 1
+        stats.failed_journeys += failed
+
+
+async def sample_backlog(api, stats, deadline):
+    while time.monotonic() < deadline:
+        stats.backlog.append(api.backlog())
+        await asyncio.sleep(0.5)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def print_report(stage, stats, api, calls_before, injected_before, duration):
+    sends = sum(api.calls.get(m, 0) - calls_before.get(m, 0) for m in SINK_METHODS)
+    error_rate = stats.timeouts / stats.steps * 100 if stats.steps else 0
+    backlog_growth = stats.backlog[-1] - stats.backlog[0] if stats.backlog else 0
+    lat = [x * 1000 for x in stats.latencies]
+    print(
+        f"\n=== Этап {stage}: {stats.users} виртуальных пользователей, {duration:.0f} с ===\n"
+        f"  шагов: {stats.steps}, сценариев: {stats.journeys} (неуспешных {stats.failed_journeys})\n"
+        f"  задержка, мс: p50={percentile(lat, 0.5):.0f} p95={percentile(lat, 0.95):.0f} "
+        f"p99={percentile(lat, 0.99):.0f} max={max(lat, default=0):.0f} "
+        f"mean={statistics.fmean(lat) if lat else 0:.0f}\n"
+        f"  таймауты: {stats.timeouts} ({error_rate:.1f}%), "
+        f"инъекций 429: {api.injected_429 - injected_before}, ошибок webhook: {api.delivery_errors}\n"
+        f"  очередь апдейтов: max={max(stats.backlog, default=0)} прирост={backlog_growth:+d}\n"
+        f"  исходящих сообщений: {sends} ({sends / duration:.1f}/с)"
+    )
+
+
+def start_bot(api, args):
+    env = dict(os.environ)
+    env['BOT_TOKEN'] = FAKE_TOKEN
+    env['BOT_API_URL'] = api.base_url
+    # Порт проверок бота не должен пересечься с фейковым Bot API
+    env['HEALTH_PORT'] = '0'
+    if args.webhook:
+        env['WEBHOOK_URL'] = f"http://127.0.0.1:{args.webhook_port}/loadtest"
+        env['WEBHOOK_PORT'] = str(args.webhook_port)
+        env['WEBHOOK_LISTEN'] = '127.0.0.1'
+    else:
+        env.pop('WEBHOOK_URL', None)
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+    return subprocess.Popen([sys.executable, bot_path], env=env)
+
+
+async def run(args):
+    api = FakeBotApi(args.host, args.port, args.latency_ms, args.rate_429, args.retry_after,
+                     args.webhook_connections)
+    await api.start()
+    bot = start_bot(api, args)
+    try:
+        await asyncio.wait_for(api.ready.wait(), 60)
+        if args.webhook:
+            # Даём серверу вебхука подняться после setWebhook
+            await asyncio.sleep(1)
+
+        journeys = build_journeys(args)
+        mix = parse_mix(args.mix)
+        if 'broadcast' in mix and not args.admin_id:
+            print("Сценарий broadcast требует --admin-id, он исключён из смеси")
+            mix.pop('broadcast')
+        names, weights = list(mix), list(mix.values())
+
+        for stage, users in enumerate(int(x) for x in args.stages.split(',')):
+            stats = StageStats(users)
+            calls_before = dict(api.calls)
+            injected_before = api.injected_429
+            started = time.monotonic()
+            deadline = started + args.duration
+            any_broadcast = False
+            tasks = []
+            for i in range(users):
+                journey = random.choices(names, weights)[0]
+                # Рассылку делает админ; одновременно — не больше одной
+                if journey == 'broadcast' and not any_broadcast:
+                    user_id = args.admin_id
+                    any_broadcast = True
+                else:
+                    journey = 'browse' if journey == 'broadcast' else journey
+                    user_id = args.user_id_base + i
+                tasks.append(virtual_user(api, user_id, journey, journeys, stats, deadline, args.reply_timeout))
+            await asyncio.gather(sample_backlog(api, stats, deadline), *tasks)
+            print_report(stage + 1, stats, api, calls_before, injected_before, time.monotonic() - started)
+            if bot.poll() is not None:
+                print(f"Бот завершился с кодом {bot.returncode}")
+                break
+    finally:
+        if bot.poll() is None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(15)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование бота на локальной заглушке Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--stages', default='10,50,100', help="число виртуальных пользователей по этапам")
+    parser.add_argument('--duration', type=float, default=30, help="длительность этапа, с")
+    parser.add_argument('--mix', default='registration=1,browse=3,checkin=2',
+                        help="веса сценариев: registration, browse, checkin, broadcast")
+    parser.add_argument('--user-id-base', type=int, default=900000000,
+                        help="telegram_id первого виртуального пользователя")
+    parser.add_argument('--admin-id', type=int, help="telegram_id админа для сценария broadcast")
+    parser.add_argument('--roster', help="файл с ФИО студентов из тестовой БД для регистрации")
+    parser.add_argument('--checkin-code', default='0000', help="код мероприятия для массовой отметки")
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка приёмников send*/copy*")
+    parser.add_argument('--rate-429', type=float, default=0, help="доля ответов 429 от приёмников")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--reply-timeout', type=float, default=10)
+    parser.add_argument('--webhook', action='store_true', help="доставлять апдейты через webhook")
+    parser.add_argument('--webhook-port', type=int, default=8443)
+    parser.add_argument('--webhook-connections', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
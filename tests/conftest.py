@@ -0,0 +1,71 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+# MySQL-прогон включается только явно заданным DB_HOST, а не тем, что подтянет .env бота
+MYSQL_HOST = os.getenv('DB_HOST')
+os.environ.setdefault('BOT_TOKEN', '1:test')
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+
+BACKENDS = ['sqlite'] + (['mysql'] if MYSQL_HOST else [])
+TABLES = (
+    'users', 'tutors', 'tutor_groups', 'events', 'event_attendance', 'faq_questions', 'sks_applications',
+    'bot_state', 'broadcast_jobs', 'attendance_event_stats', 'attendance_group_stats',
+    'attendance_student_stats', 'events_archive', 'event_attendance_archive', 'faq_questions_archive',
+    'sks_applications_archive', 'audit_log',
+)
+
+
+def make_tenant(name: str, tmp_path) -> bot.Tenant:
+    return bot.Tenant(name, '1:test', os.getenv('DB_NAME'), str(tmp_path / f'{name}.db'), f'secret:{name}')
+
+
+# Отдельный тенант на тест: свой файл sqlite и свои экземпляры кэшей TenantLocal
+@pytest.fixture
+def tenant(tmp_path):
+    tenant = make_tenant(f'test_{tmp_path.name}', tmp_path)
+    token = bot.TENANT.set(tenant)
+    yield tenant
+    bot.TENANT.reset(token)
+
+
+# Чистая БД выбранного бэкенда. Основные таблицы в MySQL создаются заранее,
+# свои таблицы бот создаёт сам — как в post_init
+@pytest.fixture(params=BACKENDS)
+def db(request, tenant, monkeypatch):
+    monkeypatch.setattr(bot, 'DB_BACKEND', request.param)
+    if request.param == 'sqlite':
+        bot.init_sqlite_schema()
+    bot.DatabasePersistence(0).ensure_table()
+    bot.BROADCASTS.ensure_table()
+    bot.ATTENDANCE_STATS.ensure_tables()
+    bot.ARCHIVER.ensure_tables()
+    bot.AUDIT.ensure_table()
+    if request.param == 'mysql':
+        connection = bot.get_db_connection(primary=True)
+        cursor = connection.cursor()
+        for table in TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        connection.commit()
+        connection.close()
+    return request.param
+
+
+@pytest.fixture
+def execute(db):
+    def run(sql, params=None, fetch=False):
+        connection = bot.get_db_connection(primary=True)
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if fetch else None
+            connection.commit()
+            return rows
+        finally:
+            cursor.close()
+            connection.close()
+    return run
@@ -0,0 +1,196 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from mysql.connector import Error
+
+import bot
+
+
+@pytest.mark.parametrize('sql, expected, lock', [
+    ("SELECT * FROM users WHERE telegram_id = %s", "SELECT * FROM users WHERE telegram_id = ?", False),
+    ("SELECT id FROM users WHERE id = %s FOR UPDATE", "SELECT id FROM users WHERE id = ?", True),
+    ("SELECT * FROM events WHERE event_date >= NOW()",
+     "SELECT * FROM events WHERE event_date >= datetime('now', 'localtime')", False),
+    ("INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b), c = c + 1",
+     "INSERT INTO t (a, b) VALUES (?, ?) ON CONFLICT DO UPDATE SET b = excluded.b, c = c + 1", False),
+])
+def test_translate_to_sqlite(sql, expected, lock):
+    assert bot.translate_to_sqlite(sql) == (expected, lock)
+
+
+def test_sqlite_errors_map_to_mysql_errno():
+    assert bot.as_db_error(bot.sqlite3.IntegrityError("UNIQUE constraint failed")).errno == 1062
+    assert bot.as_db_error(bot.sqlite3.OperationalError("database is locked")).errno == 1205
+    assert bot.as_db_error(bot.sqlite3.OperationalError("no such table: x")).errno not in (1062, 1205)
+
+
+def add_student(execute, telegram_id: int, group: str = 'G1', name: str = None):
+    execute(
+        "INSERT INTO users (telegram_id, full_name, group_name, student_id) VALUES (%s, %s, %s, %s)",
+        (telegram_id, name or f'Студент {telegram_id}', group, str(telegram_id))
+    )
+
+
+def add_event(execute, title: str, event_date: datetime) -> dict:
+    execute("INSERT INTO events (title, event_date, attendance_code) VALUES (%s, %s, %s)", (title, event_date, title))
+    return execute("SELECT id, event_date FROM events WHERE title = %s", (title,), fetch=True)[0]
+
+
+def check_in(event: dict, telegram_id: int) -> bool:
+    connection = bot.get_db_connection(primary=True)
+    cursor = connection.cursor(dictionary=True)
+    marked = bot.record_attendance(cursor, event, telegram_id)
+    connection.commit()
+    connection.close()
+    return marked
+
+
+def test_duplicate_key_errno(execute):
+    add_student(execute, 1)
+    with pytest.raises(Error) as error:
+        add_student(execute, 1)
+    assert error.value.errno == 1062
+
+
+def test_on_duplicate_key_update(execute):
+    bot.BroadcastJobs.save('job', 7, 'send_message', {'text': 'Привет'}, {1, 2, 3})
+    bot.BroadcastJobs.save('job', 7, 'send_message', {'text': 'Привет'}, {3})
+    rows = execute("SELECT job_id, report_chat_id, kwargs, chat_ids FROM broadcast_jobs", fetch=True)
+    assert len(rows) == 1
+    assert json.loads(rows[0]['chat_ids']) == [3]
+    assert json.loads(rows[0]['kwargs']) == {'text': 'Привет'}
+    bot.BroadcastJobs.delete('job')
+    assert execute("SELECT job_id FROM broadcast_jobs", fetch=True) == []
+
+
+def test_tutor_directory(execute):
+    add_student(execute, 1)
+    execute("INSERT INTO users (telegram_id, full_name, role) VALUES (%s, %s, %s)", (50, 'Тьютор', bot.ROLE_TUTOR))
+    tutor_id = execute("SELECT id FROM users WHERE telegram_id = %s", (50,), fetch=True)[0]['id']
+    execute("INSERT INTO tutor_groups (tutor_id, group_name) VALUES (%s, %s)", (tutor_id, 'G1'))
+    assert bot.TUTOR_DIRECTORY.load()
+    assert bot.TUTOR_DIRECTORY.tutor_chat_ids('G1') == [50]
+    assert bot.TUTOR_DIRECTORY.tutor_name('G1') == 'Тьютор'
+    assert bot.TUTOR_DIRECTORY.member(1) is None
+
+
+def test_calendar_shows_upcoming_events(execute):
+    add_event(execute, 'Прошедшее', datetime.now() - timedelta(days=1))
+    add_event(execute, 'Будущее', datetime.now() + timedelta(days=1))
+    text, pages = bot.CALENDAR_CACHE.get_page(0)
+    assert pages == 1
+    assert 'Будущее' in text and 'Прошедшее' not in text
+
+
+def test_faq_index_reads_answered_and_archived(execute):
+    execute("INSERT INTO faq_questions (user_id, question, answer, status) VALUES (%s, %s, %s, %s)",
+            (1, 'Где получить студенческий билет?', 'В деканате', 'answered'))
+    execute("INSERT INTO faq_questions_archive (id, user_id, question, answer, status, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (100, 1, 'Когда начинается сессия?', 'В январе', 'answered', datetime.now()))
+    bot.FAQ_INDEX.load()
+    answers = {doc['answer'] for doc in bot.FAQ_INDEX.docs}
+    assert {'В деканате', 'В январе'} <= answers
+
+
+def test_sks_inbox_page(execute):
+    add_student(execute, 1)
+    for telegram_id in (1, 2):
+        execute("INSERT INTO sks_applications (user_id, photo_url) VALUES (%s, %s)", (telegram_id, 'photo'))
+    apps, total = bot.load_sks_page(0)
+    assert total == 2
+    assert [app['full_name'] for app in apps] == ['Студент 1', None]
+
+
+def test_attendance_stats(execute):
+    for telegram_id in (1, 2, 3):
+        add_student(execute, telegram_id)
+    first = add_event(execute, 'Первое', datetime.now() - timedelta(days=2))
+    second = add_event(execute, 'Второе', datetime.now() - timedelta(days=1))
+    for event, students in ((first, (1, 2)), (second, (1,))):
+        for telegram_id in students:
+            assert check_in(event, telegram_id)
+
+    def aggregates():
+        return (
+            execute("SELECT event_id, attendees FROM attendance_event_stats ORDER BY event_id", fetch=True),
+            execute("SELECT group_name, checkins FROM attendance_group_stats", fetch=True),
+            execute("SELECT telegram_id, attended, streak, best_streak FROM attendance_student_stats "
+                    "ORDER BY telegram_id", fetch=True),
+        )
+
+    events, groups, students = aggregates()
+    assert [row['attendees'] for row in events] == [2, 1]
+    assert groups == [{'group_name': 'G1', 'checkins': 3}]
+    assert [(row['telegram_id'], row['attended'], row['streak']) for row in students] == [(1, 2, 2), (2, 1, 1)]
+    assert bot.ATTENDANCE_STATS.never_attended() == (1, [{'full_name': 'Студент 3', 'group_name': 'G1'}])
+    assert 'прошло мероприятий: 2' in bot.ATTENDANCE_STATS.overview()
+
+    # Пересчёт с нуля даёт те же агрегаты
+    assert bot.ATTENDANCE_STATS.rebuild()
+    assert aggregates() == (events, groups, students)
+
+
+
+# Удаление мероприятия убирает его отметки из счётчиков групп и студентов и смыкает серии
+def test_delete_event_updates_aggregates(execute):
+    for telegram_id in (1, 2):
+        add_student(execute, telegram_id)
+    events = [add_event(execute, title, datetime.now() - timedelta(days=days))
+              for title, days in (('Первое', 3), ('Второе', 2), ('Третье', 1))]
+    for event, students in zip(events, ((1,), (2,), (1,))):
+        for telegram_id in students:
+            check_in(event, telegram_id)
+
+    bot.delete_event(events[1]['id'])
+    assert execute("SELECT group_name, checkins FROM attendance_group_stats", fetch=True) == [
+        {'group_name': 'G1', 'checkins': 2}
+    ]
+    students = execute("SELECT telegram_id, attended, streak FROM attendance_student_stats", fetch=True)
+    assert [(row['telegram_id'], row['attended'], row['streak']) for row in students] == [(1, 2, 2)]
+
+
+# Серия продолжается после мероприятия, уже перенесённого в архив
+def test_streak_continues_after_archived_event(execute):
+    add_student(execute, 1)
+    old = add_event(execute, 'Старое', datetime.now() - timedelta(days=bot.ARCHIVE_EVENTS_DAYS + 1))
+    check_in(old, 1)
+    bot.ARCHIVER.archive()
+    check_in(add_event(execute, 'Новое', datetime.now()), 1)
+    assert execute("SELECT streak FROM attendance_student_stats", fetch=True) == [{'streak': 2}]
+
+def test_archive_moves_old_rows(execute, monkeypatch):
+    monkeypatch.setattr(bot, 'ARCHIVE_BATCH_PAUSE', 0)
+    monkeypatch.setattr(bot, 'ARCHIVE_BATCH_SIZE', 1)
+    add_student(execute, 1)
+    old = datetime.now() - timedelta(days=bot.ARCHIVE_EVENTS_DAYS + 1)
+    for title in ('Старое 1', 'Старое 2'):
+        check_in(add_event(execute, title, old), 1)
+    add_event(execute, 'Новое', datetime.now() + timedelta(days=1))
+    execute("INSERT INTO sks_applications (user_id, photo_url, status, created_at) VALUES (%s, %s, %s, %s)",
+            (1, 'photo', 'approved', datetime.now() - timedelta(days=bot.ARCHIVE_SKS_DAYS + 1)))
+
+    moved = bot.ARCHIVER.archive()
+    assert moved == {'events': 2, 'event_attendance': 2, 'faq_questions': 0, 'sks_applications': 1}
+    assert [row['title'] for row in execute("SELECT title FROM events", fetch=True)] == ['Новое']
+    assert execute("SELECT COUNT(*) AS total FROM event_attendance", fetch=True)[0]['total'] == 0
+
+    found = bot.ARCHIVER.search('events', 'Старое')
+    assert sorted((row['title'], row['attendees']) for row in found) == [('Старое 1', 1), ('Старое 2', 1)]
+    assert [row['user_id'] for row in bot.ARCHIVER.search('sks', '1')] == [1]
+    # Аналитика учитывает архивные мероприятия
+    assert 'прошло мероприятий: 2' in bot.ATTENDANCE_STATS.overview()
+
+
+def test_audit_log(execute):
+    for i in range(5):
+        bot.AUDIT.record(999, 'points', f'user:{i % 2}', f'+{i}')
+    bot.AUDIT.record(5, 'event_add', 'event:3', 'Встреча')
+    asyncio.run(bot.AUDIT.flush())
+    assert execute("SELECT COUNT(*) AS total FROM audit_log", fetch=True)[0]['total'] == 6
+
+    assert [row['details'] for row in bot.AUDIT.search({'actor': 5})] == ['Встреча']
+    assert len(bot.AUDIT.search({'action': 'points', 'target': 'user:1'})) == 2
+    assert bot.AUDIT.search({'until': datetime.now() - timedelta(days=1)}) == []
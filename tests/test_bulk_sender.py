@@ -0,0 +1,46 @@
+import asyncio
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import bot
+
+
+class FloodBot:
+    def __init__(self, floods: int):
+        self.floods = floods
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    async def send_message(self, chat_id, text):
+        self.calls.append((chat_id, asyncio.get_running_loop().time()))
+        if self.floods:
+            self.floods -= 1
+            raise RetryAfter(timedelta(seconds=0.2))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+
+
+# 429 ставит на паузу всю рассылку: никто не теряет попытки и не выпадает из неё
+def test_retry_after_pauses_all_sends(monkeypatch):
+    monkeypatch.setattr(bot, 'BULK_CONCURRENCY', 4)
+
+    async def run():
+        sender = bot.BulkSender(rate=200)
+        sender.bot = FloodBot(floods=1)
+        remaining = set(range(30))
+        sent = await sender.send_many(range(30), 'send_message', remaining=remaining, text='Тест')
+        return sender, sent, remaining
+
+    sender, sent, remaining = asyncio.run(run())
+    assert sent == 30 and not remaining
+    assert sender.pending == 0
+    assert sender.bot.max_active <= 4
+    flood_at = sender.bot.calls[0][1]
+    # До конца паузы уходят только отправки, которые уже ждали свой слот
+    early = [at for _, at in sender.bot.calls[1:] if at < flood_at + 0.2]
+    assert len(early) < 4
+    assert len(sender.bot.calls) <= 30 + 4
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def event(execute):
+    execute("INSERT INTO users (telegram_id, full_name, group_name) VALUES (%s, %s, %s)", (100, 'Иванов', 'G1'))
+    execute("INSERT INTO events (title, event_date) VALUES (%s, %s)", ('Встреча', datetime.now()))
+    return execute("SELECT id, event_date FROM events", fetch=True)[0]
+
+
+def mark(event) -> bool:
+    connection = bot.get_db_connection(primary=True)
+    cursor = connection.cursor(dictionary=True)
+    marked = bot.record_attendance(cursor, event, 100)
+    connection.commit()
+    connection.close()
+    return marked
+
+
+# Повторная отметка не дублирует запись и баллы, даже без уникального ключа в таблице
+@pytest.mark.parametrize('unique_key', [True, False])
+def test_record_attendance_once(execute, event, db, unique_key):
+    if not unique_key:
+        if db != 'sqlite':
+            pytest.skip("схему MySQL тест не меняет")
+        execute("DROP TABLE event_attendance")
+        execute("CREATE TABLE event_attendance (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "event_id INTEGER NOT NULL, user_id INTEGER NOT NULL)")
+
+    assert mark(event) is True
+    assert mark(event) is False
+    assert execute("SELECT COUNT(*) AS total FROM event_attendance", fetch=True)[0]['total'] == 1
+    assert execute("SELECT points FROM users WHERE telegram_id = %s", (100,), fetch=True)[0]['points'] == 1
+
+
+def test_checkin_link_signature(tenant):
+    payload = bot.sign_checkin(42, datetime.now())
+    assert bot.verify_checkin(payload) == 42
+    assert bot.verify_checkin(payload[:-2] + ('AA' if payload[-2:] != 'AA' else 'BB')) is None
+    expired = bot.sign_checkin(42, datetime.now() - timedelta(hours=bot.CHECKIN_LINK_HOURS + 1))
+    assert bot.verify_checkin(expired) is None
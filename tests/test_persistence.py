@@ -0,0 +1,41 @@
+import asyncio
+import pickle
+from types import SimpleNamespace
+
+import bot
+
+
+def stored(execute):
+    rows = execute("SELECT user_id, chat_id, kind, state FROM bot_state ORDER BY kind", fetch=True)
+    return {(row['user_id'], row['chat_id'], row['kind']): pickle.loads(row['state']) for row in rows}
+
+
+# Завершённый диалог удаляется из bot_state, даже если состояние пользователя не подгрузилось
+def test_conversation_end_deleted_without_load(execute):
+    persistence = bot.DatabasePersistence(60)
+    persistence.write({(5, 5, 'main'): pickle.dumps(3)})
+
+    async def run():
+        await persistence.update_conversation('main', (5, 5), None)
+        await persistence.flush()
+
+    asyncio.run(run())
+    assert stored(execute) == {}
+
+
+# Вытеснение из памяти сохраняет диалог, а не удаляет его
+def test_eviction_keeps_conversation(execute, monkeypatch):
+    persistence = bot.DatabasePersistence(60)
+    handler = SimpleNamespace(_conversations={(5, 5): 3}, persistent=True)
+    monkeypatch.setattr(persistence, 'conversation_handlers', lambda: {'main': handler})
+    monkeypatch.setattr(bot, 'STATE_SWEEPER', SimpleNamespace(application=SimpleNamespace(user_data={})))
+    persistence.loaded.add(5)
+
+    async def run():
+        persistence.release(5)
+        del handler._conversations[(5, 5)]
+        await persistence.update_conversation('main', (5, 5), None)
+        await persistence.flush()
+
+    asyncio.run(run())
+    assert stored(execute) == {(5, 5, 'main'): 3}
@@ -0,0 +1,33 @@
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize('text, lines', [
+    ("/setpoints 15 10\n16 5", ['15 10', '16 5']),
+    ("/bulkpoints\n15 10 олимпиада\n16 -2", ['15 10 олимпиада', '16 -2']),
+    ("/bulkpoints@ipmkn_bot 15 10", ['15 10']),
+    ("/bulkpoints", []),
+])
+def test_points_lines_keep_command_line_entry(text, lines):
+    assert bot.points_lines(text) == lines
+
+
+def test_apply_points_batch(execute):
+    for telegram_id in (1, 2):
+        execute("INSERT INTO users (telegram_id, full_name) VALUES (%s, %s)", (telegram_id, f'Студент {telegram_id}'))
+    ids = [row['id'] for row in execute("SELECT id FROM users ORDER BY id", fetch=True)]
+    entries, errors = bot.parse_points_lines(bot.points_lines(f"/setpoints {ids[0]} 10\n{ids[1]} 5\n{ids[0]} -3"))
+    assert not errors
+    assert bot.apply_points_batch(entries) == []
+    points = execute("SELECT points FROM users ORDER BY id", fetch=True)
+    assert [row['points'] for row in points] == [7, 5]
+
+
+# Неизвестный пользователь — не применяется ни одна строка
+def test_apply_points_batch_all_or_nothing(execute):
+    execute("INSERT INTO users (telegram_id, full_name) VALUES (%s, %s)", (1, 'Студент'))
+    user_id = execute("SELECT id FROM users", fetch=True)[0]['id']
+    entries, _ = bot.parse_points_lines([f"{user_id} 10", f"{user_id + 100} 5"])
+    assert bot.apply_points_batch(entries) == [f"строка 2: пользователь {user_id + 100} не найден"]
+    assert execute("SELECT points FROM users", fetch=True)[0]['points'] == 0
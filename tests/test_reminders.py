@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+import bot
+
+
+# Расписание меняет только воркер 0; остальные лишь поднимают счётчик 'events'
+def test_update_only_on_first_worker(monkeypatch):
+    scheduler = bot.ReminderScheduler([60])
+    event = {'title': 'Встреча', 'event_date': datetime.now() + timedelta(days=1)}
+    monkeypatch.setattr(bot, 'WORKER_INDEX', 1)
+    scheduler.update(1, event)
+    assert scheduler.heap == [] and scheduler.events == {}
+
+    monkeypatch.setattr(bot, 'WORKER_INDEX', 0)
+    scheduler.update(1, event)
+    assert scheduler.events[1]['title'] == 'Встреча'
+    scheduler.update(1, None)
+    assert scheduler.events == {}
+
+
+# Перенос мероприятия: напоминание ставится по новой дате, старая запись в куче устаревает
+def test_update_reschedules_moved_event(monkeypatch):
+    monkeypatch.setattr(bot, 'WORKER_INDEX', 0)
+    scheduler = bot.ReminderScheduler([60])
+    scheduler.update(1, {'title': 'Встреча', 'event_date': datetime.now() + timedelta(hours=2)})
+    moved = datetime.now() + timedelta(hours=3)
+    scheduler.update(1, {'title': 'Встреча', 'event_date': moved})
+
+    version = scheduler.events[1]['version']
+    assert [fire_at for fire_at, _, entry in scheduler.heap if entry == version] == [moved - timedelta(minutes=60)]
+    assert len(scheduler.heap) == 2
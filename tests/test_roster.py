@@ -0,0 +1,34 @@
+import tempfile
+
+import pytest
+
+import bot
+
+
+def spooled(content: bytes, max_size: int = 16):
+    data = tempfile.SpooledTemporaryFile(max_size=max_size)
+    data.write(content)
+    return data
+
+
+# Файл читается из потока (в том числе уже выгруженного на диск) и повторно — при повторе импорта
+def test_import_roster_from_spooled_csv(execute):
+    content = "ФИО;№ зачётки;Группа\nИванов Иван;101;G1\nПетров Пётр;;G1\n".encode('utf-8-sig')
+    with spooled(content) as data:
+        assert data._rolled
+        assert bot.import_roster(data, 'roster.csv') == (1, 0, ["строка 3: не заполнены ФИО, № зачётки или группа"])
+        assert not data.closed
+        assert bot.import_roster(data, 'roster.csv')[:2] == (0, 1)
+    assert execute("SELECT full_name, group_name FROM users WHERE student_id = %s", ('101',), fetch=True) == [
+        {'full_name': 'Иванов Иван', 'group_name': 'G1'}
+    ]
+
+
+def test_import_roster_from_xlsx(execute, tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Сидоров Сидор', '202', 'G2'])
+    path = tmp_path / 'roster.xlsx'
+    workbook.save(path)
+    with spooled(path.read_bytes(), max_size=1024 * 1024) as data:
+        assert bot.import_roster(data, 'roster.xlsx') == (1, 0, [])
@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def callback(user_id: int, data: str):
+    message = FakeMessage()
+    query = SimpleNamespace(data=data, message=message, from_user=SimpleNamespace(id=user_id))
+    update = SimpleNamespace(callback_query=query, effective_user=query.from_user, effective_message=message)
+    return update, message
+
+
+def add_application(execute, telegram_id: int):
+    execute("INSERT INTO sks_applications (user_id, photo_url) VALUES (%s, %s)", (telegram_id, 'photo'))
+
+
+# Поддельная кнопка входящих от не-админа ничего не решает
+def test_inbox_buttons_require_admin(execute):
+    execute("INSERT INTO users (telegram_id, full_name, role) VALUES (%s, %s, %s)", (5, 'Студент', 'student'))
+    add_application(execute, 5)
+    app_id = execute("SELECT id FROM sks_applications", fetch=True)[0]['id']
+    context = SimpleNamespace(user_data={'sks_inbox': {'page': 0, 'total': 1, 'apps': [(app_id, '1.')]},
+                                         'sks_selected': {app_id}})
+    update, message = callback(5, 'sksq_approve')
+    asyncio.run(bot.handle_sks_inbox_button(update, context))
+    assert message.replies == ["❌ У вас нет прав для выполнения этой команды."]
+    assert execute("SELECT status FROM sks_applications", fetch=True)[0]['status'] == 'pending'
+
+
+# Итог считает заявки, а не студентов
+def test_decision_counts_applications(execute):
+    for telegram_id in (5, 5, 6):
+        add_application(execute, telegram_id)
+    app_ids = [row['id'] for row in execute("SELECT id FROM sks_applications ORDER BY id", fetch=True)]
+    assert bot.apply_sks_decision(app_ids, approve=True) == (3, [5, 6])
+    assert bot.apply_sks_decision(app_ids, approve=True) == (0, [])
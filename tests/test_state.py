@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.ext import CommandHandler, ConversationHandler
+
+import bot
+
+
+# Обработчик в том виде, в каком он работает с persistence: Application.initialize
+# подменяет словарь состояний на TrackingDict и заполняет его из get_conversations
+def make_handler() -> ConversationHandler:
+    handler = ConversationHandler(
+        entry_points=[CommandHandler('start', bot.start)], states={}, fallbacks=[], name='main', persistent=True
+    )
+    persistence = SimpleNamespace(get_conversations=bot.DatabasePersistence(60).get_conversations)
+    asyncio.run(handler._initialize_persistence(SimpleNamespace(persistence=persistence)))
+    return handler
+
+
+# Бот опирается на приватный словарь состояний PTB: при обновлении PTB этот тест
+# должен падать раньше, чем сломается вытеснение
+def test_conversation_states_shape():
+    states = bot.conversation_states(make_handler())
+    states[(5, 5)] = 1
+    assert list(states.items()) == [((5, 5), 1)]
+    states.pop_accessed_write_items()
+    # Удаление видно PTB как завершение диалога — на этом держится update_conversation(..., None)
+    del states[(5, 5)]
+    assert states.pop_accessed_write_items() == [((5, 5), type(states).DELETED)]
+
+
+def test_sweeper_evicts_user_conversations(monkeypatch):
+    handler = make_handler()
+    dropped = []
+    application = SimpleNamespace(handlers={0: [handler]}, user_data={}, drop_user_data=dropped.append)
+    monkeypatch.setattr(bot, 'PERSISTENCE', None)
+    sweeper = bot.StateSweeper(idle_ttl=60, max_users=1, interval=60)
+    sweeper.application = application
+    states = bot.conversation_states(handler)
+    states.update({(5, 5): 1, (-100, 5): 2, (6, 6): 3})
+
+    sweeper.touch(5)
+    sweeper.touch(6)
+    assert dict(states) == {(6, 6): 3}
+    assert dropped == [5]
+    assert 'Состояний диалогов: 1' in sweeper.report()
+
+
+# Подгрузка из bot_state не считается изменением и не записывается обратно
+def test_load_user_restores_without_tracking(execute, monkeypatch):
+    handler = make_handler()
+    persistence = bot.DatabasePersistence(60)
+    persistence.write({(5, 5, 'main'): bot.pickle.dumps(3)})
+    monkeypatch.setattr(persistence, 'conversation_handlers', lambda: {'main': handler})
+
+    persistence.load_user(5, SimpleNamespace(user_data={}))
+    states = bot.conversation_states(handler)
+    assert dict(states) == {(5, 5): 3}
+    assert states.pop_accessed_write_items() == []
@@ -0,0 +1,101 @@
+import asyncio
+
+import bot
+from conftest import make_tenant
+
+
+# Данные тенантов не пересекаются: каждый видит только свои строки
+def test_tenants_see_own_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'DB_BACKEND', 'sqlite')
+    first, second = make_tenant('first', tmp_path), make_tenant('second', tmp_path)
+    for tenant, name in ((first, 'Иванов'), (second, 'Петров')):
+        token = bot.TENANT.set(tenant)
+        try:
+            bot.init_sqlite_schema()
+            connection = bot.get_db_connection()
+            cursor = connection.cursor()
+            cursor.execute("INSERT INTO users (telegram_id, full_name) VALUES (%s, %s)", (1, name))
+            connection.commit()
+            connection.close()
+        finally:
+            bot.TENANT.reset(token)
+
+    for tenant, name in ((first, 'Иванов'), (second, 'Петров')):
+        token = bot.TENANT.set(tenant)
+        try:
+            connection = bot.get_db_connection()
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("SELECT full_name FROM users")
+            assert cursor.fetchall() == [{'full_name': name}]
+            connection.close()
+        finally:
+            bot.TENANT.reset(token)
+
+
+class FakeConnection:
+    def __init__(self, log):
+        self.log = log
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.log.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    created = 0
+
+    def __init__(self, pool_name, pool_size, **settings):
+        FakePool.created += 1
+        self.log = []
+
+    def get_connection(self):
+        return FakeConnection(self.log)
+
+
+# На MySQL пул общий, а схема тенанта выбирается при каждой выдаче соединения
+def test_shared_pool_switches_schema(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot.pooling, 'MySQLConnectionPool', FakePool)
+    monkeypatch.setattr(bot, 'DB_POOL', None)
+    monkeypatch.setattr(bot, 'DB_POOL_SIZE', 2)
+    monkeypatch.setattr(bot, 'TENANTS', [make_tenant('first', tmp_path), make_tenant('second', tmp_path)])
+    FakePool.created = 0
+    for tenant in bot.TENANTS + bot.TENANTS[:1]:
+        tenant.db_name = f'faculty_{tenant.name}'
+        token = bot.TENANT.set(tenant)
+        try:
+            bot.primary_connect()
+        finally:
+            bot.TENANT.reset(token)
+
+    assert FakePool.created == 1
+    assert bot.DB_POOL.log == ["USE `faculty_first`", "USE `faculty_second`", "USE `faculty_first`"]
+
+
+# В цикле событий подключение не повторяется и не спит; повторы — в потоке через db_connection
+def test_connect_fails_fast_on_event_loop(monkeypatch):
+    attempts, sleeps = [], []
+
+    def unavailable():
+        attempts.append(1)
+        raise bot.Error(errno=2003, msg="Can't connect")
+
+    monkeypatch.setattr(bot, 'primary_connect', unavailable)
+    monkeypatch.setattr(bot, 'DB_BACKEND', 'mysql')
+    monkeypatch.setattr(bot, 'DB_RETRY_ATTEMPTS', 2)
+    monkeypatch.setattr(bot, 'DB_BREAKER', bot.CircuitBreaker(threshold=10, cooldown=60))
+    monkeypatch.setattr(bot.time, 'sleep', sleeps.append)
+
+    async def on_loop():
+        return bot.connect_primary()
+
+    assert asyncio.run(on_loop()) is None
+    assert (len(attempts), sleeps) == (1, [])
+
+    attempts.clear()
+    assert asyncio.run(bot.db_connection(primary=True)) is None
+    assert (len(attempts), len(sleeps)) == (3, 2)
@@ -0,0 +1,33 @@
+import asyncio
+
+import bot
+
+
+class SlowSender:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, method, chat_id, text, reply_markup):
+        await asyncio.sleep(0.05)
+        self.sent.append((chat_id, text))
+
+
+# Вопрос, заданный во время отправки дайджеста, уходит следующим окном, а не лежит до остановки
+def test_question_during_flush_is_delivered(tenant, monkeypatch):
+    sender = SlowSender()
+    monkeypatch.setattr(bot, 'BULK_SENDER', sender)
+
+    async def run():
+        notifier = bot.TutorNotifier(0.02)
+        notifier.resolve_tutors = lambda asker_id: [7]
+        notifier.enqueue(1, 10, "Первый")
+        await asyncio.sleep(0.04)
+        notifier.enqueue(2, 11, "Второй")
+        await asyncio.sleep(0.3)
+        return notifier
+
+    notifier = asyncio.run(run())
+    assert [text for _, text in sender.sent] == [
+        "Новый вопрос от студента:\n\nПервый", "Новый вопрос от студента:\n\nВторой"
+    ]
+    assert notifier.flush_task.done() and not notifier.buffer
@@ -3,4 +3,20 @@ cd /root/ipmkn_bot
 git pull
 source venv/bin/activate
 pip install -r requirements.txt
-sudo systemctl restart ipmknbot
\ No newline at end of file
+# Старый процесс по SIGTERM сохраняет рассылки и дописывает состояние (DRAIN_TIMEOUT)
+sudo systemctl restart ipmknbot
+
+# Ждём, пока новый процесс прогреет кэши и пул соединений
+HEALTH_PORT=${HEALTH_PORT:-8089}
+for i in $(seq 1 60); do
+    if curl -fsS "http://127.0.0.1:${HEALTH_PORT}/readyz" > /dev/null 2>&1; then
+        echo "Бот готов"
+        exit 0
+    fi
+    sleep 1
+done
+echo "Бот не перешёл в готовность за 60 секунд:"
+curl -sS "http://127.0.0.1:${HEALTH_PORT}/readyz"
+echo
+sudo systemctl status ipmknbot --no-pager
+exit 1